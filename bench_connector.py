@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks StreakConnection method families against mock_streak_server.py running in a subprocess
+Measures throughput, p50/p99 latency and peak Python memory (tracemalloc, in a separate untimed pass)
+of every benchmark at every data size and prints them as JSON, so results of two releases can be diffed
+
+    python bench_connector.py --sizes 100 1000 10000 --latency 0.005 --output bench_output.txt
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from mock_streak_server import MOCK_API_KEY
+from streak_crm_python import StreakConnection, StreakError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class MockServerProcess:
+    """
+    Runs mock_streak_server.py in its own process, so its memory and CPU do not skew measurements
+    """
+
+    def __init__(self, boxes, fields=10, latency=0.0, value_size=16):
+        self.port = free_port()
+        self.args = [sys.executable, os.path.join(HERE, 'mock_streak_server.py'), '--port', str(self.port),
+                     '--boxes', str(boxes), '--fields', str(fields), '--latency', str(latency),
+                     '--value-size', str(value_size)]
+        self.process = None
+
+    @property
+    def api_endpoint(self):
+        return 'http://127.0.0.1:%s/api/v1/' % self.port
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.args, stdout=subprocess.DEVNULL)
+        started = time.monotonic()
+        while time.monotonic() - started < 60:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.process.kill()
+        raise RuntimeError('Mock server did not start')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.process.terminate()
+        self.process.wait()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(name, size, calls):
+    """
+    Runs calls (iterable of zero-argument callables) one by one, twice: a timed pass, then a pass under
+    tracemalloc for peak memory, since tracing every allocation slows down exactly the code being timed
+    :return: dict with throughput, latency percentiles and peak memory
+    """
+    calls = list(calls)
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for call in calls:
+        call_started = time.perf_counter()
+        try:
+            call()
+        except StreakError:
+            errors += 1
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for call in calls:
+        try:
+            call()
+        except StreakError:
+            pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        'benchmark': name,
+        'size': size,
+        'calls': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'calls_per_second': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'peak_memory_kb': peak // 1024,
+    }
+
+
+def run_size(size, latency, calls, max_workers):
+    """
+    Benchmarks every method family against a pipeline of size boxes
+    :return: list of result dicts
+    """
+    results = []
+    with MockServerProcess(size, latency=latency) as server:
+        with StreakConnection(MOCK_API_KEY, api_endpoint=server.api_endpoint,
+                              pool_maxsize=max_workers) as streak:
+            pipeline_key = streak.pipeline_get_all()[0].pipelineKey
+            box_keys = [box.boxKey for box in streak.box_get_all_in_pipeline(pipeline_key)]
+            field_key = streak.field_get_all_in_pipeline(pipeline_key)[0].key
+            sample = box_keys[:calls]
+
+            results.append(measure('box_get_all_in_pipeline', size, [
+                lambda: streak.box_get_all_in_pipeline(pipeline_key)
+            ] * 3))
+            results.append(measure('iter_boxes_in_pipeline', size, [
+                lambda: sum(1 for _ in streak.iter_boxes_in_pipeline(pipeline_key))
+            ] * 3))
+            results.append(measure('pipeline_get', size, [
+                lambda: streak.pipeline_get(pipeline_key)
+            ] * calls))
+            results.append(measure('box_get', size, [
+                lambda box_key=box_key: streak.box_get(box_key) for box_key in sample
+            ]))
+            results.append(measure('value_get_all_in_box', size, [
+                lambda box_key=box_key: streak.value_get_all_in_box(box_key) for box_key in sample
+            ]))
+            results.append(measure('value_get_all_in_boxes', size, [
+                lambda: streak.value_get_all_in_boxes(sample, max_workers=max_workers)
+            ]))
+            results.append(measure('box_create', size, [
+                lambda number=number: streak.box_create(pipeline_key, {'name': 'bench box %s' % number})
+                for number in range(calls)
+            ]))
+            results.append(measure('box_edit', size, [
+                lambda box_key=box_key: streak.box_edit(box_key, {'notes': 'benchmarked'}) for box_key in sample
+            ]))
+            results.append(measure('value_edit_in_box', size, [
+                lambda box_key=box_key: streak.value_edit_in_box(box_key, field_key, {'value': 'benchmarked'})
+                for box_key in sample
+            ]))
+    return results
+
+
+def run(sizes=(100, 1000, 10000), latency=0.0, calls=50, max_workers=8):
+    """
+    :return: dict with environment description and list of results
+    """
+    results = []
+    for size in sizes:
+        results.extend(run_size(size, latency, calls, max_workers))
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency': latency,
+        'calls': calls,
+        'max_workers': max_workers,
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark StreakConnection against a local mock server')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='boxes in pipeline')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the mock adds to every response')
+    parser.add_argument('--calls', type=int, default=50, help='calls per single-object benchmark')
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--output', help='write JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.latency, args.calls, args.max_workers)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of JsonCodec backends on box payloads shaped like Streak api responses
+
+    python bench_json.py --boxes 5000 --fields 20 --repeat 5
+"""
+
+import argparse
+import json
+import random
+import string
+import time
+
+from streak_crm_python import JsonCodec, orjson
+
+
+def random_text(rnd, length):
+    return ''.join(rnd.choice(string.ascii_letters + ' ') for _ in range(length))
+
+
+def make_box(rnd, number, pipeline_key, fields):
+    box_key = ''.join(rnd.choice(string.ascii_letters + string.digits) for _ in range(80))
+    return {
+        'pipelineKey': pipeline_key,
+        'creatorKey': 'agxzfm1haWxmb29nYWVyMQsSDE9yZ2FuaXphdGlvbiIObWVkcGVyZXZvZC5jb20MCxIEVXNlchiAgIDQ98eFCgw',
+        'name': 'Lead #%s %s' % (number, random_text(rnd, 12)),
+        'notes': random_text(rnd, rnd.randint(0, 400)),
+        'stageKey': str(5001 + rnd.randint(0, 5)),
+        'creationTimestamp': 1500000000000 + number,
+        'lastUpdatedTimestamp': 1500000000000 + number * 7,
+        'lastStageChangeTimestamp': 1500000000000 + number * 3,
+        'totalNumberOfEmails': rnd.randint(0, 50),
+        'totalNumberOfSentEmails': rnd.randint(0, 20),
+        'totalNumberOfReceivedEmails': rnd.randint(0, 30),
+        'followerKeys': [],
+        'assignedToSharingEntries': [{'email': 'robot@example.com', 'fullName': 'Robot'}],
+        'fields': {field_key: random_text(rnd, 24) if rnd.random() > 0.2 else rnd.randint(0, 10 ** 6)
+                   for field_key in fields},
+        'freshness': rnd.random(),
+        'boxKey': box_key,
+        'key': box_key,
+    }
+
+
+def make_payload(boxes, fields, seed=0):
+    rnd = random.Random(seed)
+    pipeline_key = ''.join(rnd.choice(string.ascii_letters) for _ in range(80))
+    field_keys = [str(1001 + number) for number in range(fields)]
+    return [make_box(rnd, number, pipeline_key, field_keys) for number in range(boxes)]
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(boxes=2000, fields=20, repeat=5):
+    """
+    :return: dict with payload size and a list of timings, one per backend and operation
+    """
+    payload = make_payload(boxes, fields)
+    body = json.dumps(payload).encode('utf-8')
+    post_body = payload[0]['fields']
+    results = []
+
+    # decoding the way StreakConnection did before codecs: bytes -> str -> stdlib parser
+    seconds = best_of(lambda: json.loads(body.decode('utf-8')), repeat)
+    results.append({'backend': 'json', 'operation': 'loads(text)', 'seconds': seconds})
+
+    backends = ['json'] + (['orjson'] if orjson is not None else [])
+    for backend in backends:
+        codec = JsonCodec(backend)
+        seconds = best_of(lambda: codec.loads(body), repeat)
+        results.append({'backend': backend, 'operation': 'loads(bytes)', 'seconds': seconds})
+        seconds = best_of(lambda: codec.dumps(payload), repeat)
+        results.append({'backend': backend, 'operation': 'dumps(boxes)', 'seconds': seconds})
+        seconds = best_of(lambda: [codec.dumps(post_body) for _ in range(1000)], repeat)
+        results.append({'backend': backend, 'operation': 'dumps(post) x1000', 'seconds': seconds})
+
+    for result in results:
+        result['seconds'] = round(result['seconds'], 6)
+    return {'boxes': boxes, 'fields': fields, 'payload_bytes': len(body), 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare JsonCodec backends on box payloads')
+    parser.add_argument('--boxes', type=int, default=2000)
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print machine readable results')
+    args = parser.parse_args()
+
+    report = run(args.boxes, args.fields, args.repeat)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print('%s boxes, %s fields, %s bytes' % (report['boxes'], report['fields'], report['payload_bytes']))
+        for result in report['results']:
+            print('%-8s %-18s %10.2f ms' % (result['backend'], result['operation'], result['seconds'] * 1000))
@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Streak api, for offline tests and benchmarks of StreakConnection
+
+    python mock_streak_server.py --port 8765 --boxes 10000 --latency 0.05
+"""
+
+import argparse
+import json
+import random
+import re
+import string
+import sys
+import threading
+import time
+from base64 import b64decode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+MOCK_API_KEY = 'mock-api-key'
+
+
+class MockStreakData:
+    """
+    In-memory Streak org: users, pipelines with stages and fields, boxes with field values
+    """
+
+    def __init__(self, pipelines=1, boxes_per_pipeline=10, fields_per_pipeline=3, stages_per_pipeline=3,
+                 value_size=16, seed=0):
+        self.lock = threading.RLock()
+        self.random = random.Random(seed)
+        self.clock = 1500000000000
+        self.user = {
+            'userKey': 'mock-user-key',
+            'email': 'robot@example.com',
+            'displayName': 'Mock Robot',
+            'orgKey': 'mock-org-key',
+            'creationTimestamp': self.clock,
+            'lastUpdatedTimestamp': self.clock,
+        }
+        self.pipelines = {}
+        self.boxes = {}
+        self.ignore_paging = False
+        self.value_size = value_size
+        for pipeline_number in range(pipelines):
+            pipeline = self.create_pipeline({
+                'name': 'pipeline %s' % pipeline_number,
+                'description': 'mock pipeline',
+                'fieldNames': ', '.join('field %s' % n for n in range(fields_per_pipeline)),
+                'fieldTypes': ', '.join('TEXT_INPUT' for _ in range(fields_per_pipeline)),
+                'stageNames': ', '.join('stage %s' % n for n in range(stages_per_pipeline)),
+            })
+            for box_number in range(boxes_per_pipeline):
+                box = self.create_box(pipeline['pipelineKey'], {'name': 'box %s' % box_number, 'notes': 'notes'})
+                for field in pipeline['fields']:
+                    box['fields'][field['key']] = self.random_value()
+
+    def tick(self):
+        self.clock += 1
+        return self.clock
+
+    def next_key(self):
+        return ''.join(self.random.choices(string.ascii_letters + string.digits, k=24))
+
+    def random_value(self):
+        return ''.join(self.random.choices(string.ascii_lowercase, k=self.value_size))
+
+    def create_pipeline(self, params):
+        if 'name' not in params:
+            raise MockError('Insufficient params for Pipeline')
+        key = self.next_key()
+        pipeline = {
+            'pipelineKey': key,
+            'key': key,
+            'name': params['name'],
+            'description': params.get('description', ''),
+            'orgWide': params.get('orgWide') in (True, 'true', 'True'),
+            'creatorKey': self.user['userKey'],
+            'creationTimestamp': self.tick(),
+            'lastUpdatedTimestamp': self.clock,
+            'stageOrder': [],
+            'stages': {},
+            'fields': [],
+        }
+        self.pipelines[key] = pipeline
+        names = [name.strip() for name in params.get('fieldNames', '').split(',') if name.strip()]
+        types = [kind.strip() for kind in params.get('fieldTypes', '').split(',') if kind.strip()]
+        for name, kind in zip(names, types):
+            self.create_field(key, {'name': name, 'type': kind})
+        for name in [name.strip() for name in params.get('stageNames', '').split(',') if name.strip()]:
+            self.create_stage(key, {'name': name})
+        return pipeline
+
+    def create_stage(self, pipeline_key, params):
+        pipeline = self.get_pipeline(pipeline_key)
+        key = str(5001 + len(pipeline['stages']))
+        stage = {'key': key, 'name': params.get('name', ''), 'pipelineKey': pipeline_key,
+                 'backgroundColor': '#ffffff'}
+        pipeline['stages'][key] = stage
+        pipeline['stageOrder'].append(key)
+        return stage
+
+    def create_field(self, pipeline_key, params):
+        pipeline = self.get_pipeline(pipeline_key)
+        key = str(1001 + len(pipeline['fields']))
+        field = {'key': key, 'name': params.get('name', ''), 'type': params.get('type', 'TEXT_INPUT'),
+                 'lastUpdatedTimestamp': self.tick()}
+        pipeline['fields'].append(field)
+        return field
+
+    def create_box(self, pipeline_key, params):
+        pipeline = self.get_pipeline(pipeline_key)
+        key = self.next_key()
+        box = {
+            'boxKey': key,
+            'key': key,
+            'pipelineKey': pipeline_key,
+            'name': params.get('name', ''),
+            'notes': params.get('notes', ''),
+            'stageKey': params.get('stageKey') or (pipeline['stageOrder'] or [None])[0],
+            'creatorKey': self.user['userKey'],
+            'creationTimestamp': self.tick(),
+            'lastUpdatedTimestamp': self.clock,
+            'assignedToSharingEntries': [],
+            'fields': {},
+        }
+        self.boxes[key] = box
+        return box
+
+    def get_pipeline(self, pipeline_key):
+        if pipeline_key not in self.pipelines:
+            raise MockError('Illegal Argument Exception in GetEntities, usually a key issue')
+        return self.pipelines[pipeline_key]
+
+    def get_box(self, box_key):
+        if box_key not in self.boxes:
+            raise MockError('Illegal Argument Exception in GetEntities, usually a key issue')
+        return self.boxes[box_key]
+
+    def get_stage(self, pipeline_key, stage_key):
+        stages = self.get_pipeline(pipeline_key)['stages']
+        if stage_key not in stages:
+            raise MockError('Illegal Argument Exception in GetEntities, usually a key issue')
+        return stages[stage_key]
+
+    def get_field(self, pipeline_key, field_key):
+        for field in self.get_pipeline(pipeline_key)['fields']:
+            if field['key'] == field_key:
+                return field
+        raise MockError('Illegal Argument Exception in GetEntities, usually a key issue')
+
+    def box_values(self, box):
+        fields = self.get_pipeline(box['pipelineKey'])['fields']
+        return [{'key': field['key'], 'value': box['fields'].get(field['key'], '')} for field in fields]
+
+
+class MockError(Exception):
+    pass
+
+
+class MockStreakHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body leave in one packet, otherwise delayed ACK adds ~40 ms to every keep-alive response
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    routes = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def read_params(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if not body:
+            return {}
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(body)
+        return {key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def dispatch(self, method):
+        server = self.server
+        params = self.read_params()
+        with server.stats_lock:
+            server.request_count += 1
+            server.request_log.append((method, self.path))
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttle_next > 0:
+            with server.stats_lock:
+                server.throttle_next -= 1
+            return self.send_json(429, {'success': False, 'error': 'rate limited'},
+                                  {'Retry-After': str(server.retry_after)})
+        if server.fail_next > 0:
+            with server.stats_lock:
+                server.fail_next -= 1
+            return self.send_json(503, {'success': False, 'error': 'backend unavailable'})
+        if not self.authorized():
+            return self.send_json(400, {'success': False, 'error': 'invalid api key'})
+        url = urlsplit(self.path)
+        path = url.path[len(server.prefix):] if url.path.startswith(server.prefix) else url.path
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                try:
+                    with server.data.lock:
+                        result = handler(server.data, params, query, *match.groups())
+                except MockError as error:
+                    return self.send_json(400, {'success': False, 'error': str(error)})
+                return self.send_json(200, result)
+        return self.send_json(404, {'success': False, 'error': 'no route for %s %s' % (method, path)})
+
+    def authorized(self):
+        header = self.headers.get('Authorization', '')
+        if not header.startswith('Basic '):
+            return False
+        api_key = b64decode(header[6:]).decode('utf-8').split(':')[0]
+        return api_key in self.server.api_keys
+
+
+def route(method, pattern):
+    def decorator(func):
+        MockStreakHandler.routes.append((method, re.compile('^' + pattern + '$'), func))
+        return func
+
+    return decorator
+
+
+def paged(data, items, query):
+    # data.ignore_paging mimics an endpoint that returns the whole list whatever page/limit say
+    if 'limit' not in query or data.ignore_paging:
+        return items
+    limit = int(query['limit'])
+    page = int(query.get('page', 0))
+    return items[page * limit:(page + 1) * limit]
+
+
+@route('GET', 'users/me')
+def user_get_me(data, params, query):
+    return data.user
+
+
+@route('GET', 'users/([^/]+)')
+def user_get(data, params, query, user_key):
+    if user_key != data.user['userKey']:
+        raise MockError('Illegal Argument Exception in GetEntities, usually a key issue')
+    return data.user
+
+
+@route('GET', 'pipelines/?')
+def pipeline_get_all(data, params, query):
+    return list(data.pipelines.values())
+
+
+@route('PUT', 'pipelines/?')
+def pipeline_create(data, params, query):
+    return data.create_pipeline(params)
+
+
+@route('GET', 'pipelines/([^/]+)')
+def pipeline_get(data, params, query, pipeline_key):
+    return data.get_pipeline(pipeline_key)
+
+
+@route('POST', 'pipelines/([^/]+)')
+def pipeline_edit(data, params, query, pipeline_key):
+    if pipeline_key not in data.pipelines:
+        raise MockError('existing entity does not exist')
+    pipeline = data.pipelines[pipeline_key]
+    pipeline.update({key: value for key, value in params.items() if key in ('name', 'description', 'orgWide')})
+    pipeline['lastUpdatedTimestamp'] = data.tick()
+    return pipeline
+
+
+@route('DELETE', 'pipelines/([^/]+)')
+def pipeline_delete(data, params, query, pipeline_key):
+    if pipeline_key not in data.pipelines:
+        return {'success': False}
+    del data.pipelines[pipeline_key]
+    for box_key in [key for key, box in data.boxes.items() if box['pipelineKey'] == pipeline_key]:
+        del data.boxes[box_key]
+    return {'success': True}
+
+
+@route('GET', 'boxes/?')
+def box_get_all(data, params, query):
+    return paged(data, list(data.boxes.values()), query)
+
+
+@route('GET', 'pipelines/([^/]+)/boxes')
+def box_get_all_in_pipeline(data, params, query, pipeline_key):
+    data.get_pipeline(pipeline_key)
+    return paged(data, [box for box in data.boxes.values() if box['pipelineKey'] == pipeline_key], query)
+
+
+@route('PUT', 'pipelines/([^/]+)/boxes')
+def box_create(data, params, query, pipeline_key):
+    return data.create_box(pipeline_key, params)
+
+
+@route('GET', 'boxes/([^/]+)')
+def box_get(data, params, query, box_key):
+    return data.get_box(box_key)
+
+
+@route('POST', 'boxes/([^/]+)')
+def box_edit(data, params, query, box_key):
+    if box_key not in data.boxes:
+        raise MockError('existing entity does not exist')
+    box = data.boxes[box_key]
+    box.update({key: value for key, value in params.items() if key in ('name', 'notes', 'stageKey')})
+    box['lastUpdatedTimestamp'] = data.tick()
+    return box
+
+
+@route('DELETE', 'boxes/([^/]+)')
+def box_delete(data, params, query, box_key):
+    if box_key not in data.boxes:
+        return {'success': False}
+    del data.boxes[box_key]
+    return {'success': True}
+
+
+@route('GET', 'pipelines/([^/]+)/stages')
+def stage_get_all_in_pipeline(data, params, query, pipeline_key):
+    return data.get_pipeline(pipeline_key)['stages']
+
+
+@route('PUT', 'pipelines/([^/]+)/stages')
+def stage_create_in_pipeline(data, params, query, pipeline_key):
+    return data.create_stage(pipeline_key, params)
+
+
+@route('GET', 'pipelines/([^/]+)/stages/([^/]+)')
+def stage_get_specific_in_pipeline(data, params, query, pipeline_key, stage_key):
+    return data.get_stage(pipeline_key, stage_key)
+
+
+@route('POST', 'pipelines/([^/]+)/stages/([^/]+)')
+def stage_edit_in_pipeline(data, params, query, pipeline_key, stage_key):
+    stage = data.get_stage(pipeline_key, stage_key)
+    stage.update({key: value for key, value in params.items() if key in ('name', 'backgroundColor')})
+    return stage
+
+
+@route('DELETE', 'pipelines/([^/]+)/stages/([^/]+)')
+def stage_delete_in_pipeline(data, params, query, pipeline_key, stage_key):
+    pipeline = data.pipelines.get(pipeline_key)
+    if not pipeline or stage_key not in pipeline['stages']:
+        return {'success': False}
+    del pipeline['stages'][stage_key]
+    pipeline['stageOrder'].remove(stage_key)
+    return {'success': True}
+
+
+@route('GET', 'pipelines/([^/]+)/fields')
+def field_get_all_in_pipeline(data, params, query, pipeline_key):
+    return data.get_pipeline(pipeline_key)['fields']
+
+
+@route('PUT', 'pipelines/([^/]+)/fields')
+def field_create_in_pipeline(data, params, query, pipeline_key):
+    return data.create_field(pipeline_key, params)
+
+
+@route('GET', 'pipelines/([^/]+)/fields/([^/]+)')
+def field_get_specific_in_pipeline(data, params, query, pipeline_key, field_key):
+    return data.get_field(pipeline_key, field_key)
+
+
+@route('POST', 'pipelines/([^/]+)/fields/([^/]+)')
+def field_edit_in_pipeline(data, params, query, pipeline_key, field_key):
+    field = data.get_field(pipeline_key, field_key)
+    field.update({key: value for key, value in params.items() if key in ('name',)})
+    field['lastUpdatedTimestamp'] = data.tick()
+    return field
+
+
+@route('DELETE', 'pipelines/([^/]+)/fields/([^/]+)')
+def field_delete_in_pipeline(data, params, query, pipeline_key, field_key):
+    pipeline = data.pipelines.get(pipeline_key)
+    fields = [field for field in (pipeline or {}).get('fields', []) if field['key'] != field_key]
+    if not pipeline or len(fields) == len(pipeline['fields']):
+        return {'success': False}
+    pipeline['fields'] = fields
+    return {'success': True}
+
+
+@route('GET', 'boxes/([^/]+)/fields')
+def value_get_all_in_box(data, params, query, box_key):
+    return data.box_values(data.get_box(box_key))
+
+
+@route('GET', 'boxes/([^/]+)/fields/([^/]+)')
+def value_get_specific_in_box(data, params, query, box_key, field_key):
+    box = data.get_box(box_key)
+    data.get_field(box['pipelineKey'], field_key)
+    return {'key': field_key, 'value': box['fields'].get(field_key, '')}
+
+
+@route('POST', 'boxes/([^/]+)/fields/([^/]+)')
+def value_edit_in_box(data, params, query, box_key, field_key):
+    box = data.get_box(box_key)
+    data.get_field(box['pipelineKey'], field_key)
+    box['fields'][field_key] = params.get('value', '')
+    box['lastUpdatedTimestamp'] = data.tick()
+    return {'key': field_key, 'value': box['fields'][field_key]}
+
+
+class MockStreakServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Streak API, serves MockStreakData over http on localhost
+    # >>> with MockStreakServer(boxes_per_pipeline=100, latency=0.01) as server:
+    # ...     streak = StreakConnection(MOCK_API_KEY, api_endpoint=server.api_endpoint)
+    """
+    daemon_threads = True
+    prefix = '/api/v1/'
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, api_keys=(MOCK_API_KEY,), retry_after=0, **data):
+        super().__init__((host, port), MockStreakHandler)
+        self.data = MockStreakData(**data)
+        self.latency = latency
+        self.api_keys = set(api_keys)
+        self.retry_after = retry_after
+        self.throttle_next = 0
+        self.fail_next = 0
+        self.stats_lock = threading.Lock()
+        self.request_count = 0
+        self.request_log = []
+        self.thread = None
+
+    @property
+    def api_endpoint(self):
+        return 'http://%s:%s%s' % (self.server_address[0], self.server_address[1], self.prefix)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # clients that gave up on a slow response (timeouts, deadlines) are expected
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local mock of the Streak API')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--pipelines', type=int, default=1)
+    parser.add_argument('--boxes', type=int, default=100, help='boxes per pipeline')
+    parser.add_argument('--fields', type=int, default=5, help='fields per pipeline')
+    parser.add_argument('--value-size', type=int, default=16, help='length of generated field values')
+    args = parser.parse_args()
+    server = MockStreakServer(port=args.port, latency=args.latency, pipelines=args.pipelines,
+                              boxes_per_pipeline=args.boxes, fields_per_pipeline=args.fields,
+                              value_size=args.value_size)
+    print('Serving mock Streak API at %s (api key: %s)' % (server.api_endpoint, MOCK_API_KEY))
+    server.serve_forever()
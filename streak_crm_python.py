@@ -1,16 +1,147 @@
 # -*- coding: utf-8 -*-
 
+import argparse
+import asyncio
+import bisect
+import codecs
+import contextlib
+import copy
+import datetime
+import email.utils
+import functools
+import gzip
+import io
+import itertools
 import json
+import logging
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from requests.structures import CaseInsensitiveDict
 
 try:
     from keys import TEST_API_KEY
 except:
     TEST_API_KEY = 'YOU_API_KEY_HERE'
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('streak_crm_python')
+
+
+class StreakError(Exception):
+    """
+    Base of all errors raised by StreakConnection
+    """
+
+
+class StreakAPIError(StreakError):
+    """
+    Streak api refused the request, e.g. answered {'success': false, 'error': ...}
+    """
+
+
+class StreakHTTPError(StreakError):
+    """
+    Server error or response that is not JSON, raised after retries are exhausted
+    """
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+        self.status_code = response.status_code if response is not None else None
+
+
+class StreakRateLimitError(StreakHTTPError):
+    """
+    Request was still answered with 429 after max_throttle_retries retries
+    """
+
+
+class StreakTimeoutError(StreakError):
+    """
+    Request timed out or the deadline of the operation passed
+    """
+
+
+class StreakConnectionError(StreakError):
+    """
+    Server could not be reached
+    """
+
+
+class StreakCassetteMiss(StreakError):
+    """
+    Replaying Cassette has no recorded response for the request
+    """
+
+
+class JsonCodec:
+    """
+    Decodes response bodies straight from bytes and encodes request bodies to bytes
+    Backends: 'json' (stdlib), 'orjson' (optional, much faster) and 'auto', which picks orjson if it is installed
+    # >>> codec = JsonCodec('auto')
+    # >>> codec.loads(b'{"name": "box"}')
+    # {'name': 'box'}
+    """
+    backends = ('auto', 'json', 'orjson')
+
+    def __init__(self, backend='auto'):
+        if backend not in self.backends:
+            raise Exception('[!] Unknown JSON backend %r, choose one of %s' % (backend, ', '.join(self.backends)))
+        if backend == 'orjson' and orjson is None:
+            raise Exception('[!] orjson JSON backend requested, but orjson is not installed')
+        if backend == 'auto':
+            backend = 'orjson' if orjson is not None else 'json'
+        self.backend = backend
+
+    def __repr__(self):
+        return '<JSON Codec: \'%s\'>' % self.backend
+
+    def loads(self, data: bytes):
+        """
+        :param data: bytes or str
+        :return: decoded object
+        """
+        if self.backend == 'orjson':
+            return orjson.loads(data)
+        return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        """
+        :param obj: object
+        :return: UTF-8 encoded JSON
+        """
+        if self.backend == 'orjson':
+            try:
+                return orjson.dumps(obj)
+            except TypeError:
+                # orjson refuses what stdlib accepts, e.g. non-str dict keys and ints over 64 bit
+                pass
+        return json.dumps(obj).encode('utf-8')
+
 
 def flush_attributes(obj):
+    """
+    Removes all server data from obj, keeping its streak_connection
+    :param obj: StreakObject or plain object
+    :return: obj flushed
+    """
+    if isinstance(obj, StreakObject):
+        obj.__dict__ = {}
+        return obj
     tmp = obj.__dict__['streak_connection']
     obj.__dict__ = {}
     setattr(obj, 'streak_connection', tmp)
@@ -27,44 +158,1420 @@ def add_attributes(attr_dict: dict, obj: object):
     :param obj: object
     :return: obj updated
     """
+    if isinstance(obj, StreakObject):
+        return obj.load(attr_dict)
     for key, value in attr_dict.items():
         setattr(obj, key, value)
     return obj
 
 
+class Shape:
+    """
+    Attribute layout shared by all StreakObjects that were loaded from dicts with the same keys
+    Holds key -> index of the value in the object's values list, and indexes of values worth interning
+    """
+    __slots__ = ('keys', 'index', 'intern_indexes', 'transitions')
+
+    # values repeated across many objects, e.g. every box of a pipeline carries the same pipelineKey
+    interned_values = frozenset(['pipelineKey', 'stageKey', 'creatorKey', 'orgKey', 'userKey', 'key', 'type'])
+    shapes = {}
+
+    def __init__(self, keys: tuple):
+        self.keys = keys
+        self.index = {key: number for number, key in enumerate(keys)}
+        self.intern_indexes = tuple(number for number, key in enumerate(keys) if key in self.interned_values)
+        self.transitions = {}
+
+    def __repr__(self):
+        return '<Shape: %s>' % ', '.join(self.keys)
+
+    @classmethod
+    def get(cls, keys: tuple):
+        shape = cls.shapes.get(keys)
+        if shape is None:
+            keys = tuple(sys.intern(key) for key in keys)
+            shape = cls.shapes.setdefault(keys, Shape(keys))
+        return shape
+
+    def with_key(self, key: str):
+        """
+        :return: Shape of an object with this shape after key was added to it
+        """
+        shape = self.transitions.get(key)
+        if shape is None:
+            shape = self.transitions.setdefault(key, Shape.get(self.keys + (key,)))
+        return shape
+
+
+class StreakObject:
+    """
+    Base of models built from api responses
+    Server data is not copied into per-object __dict__: the object keeps a Shape shared with other objects
+    of the same layout and a plain list of values, attributes are looked up in them on access.
+    Values of keys listed in Shape.interned_values are interned, so repeated keys are stored once.
+    Attribute access (box.name, box.boxKey), assignment and __dict__ work like on a plain object.
+    Related objects (box.stage, box.values...) are loaded on first access and kept in _related.
+    """
+    __slots__ = ('streak_connection', '_shape', '_values', '_related')
+    _defaults = {}
+
+    def __init__(self, streak_connection):
+        object.__setattr__(self, 'streak_connection', streak_connection)
+        object.__setattr__(self, '_shape', EMPTY_SHAPE)
+        object.__setattr__(self, '_values', [])
+        object.__setattr__(self, '_related', None)
+
+    def load(self, attr_dict: dict):
+        """
+        Sets keys:values of attr_dict as attributes of self
+        :param attr_dict: dict with attrs
+        :return: self
+        """
+        if self._values:
+            for key, value in attr_dict.items():
+                setattr(self, key, value)
+            return self
+
+        keys = tuple(attr_dict)
+        shape = Shape.shapes.get(keys) or Shape.get(keys)
+        values = list(attr_dict.values())
+        for number in shape.intern_indexes:
+            value = values[number]
+            if type(value) is str:
+                values[number] = sys.intern(value)
+        object.__setattr__(self, '_shape', shape)
+        object.__setattr__(self, '_values', values)
+        return self
+
+    def __getattr__(self, name):
+        # called only when regular lookup failed, i.e. name is not a set slot, method or property
+        if name == '_shape' or name == '_values' or name == '_related':
+            raise AttributeError(name)
+        try:
+            return self._values[self._shape.index[name]]
+        except KeyError:
+            pass
+        try:
+            return self._defaults[name]
+        except KeyError:
+            raise AttributeError('%r object has no attribute %r' % (type(self).__name__, name)) from None
+
+    def __setattr__(self, name, value):
+        if hasattr(type(self), name):
+            object.__setattr__(self, name, value)
+            return
+        number = self._shape.index.get(name)
+        if number is None:
+            self._shape = self._shape.with_key(name)
+            self._values.append(value)
+        else:
+            self._values[number] = value
+
+    def __delattr__(self, name):
+        if hasattr(type(self), name):
+            object.__delattr__(self, name)
+            return
+        if name not in self._shape.index:
+            raise AttributeError(name)
+        attributes = dict(zip(self._shape.keys, self._values))
+        del attributes[name]
+        self._shape = EMPTY_SHAPE
+        self._values = []
+        self.load(attributes)
+
+    def __dir__(self):
+        return sorted(set(object.__dir__(self)) | set(self._shape.keys) | set(self._defaults))
+
+    @property
+    def __dict__(self):
+        """
+        Snapshot dict of all attributes, changing it does not change the object
+        """
+        attributes = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if not name.startswith('_') and hasattr(self, name):
+                    attributes[name] = getattr(self, name)
+        attributes.update(self._defaults)
+        attributes.update(zip(self._shape.keys, self._values))
+        return attributes
+
+    def attributes(self):
+        """
+        :return: new dict of the attributes loaded from the api or set on the object, without defaults
+        """
+        return dict(zip(self._shape.keys, self._values))
+
+    @__dict__.setter
+    def __dict__(self, attributes):
+        self._shape = EMPTY_SHAPE
+        self._values = []
+        self._related = None
+        self.load(attributes)
+
+    def __getstate__(self):
+        """
+        State for copy and pickle: own values list, cached related objects are not carried over
+        """
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        state['_values'] = list(self._values)
+        state['_related'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def __copy__(self):
+        obj = type(self).__new__(type(self))
+        obj.__setstate__(self.__getstate__())
+        return obj
+
+    def __deepcopy__(self, memo):
+        # the copy stays bound to the same connection, only data is copied
+        obj = type(self).__new__(type(self))
+        memo[id(self)] = obj
+        state = self.__getstate__()
+        streak_connection = state.pop('streak_connection', None)
+        state = copy.deepcopy(state, memo)
+        state['streak_connection'] = streak_connection
+        obj.__setstate__(state)
+        return obj
+
+    def related(self, name: str, load):
+        """
+        :param name: relationship name
+        :param load: callable returning related object(s), called only if name is not cached yet
+        :return: cached related object(s)
+        """
+        if self._related is None:
+            self._related = {}
+        if name not in self._related:
+            self._related[name] = load()
+        return self._related[name]
+
+    def is_related_loaded(self, name: str):
+        return self._related is not None and name in self._related
+
+    def set_related(self, name: str, value):
+        if self._related is None:
+            self._related = {}
+        self._related[name] = value
+
+    def forget_related(self):
+        """
+        Drops cached related objects, they are loaded again on next access
+        """
+        self._related = None
+
+
+EMPTY_SHAPE = Shape.get(())
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally parses JSON array from iterable of bytes chunks, yields its elements as soon as they are complete
+    If the document is not an array (api error response), raises Exception with its error
+    # >>> list(iter_json_array([b'[{"a": 1}, {"b"', b': 2}]']))
+    # [{'a': 1}, {'b': 2}]
+    :param chunks: iterable of bytes
+    :return: generator of decoded elements
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    started = False
+    finished = False
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    rest = buffer[position:] + ''.join(text_decoder.decode(chunk) for chunk in chunks)
+                    document = json.loads(rest + text_decoder.decode(b'', final=True))
+                    if isinstance(document, dict) and 'error' in document:
+                        raise StreakAPIError(document['error'])
+                    raise StreakAPIError('Expected JSON array, got %s' % type(document).__name__)
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == ']':
+                return
+
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                end = None
+            # element ending right at the buffer end may be a number cut in half, wait for more data
+            if end is not None and (end < len(buffer) or finished):
+                position = end
+                yield element
+                continue
+
+        if finished:
+            raise ValueError('Truncated JSON array')
+        chunk = next(chunks, None)
+        if chunk is None:
+            finished = True
+            buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+        else:
+            buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+
+
+class RequestEvent:
+    """
+    One HTTP attempt, passed to request hooks
+    status, bytes and duration are set before 'after' hooks run; error is set if no response was received
+    """
+    __slots__ = ('method', 'url', 'path', 'path_template', 'attempt', 'status', 'bytes', 'duration', 'error')
+
+    def __init__(self, method: str, url: str, api_endpoint: str, attempt=0):
+        self.method = method
+        self.url = url
+        self.path = url[len(api_endpoint):] if url.startswith(api_endpoint) else url
+        self.path_template = path_template(self.path)
+        self.attempt = attempt
+        self.status = None
+        self.bytes = 0
+        self.duration = None
+        self.error = None
+
+    def __repr__(self):
+        return '<Request Event: %s %s %s>' % (self.method, self.path, self.status or self.error)
+
+
+def path_template(api_path: str):
+    """
+    Replaces keys in api path with %s, so requests to the same endpoint are counted together
+    # >>> path_template('boxes/agxzfm1ha/fields/1001')
+    # 'boxes/%s/fields/%s'
+    :param api_path: string
+    :return: string
+    """
+    parts = api_path.split('?')[0].strip('/').split('/')
+    for number in range(1, len(parts), 2):
+        if parts[number] != 'me':
+            parts[number] = '%s'
+    return '/'.join(parts)
+
+
+class RequestStats:
+    """
+    Thread-safe per-endpoint request counters and latency histograms
+    Endpoints are keyed 'METHOD path template', e.g. 'GET pipelines/%s/boxes'
+    """
+    # upper bounds of latency buckets, milliseconds
+    buckets = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def __repr__(self):
+        return '<Request Stats: %s endpoints>' % len(self.endpoints)
+
+    def record(self, event: RequestEvent):
+        milliseconds = event.duration * 1000
+        endpoint_key = '%s %s' % (event.method, event.path_template)
+        with self.lock:
+            endpoint = self.endpoints.get(endpoint_key)
+            if endpoint is None:
+                endpoint = self.endpoints[endpoint_key] = {
+                    'count': 0, 'errors': 0, 'bytes': 0, 'total_ms': 0.0,
+                    'min_ms': milliseconds, 'max_ms': milliseconds, 'statuses': {},
+                    'histogram': [0] * len(self.buckets),
+                }
+            endpoint['count'] += 1
+            endpoint['bytes'] += event.bytes
+            endpoint['total_ms'] += milliseconds
+            endpoint['min_ms'] = min(endpoint['min_ms'], milliseconds)
+            endpoint['max_ms'] = max(endpoint['max_ms'], milliseconds)
+            if event.error is not None or event.status >= 400:
+                endpoint['errors'] += 1
+            status = event.status if event.error is None else type(event.error).__name__
+            endpoint['statuses'][status] = endpoint['statuses'].get(status, 0) + 1
+            endpoint['histogram'][bisect.bisect_left(self.buckets, milliseconds)] += 1
+
+    def as_dict(self):
+        """
+        :return: dict endpoint: counters, mean latency and histogram as {'<=10ms': n, ...}
+        """
+        result = {}
+        with self.lock:
+            for endpoint_key, endpoint in self.endpoints.items():
+                result[endpoint_key] = dict(
+                    endpoint,
+                    statuses=dict(endpoint['statuses']),
+                    mean_ms=endpoint['total_ms'] / endpoint['count'],
+                    histogram={('<=%sms' % bound if bound != float('inf') else '>%sms' % self.buckets[-2]): count
+                               for bound, count in zip(self.buckets, endpoint['histogram'])},
+                )
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+
+class RateLimiter:
+    """
+    Request scheduler of one api key: token bucket for request rate plus adaptive concurrency limit
+    Concurrency limit is halved on every 429 response and grows back by one after a full window of
+    successful requests (AIMD), so it settles at the highest level the api accepts without throttling.
+    A 429 with Retry-After also pauses all requests of the key until that moment.
+    Limiters are kept per api key for the whole process, since the api quota belongs to the key. When
+    connections of one key ask for different limits, the strictest of each setting applies to all of them.
+    """
+    limiters = {}
+    limiters_lock = threading.Lock()
+
+    def __init__(self, rate=None, burst=None, max_concurrency=None):
+        self.rate = rate
+        self.burst_setting = burst
+        # a bucket smaller than one token would never let a request through
+        self.burst = max(1, burst or rate or 1)
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = max_concurrency
+        self.requested = {(rate, burst, max_concurrency)}
+        self.condition = threading.Condition()
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+        self.blocked_until = 0
+        self.in_flight = 0
+        self.successes_in_window = 0
+        self.requests = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    def __repr__(self):
+        return '<Rate Limiter: %s req/s, concurrency %s>' % (self.rate, self.concurrency_limit)
+
+    @classmethod
+    def for_key(cls, api_key: str, rate=None, burst=None, max_concurrency=None):
+        """
+        Returns limiter of api key, creating it with given settings on first use,
+        later settings are reconciled with the existing ones, see reconcile
+        :return: RateLimiter
+        """
+        limiter = cls.limiters.get(api_key)
+        if limiter is None:
+            with cls.limiters_lock:
+                limiter = cls.limiters.setdefault(api_key, cls(rate, burst, max_concurrency))
+        if (rate, burst, max_concurrency) not in limiter.requested:
+            limiter.reconcile(rate, burst, max_concurrency)
+        return limiter
+
+    def reconcile(self, rate=None, burst=None, max_concurrency=None):
+        """
+        Applies settings asked for by another connection of the same api key, None leaves a setting as it is
+        and of two limits the stricter one is kept, so the result does not depend on the order of connections
+        """
+        def stricter(current, requested):
+            if current is None or requested is None:
+                return requested if current is None else current
+            return min(current, requested)
+
+        with self.condition:
+            self.requested.add((rate, burst, max_concurrency))
+            self.rate = stricter(self.rate, rate)
+            self.burst_setting = stricter(self.burst_setting, burst)
+            self.burst = max(1, self.burst_setting or self.rate or 1)
+            self.tokens = min(self.tokens, self.burst)
+            self.max_concurrency = stricter(self.max_concurrency, max_concurrency)
+            if self.max_concurrency is not None:
+                self.concurrency_limit = stricter(self.concurrency_limit, self.max_concurrency)
+            applied = (self.rate, self.burst_setting, self.max_concurrency)
+            self.condition.notify_all()
+        if any(asked is not None and asked != got for asked, got in zip((rate, burst, max_concurrency), applied)):
+            logger.warning('[!] Api key is limited to %s req/s (burst %s, concurrency %s) by another connection, '
+                           'looser %s req/s (burst %s, concurrency %s) not applied',
+                           *(applied + (rate, burst, max_concurrency)))
+
+    def acquire(self, deadline=None):
+        """
+        Blocks until a request may be sent
+        :param deadline: absolute time.monotonic() deadline, StreakTimeoutError is raised
+            as soon as it is clear the request could not be sent before it
+        """
+        started = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    raise StreakTimeoutError('Deadline exceeded while waiting for the rate limiter')
+                if now < self.blocked_until:
+                    if deadline is not None and self.blocked_until > deadline:
+                        raise StreakTimeoutError('Deadline exceeded: api key is throttled for %.1f s more' % (
+                            self.blocked_until - now))
+                    self.condition.wait(self.blocked_until - now)
+                    continue
+                if self.concurrency_limit is not None and self.in_flight >= self.concurrency_limit:
+                    self.condition.wait(None if deadline is None else deadline - now)
+                    continue
+                if self.rate:
+                    self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+                    self.refilled_at = now
+                    if self.tokens < 1:
+                        wait = (1 - self.tokens) / self.rate
+                        if deadline is not None and now + wait > deadline:
+                            raise StreakTimeoutError('Deadline exceeded: next request of the api key is allowed '
+                                                     'in %.1f s' % wait)
+                        self.condition.wait(wait)
+                        continue
+                    self.tokens -= 1
+                break
+            self.in_flight += 1
+            self.requests += 1
+            self.waited_seconds += time.monotonic() - started
+
+    def release(self, retry_after=None):
+        """
+        Marks request as finished
+        :param retry_after: seconds to pause the api key for, when request was throttled
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if retry_after is not None:
+                self.throttled += 1
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                self.successes_in_window = 0
+                if self.concurrency_limit is None:
+                    self.concurrency_limit = max(1, self.in_flight + 1)
+                self.concurrency_limit = max(1, self.concurrency_limit // 2)
+            elif self.concurrency_limit is not None:
+                self.successes_in_window += 1
+                if self.successes_in_window >= self.concurrency_limit:
+                    self.successes_in_window = 0
+                    if self.max_concurrency is None or self.concurrency_limit < self.max_concurrency:
+                        self.concurrency_limit += 1
+            self.condition.notify_all()
+
+    def stats(self):
+        """
+        :return: dict with throttle counters
+        """
+        with self.condition:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'concurrency_limit': self.concurrency_limit,
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'waited_seconds': round(self.waited_seconds, 3),
+                'blocked_for': round(max(0.0, self.blocked_until - time.monotonic()), 3),
+            }
+
+
+def parse_retry_after(value, default):
+    """
+    Parses Retry-After header, given either in seconds or as HTTP date
+    :param value: header value or None
+    :param default: seconds to use when header is missing or malformed
+    :return: seconds
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls with the same key: the first caller runs the call,
+    callers arriving while it is in flight wait for it and get the same result (or exception),
+    so results should not be mutated by callers
+    """
+
+    class Call:
+        __slots__ = ('done', 'result', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def __repr__(self):
+        return '<Single Flight: %s in flight>' % len(self.calls)
+
+    def do(self, key, func, deadline=None):
+        """
+        :param key: hashable identifying the call
+        :param func: callable without arguments
+        :param deadline: absolute time.monotonic() after which waiting callers give up
+        :return: result of func
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self.Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                call.result = func()
+            except BaseException as error:
+                call.error = error
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+        else:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            if not call.done.wait(timeout):
+                raise StreakTimeoutError('Deadline exceeded while waiting for identical request in flight')
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        """
+        :return: dict with number of executed and shared calls
+        """
+        with self.lock:
+            return {'executed': self.executed, 'shared': self.shared, 'in_flight': len(self.calls)}
+
+
+class Cassette:
+    """
+    Records HTTP responses of a StreakConnection to a compact file and replays them without network
+    Pass it as the cassette setting, it is mounted as the transport adapter of the connection's session,
+    so rate limiting, retries, hooks and stats work the same way in both modes.
+    # >>> with Cassette('boxes.cassette', 'record') as cassette:
+    # ...     StreakConnection(api_key, cassette=cassette).box_get_all()
+    # >>> with Cassette('boxes.cassette', 'replay', latency_scale=1.0) as cassette:
+    # ...     StreakConnection(cassette=cassette).box_get_all()
+    File is a gzip stream of records: 4 byte length, JSON header (request, status, headers, latency), body.
+    Requests are matched on method, path with query and body, ignoring host and credentials. JSON bodies
+    are compared in a normal form, so a cassette recorded with one json_backend replays with another.
+    Identical requests replay their recorded responses in order, the last one is repeated when they run out.
+    """
+    modes = ('record', 'replay')
+    kept_headers = ('Content-Type', 'Retry-After')
+    header_length = struct.Struct('<I')
+
+    def __init__(self, path: str, mode='replay', latency_scale=0.0):
+        """
+        :param path: cassette file
+        :param mode: 'record' sends requests and (over)writes the file, 'replay' never touches the network
+        :param latency_scale: replayed responses wait recorded latency times this, 0 to answer at once
+        """
+        if mode not in self.modes:
+            raise Exception('[!] Unknown cassette mode %r, choose one of %s' % (mode, ', '.join(self.modes)))
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.interactions = {}
+        self.count = 0
+        self.file = None
+        if mode == 'record':
+            self.file = gzip.open(path, 'wb')
+        else:
+            self.load()
+
+    def __repr__(self):
+        return '<Cassette: \'%s\' %s, %s responses>' % (self.path, self.mode, self.count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    @staticmethod
+    def normal_body(body):
+        """
+        :return: JSON body with sorted keys and compact separators, other bodies as they are
+        """
+        if not body:
+            return body
+        try:
+            return json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        except ValueError:
+            return body
+
+    @classmethod
+    def request_key(cls, request):
+        url = urllib.parse.urlsplit(request.url)
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode('latin-1')
+        return request.method, url.path + ('?' + url.query if url.query else ''), cls.normal_body(body)
+
+    def load(self):
+        with gzip.open(self.path, 'rb') as cassette_file:
+            while True:
+                length = cassette_file.read(self.header_length.size)
+                if not length:
+                    break
+                header = json.loads(cassette_file.read(self.header_length.unpack(length)[0]))
+                body = cassette_file.read(header['length'])
+                key = (header['method'], header['url'], self.normal_body(header['body']))
+                self.interactions.setdefault(key, deque()).append((header, body))
+                self.count += 1
+
+    def record(self, request, response, latency: float):
+        method, url, body = self.request_key(request)
+        content = response.content
+        header = json.dumps({
+            'method': method, 'url': url, 'body': body, 'status': response.status_code, 'reason': response.reason,
+            'headers': {name: response.headers[name] for name in self.kept_headers if name in response.headers},
+            'latency': round(latency, 6), 'length': len(content),
+        }).encode('utf-8')
+        with self.lock:
+            if self.file is None:
+                raise Exception('[!] Cassette %s is closed' % self.path)
+            self.file.write(self.header_length.pack(len(header)) + header + content)
+            self.count += 1
+
+    def replay(self, request, adapter):
+        key = self.request_key(request)
+        with self.lock:
+            recorded = self.interactions.get(key)
+            if not recorded:
+                raise StreakCassetteMiss('[!] Cassette %s has no response for %s %s' % (self.path, key[0], key[1]))
+            header, body = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        if self.latency_scale:
+            time.sleep(header['latency'] * self.latency_scale)
+
+        response = requests.Response()
+        response.status_code = header['status']
+        response.reason = header['reason']
+        response.headers = CaseInsensitiveDict(header['headers'])
+        response.headers['Content-Length'] = str(len(body))
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.connection = adapter
+        response.encoding = 'utf-8'
+        response.elapsed = datetime.timedelta(seconds=header['latency'])
+        return response
+
+
+class CassetteAdapter(BaseAdapter):
+    """
+    Transport adapter that records responses of the wrapped adapter to a Cassette, or replays them
+    """
+
+    def __init__(self, cassette: Cassette, adapter: BaseAdapter):
+        super().__init__()
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == 'replay':
+            return self.cassette.replay(request, self)
+        started = time.perf_counter()
+        response = self.adapter.send(request, **kwargs)
+        # the whole body is read before the clock stops, so replayed latency includes the download;
+        # a streamed response then iterates over it from memory
+        response.content
+        self.cassette.record(request, response, time.perf_counter() - started)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class SchemaCache:
+    """
+    Thread-safe LRU cache of pipeline schema responses with per-resource time to live
+    Entries are keyed by (resource, pipeline_key, key) and returned as deep copies,
+    so models built from them never share mutable state with the cache.
+    Every invalidation bumps the generation of the pipeline: a response read before it is not stored
+    by put, even if it arrives after the invalidation.
+    """
+    default_ttl = {
+        'pipeline': 300,
+        'stages': 300,
+        'stage': 300,
+        'fields': 300,
+        'field': 300,
+    }
+
+    def __init__(self, max_size=256, ttl=None):
+        self.max_size = max_size
+        self.ttl = dict(self.default_ttl, **(ttl or {}))
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generations = {}
+        self.cleared = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale = 0
+
+    def __repr__(self):
+        return '<Schema Cache: %s entries>' % len(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, resource: str, pipeline_key: str, key=None):
+        """
+        Looks entry up, expired entries count as misses
+        :return: tuple (hit, data)
+        """
+        cache_key = (resource, pipeline_key, key)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(cache_key)
+                self.hits += 1
+                data = entry[1]
+            else:
+                if entry is not None:
+                    del self.entries[cache_key]
+                self.misses += 1
+                return False, None
+        return True, copy.deepcopy(data)
+
+    def generation(self, pipeline_key: str):
+        """
+        :return: token to pass to put, taken before the request whose response will be stored
+        """
+        with self.lock:
+            return self.cleared, self.generations.get(pipeline_key, 0)
+
+    def put(self, resource: str, pipeline_key: str, key, data, generation=None):
+        """
+        Stores data, unless pipeline was invalidated since generation was taken
+        """
+        cache_key = (resource, pipeline_key, key)
+        with self.lock:
+            if generation is not None and generation != (self.cleared, self.generations.get(pipeline_key, 0)):
+                self.stale += 1
+                return
+            self.entries[cache_key] = (time.monotonic() + self.ttl[resource], copy.deepcopy(data))
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, pipeline_key=None):
+        """
+        Drops all entries of pipeline, or the whole cache if pipeline_key is None
+        """
+        with self.lock:
+            if pipeline_key is None:
+                self.entries.clear()
+                self.cleared += 1
+            else:
+                self.generations[pipeline_key] = self.generations.get(pipeline_key, 0) + 1
+                for cache_key in [cache_key for cache_key in self.entries if cache_key[1] == pipeline_key]:
+                    del self.entries[cache_key]
+            self.invalidations += 1
+
+    def stats(self):
+        """
+        :return: dict with hit/miss counters
+        """
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'stale': self.stale,
+            }
+
+
+def map_concurrently(func, items, max_workers=8):
+    """
+    Calls func on every item in a thread pool, yields (item, result) in items order
+    Exception raised by func is yielded as the result of its item. Items are consumed lazily,
+    no more than 2 * max_workers of them are pending at once
+    :param func: callable of one argument
+    :param items: iterable
+    :param max_workers: number of threads
+    :return: generator of (item, result or Exception)
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for item in items:
+                pending.append((item, executor.submit(func, item)))
+                if len(pending) >= 2 * max_workers:
+                    yield _pop_result(pending)
+            while pending:
+                yield _pop_result(pending)
+        finally:
+            for item, future in pending:
+                future.cancel()
+
+
+def _pop_result(pending):
+    item, future = pending.popleft()
+    try:
+        return item, future.result()
+    except Exception as error:
+        return item, error
+
+
+class FlushResult:
+    """
+    Outcome of writing the buffered edits of one box, passed to EditBuffer callbacks
+    edits is a list of (target, params) in write order, target is 'box' or a field key;
+    results holds the models returned by the writes that succeeded, error the exception that stopped the rest
+    """
+    __slots__ = ('box_key', 'edits', 'results', 'error')
+
+    def __init__(self, box_key: str, edits: list):
+        self.box_key = box_key
+        self.edits = edits
+        self.results = []
+        self.error = None
+
+    def __repr__(self):
+        return '<Flush Result: %s %s/%s written%s>' % (self.box_key, len(self.results), len(self.edits),
+                                                       ', %s' % self.error if self.error else '')
+
+
+class EditBuffer:
+    """
+    Write-behind buffer for box and value edits
+    Edits are collected per box, successive edits of the same box (or the same field of it) are merged
+    into one write. Pending edits are flushed by a background thread once max_edits are pending or
+    the oldest one waited max_delay seconds, or by flush(). Boxes are written concurrently, edits of one box
+    are written in the order their targets were first edited, and a box is never written by two flushes at once.
+    # >>> with streak.edit_buffer(max_delay=2, callback=print) as buffer:
+    # ...     buffer.box_edit(box_key, {'stageKey': '5002'})
+    # ...     buffer.value_edit(box_key, '1001', 'hot')
+    # ...     buffer.value_edit(box_key, '1001', 'very hot')   # replaces the pending 'hot'
+    Edits stop at the first failed write of a box, the callback gets it in FlushResult.error.
+    """
+
+    def __init__(self, streak_connection, max_edits=100, max_delay=1.0, max_workers=4, callback=None):
+        """
+        :param streak_connection: StreakConnection
+        :param max_edits: pending edits that trigger a background flush
+        :param max_delay: seconds an edit may wait before a background flush, None to flush only on max_edits
+        :param max_workers: boxes written at once
+        :param callback: callable called with a FlushResult for every box written
+        """
+        self.streak_connection = streak_connection
+        self.max_edits = max_edits
+        self.max_delay = max_delay
+        self.callback = callback
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()
+        self.pending_count = 0
+        self.oldest = None
+        self.in_flight = {}
+        self.counters = {'edits': 0, 'merged': 0, 'writes': 0, 'failed': 0, 'flushes': 0}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='streak-edit-buffer')
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='streak-edit-buffer-timer', daemon=True)
+        self.thread.start()
+
+    def __repr__(self):
+        return '<Edit Buffer: %s pending>' % self.pending_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, box_key: str, target: str, params: dict):
+        with self.condition:
+            if self.closed:
+                raise Exception('[!] Edit buffer is closed')
+            edits = self.pending.setdefault(box_key, OrderedDict())
+            if target in edits:
+                edits[target].update(params)
+                self.counters['merged'] += 1
+            else:
+                edits[target] = dict(params)
+                self.pending_count += 1
+            self.counters['edits'] += 1
+            if self.oldest is None:
+                # the timer thread sleeps without timeout while nothing is pending
+                self.oldest = time.monotonic()
+                self.condition.notify_all()
+            elif self.pending_count >= self.max_edits:
+                self.condition.notify_all()
+
+    def box_edit(self, box_key: str, box_params: dict):
+        """
+        Buffers box_edit, params of pending edit of the same box are updated with box_params
+        """
+        self.add(box_key, 'box', box_params)
+
+    def value_edit(self, box_key: str, field_key: str, value):
+        """
+        Buffers value_edit_in_box, a pending value of the same field is replaced
+        """
+        self.add(box_key, field_key, {'value': value})
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self.due():
+                    timeout = None
+                    if self.oldest is not None and self.max_delay is not None:
+                        timeout = max(0, self.oldest + self.max_delay - time.monotonic())
+                    self.condition.wait(timeout)
+                if self.closed:
+                    return
+            self.flush(wait=False)
+
+    def due(self):
+        if self.pending_count >= self.max_edits:
+            return True
+        return self.oldest is not None and self.max_delay is not None and \
+            time.monotonic() >= self.oldest + self.max_delay
+
+    def flush(self, wait=True):
+        """
+        Writes all pending edits
+        :param wait: block until they are written
+        :return: list of FlushResult if wait, else list of futures
+        """
+        with self.condition:
+            pending, self.pending = self.pending, OrderedDict()
+            self.pending_count = 0
+            self.oldest = None
+            if pending:
+                self.counters['flushes'] += 1
+            futures = []
+            for box_key, edits in pending.items():
+                # a box still being written by an earlier flush is written after it
+                previous = self.in_flight.get(box_key)
+                future = self.executor.submit(self.write_box, box_key, list(edits.items()), previous)
+                self.in_flight[box_key] = future
+                future.add_done_callback(functools.partial(self.done, box_key))
+                futures.append(future)
+        if not wait:
+            return futures
+        return [future.result() for future in futures]
+
+    def done(self, box_key: str, future):
+        with self.condition:
+            if self.in_flight.get(box_key) is future:
+                del self.in_flight[box_key]
+
+    def write_box(self, box_key: str, edits: list, previous=None):
+        if previous is not None:
+            previous.exception()
+        result = FlushResult(box_key, edits)
+        for target, params in edits:
+            try:
+                if target == 'box':
+                    result.results.append(self.streak_connection.box_edit(box_key, params))
+                else:
+                    result.results.append(self.streak_connection.value_edit_in_box(box_key, target, params))
+            except Exception as error:
+                result.error = error
+                break
+        with self.condition:
+            self.counters['writes'] += len(result.results)
+            self.counters['failed'] += result.error is not None
+        if result.error is not None:
+            logger.debug('Buffered edits of Box %s failed: %s', box_key, result.error)
+        if self.callback is not None:
+            try:
+                self.callback(result)
+            except Exception:
+                logger.exception('[!] Edit buffer callback %r failed', self.callback)
+        return result
+
+    def stats(self):
+        """
+        :return: dict with counts of edits buffered, edits merged into pending ones, writes sent,
+                 boxes failed, flushes and pending edits
+        """
+        with self.condition:
+            stats = dict(self.counters)
+            stats['pending'] = self.pending_count
+        return stats
+
+    def close(self):
+        """
+        Flushes pending edits, waits for all writes and stops the background thread
+        """
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.flush()
+        self.executor.shutdown(wait=True)
+
+
 # def api_get(self, request_path):
 # return self.streak_connection.get_api_data(request_path)
 
 
 class StreakConnection:
-    def __init__(self, api_key=TEST_API_KEY):
-        self.settings = self.Settings(api_key)
+    def __init__(self, api_key=TEST_API_KEY, **settings):
+        self.settings = self.Settings(api_key, **settings)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._local = threading.local()
+        self.hooks = {'before': [], 'after': [], 'box_written': [], 'box_deleted': [], 'value_written': []}
+        self.stats = RequestStats()
+        self.single_flight = SingleFlight()
+        self.write_counter = itertools.count(1)
+        self.write_generation = 0
+        self.codec = JsonCodec(self.settings.json_backend)
+        self.schema_cache = None
+        if self.settings.schema_cache:
+            self.schema_cache = SchemaCache(self.settings.schema_cache_size, self.settings.schema_cache_ttl)
 
     def __repr__(self):
         return '<Streak Connection Object>'
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     class Settings:
-        def __init__(self, api_key, api_endpoint='https://www.streak.com/api/v1/'):
+        def __init__(self, api_key, api_endpoint='https://www.streak.com/api/v1/',
+                     pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True,
+                     schema_cache=False, schema_cache_size=256, schema_cache_ttl=None, json_backend='auto',
+                     rate_limit=None, rate_burst=None, max_concurrency=None, max_throttle_retries=5,
+                     connect_timeout=5, read_timeout=60, max_retries=3, backoff_base=0.5, backoff_max=30,
+                     retry_methods=('GET', 'PUT', 'DELETE'), coalesce_gets=True, cassette=None):
+            """
+            Connection settings
+            :param api_key: Streak API key
+            :param api_endpoint: base url all api paths are appended to
+            :param pool_connections: number of per-host connection pools to keep
+            :param pool_maxsize: max number of sockets kept open to a single host
+            :param pool_block: when True, requests wait for a free socket instead of opening extra ones
+            :param keep_alive: when False, every socket is closed after its response
+            :param schema_cache: cache pipelines, stages and fields read by pipeline_get, stage_get_* and field_get_*
+            :param schema_cache_size: max number of cached responses, least recently used are evicted
+            :param schema_cache_ttl: dict resource: seconds, overrides SchemaCache.default_ttl
+            :param json_backend: one of JsonCodec.backends
+            :param rate_limit: requests per second allowed for the api key, None for no limit
+            :param rate_burst: requests that can be sent at once before rate_limit kicks in, defaults to rate_limit
+            :param max_concurrency: max requests in flight for the api key, None for no limit
+            :param max_throttle_retries: how many times a request answered with 429 is retried
+            :param connect_timeout: seconds to wait for a socket to connect
+            :param read_timeout: seconds to wait for the server to send data
+            :param max_retries: how many times a failed request (timeout, connection error, 5xx) is retried
+            :param backoff_base: first retry waits up to this many seconds, every next one up to twice as long
+            :param backoff_max: max seconds to wait between retries
+            :param retry_methods: HTTP methods safe to retry; PUT creates objects in Streak api, drop it
+                                  from the list if a duplicate after a lost response is worse than a failure
+            :param coalesce_gets: concurrent identical GETs share one in-flight request
+            :param cassette: Cassette recording or replaying all HTTP traffic of the connection
+            """
             self.api_key = api_key
             self.api_endpoint = api_endpoint
+            self.pool_connections = pool_connections
+            self.pool_maxsize = pool_maxsize
+            self.pool_block = pool_block
+            self.keep_alive = keep_alive
+            self.schema_cache = schema_cache
+            self.schema_cache_size = schema_cache_size
+            self.schema_cache_ttl = schema_cache_ttl
+            self.json_backend = json_backend
+            self.rate_limit = rate_limit
+            self.rate_burst = rate_burst
+            self.max_concurrency = max_concurrency
+            self.max_throttle_retries = max_throttle_retries
+            self.connect_timeout = connect_timeout
+            self.read_timeout = read_timeout
+            self.max_retries = max_retries
+            self.backoff_base = backoff_base
+            self.backoff_max = backoff_max
+            self.retry_methods = retry_methods
+            self.coalesce_gets = coalesce_gets
+            self.cassette = cassette
+
+    @property
+    def session(self):
+        """
+        Lazily creates the pooled requests.Session shared by all requests of this connection
+        :return: requests.Session
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    session.auth = HTTPBasicAuth(self.settings.api_key, '')
+                    if not self.settings.keep_alive:
+                        session.headers['Connection'] = 'close'
+                    adapter = HTTPAdapter(pool_connections=self.settings.pool_connections,
+                                          pool_maxsize=self.settings.pool_maxsize,
+                                          pool_block=self.settings.pool_block)
+                    if self.settings.cassette is not None:
+                        adapter = CassetteAdapter(self.settings.cassette, adapter)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def close(self):
+        """
+        Closes pooled sockets. Connection can still be used afterwards, a new pool is created on demand
+        :return:
+        """
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    @property
+    def rate_limiter(self):
+        """
+        RateLimiter shared by all connections using the same api key, the strictest settings of them apply
+        :return: RateLimiter
+        """
+        return RateLimiter.for_key(self.settings.api_key, self.settings.rate_limit, self.settings.rate_burst,
+                                   self.settings.max_concurrency)
+
+    def add_hook(self, when: str, callback):
+        """
+        Registers callback called with a RequestEvent before or after every HTTP attempt,
+        or with the model returned by a successful write made through this connection:
+        'box_written' gets the Box of box_create/box_edit, 'box_deleted' the key of a deleted box,
+        'value_written' the Value of value_edit_in_box
+        # >>> streak.add_hook('after', lambda event: print(event.method, event.path, event.status, event.duration))
+        :param when: 'before', 'after', 'box_written', 'box_deleted' or 'value_written'
+        :param callback: callable of one argument
+        :return:
+        """
+        self.hooks[when].append(callback)
+
+    def remove_hook(self, when: str, callback):
+        self.hooks[when].remove(callback)
+
+    def edit_buffer(self, max_edits=100, max_delay=1.0, max_workers=4, callback=None):
+        """
+        :return: EditBuffer writing through this connection, see EditBuffer
+        """
+        return EditBuffer(self, max_edits, max_delay, max_workers, callback)
+
+    def request_stats(self):
+        """
+        :return: dict 'METHOD path template': counters and latency histogram, see RequestStats
+        """
+        return self.stats.as_dict()
+
+    def run_hooks(self, when: str, event):
+        for callback in self.hooks[when]:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception('[!] %s hook %r failed', when, callback)
+
+    def throttle_stats(self):
+        """
+        :return: dict with request, throttle and wait counters of this connection's api key
+        """
+        return self.rate_limiter.stats()
+
+    @contextlib.contextmanager
+    def deadline(self, seconds=None, at=None):
+        """
+        Limits total time of all requests sent by this thread inside the block, retries included
+        Nested deadlines can only shorten the outer one
+        # >>> with streak.deadline(30):
+        # ...     streak.value_get_all_in_boxes(box_keys)
+        :param seconds: time budget from now
+        :param at: absolute time.monotonic() deadline, instead of seconds
+        :return: absolute deadline
+        """
+        previous = getattr(self._local, 'deadline', None)
+        current = at if at is not None else time.monotonic() + seconds
+        if previous is not None:
+            current = min(previous, current)
+        self._local.deadline = current
+        try:
+            yield current
+        finally:
+            self._local.deadline = previous
+
+    def deadline_at(self, seconds=None):
+        """
+        :param seconds: time budget from now, or None
+        :return: absolute deadline of this thread shortened to seconds from now, None if there is none
+        """
+        current = getattr(self._local, 'deadline', None)
+        if seconds is not None:
+            at = time.monotonic() + seconds
+            current = at if current is None else min(current, at)
+        return current
+
+    def call_with_deadline(self, at, func, *args, **kwargs):
+        """
+        Calls func under absolute deadline at, used to pass deadline down to worker threads
+        """
+        if at is None:
+            return func(*args, **kwargs)
+        with self.deadline(at=at):
+            return func(*args, **kwargs)
+
+    def request_timeout(self):
+        """
+        :return: (connect, read) timeout of next request, shortened to fit the deadline
+        """
+        connect_timeout, read_timeout = self.settings.connect_timeout, self.settings.read_timeout
+        at = getattr(self._local, 'deadline', None)
+        if at is not None:
+            remaining = at - time.monotonic()
+            if remaining <= 0:
+                raise StreakTimeoutError('Deadline exceeded')
+            connect_timeout = min(connect_timeout or remaining, remaining)
+            read_timeout = min(read_timeout or remaining, remaining)
+        return connect_timeout, read_timeout
+
+    def backoff_delay(self, attempt: int):
+        """
+        Full jitter exponential backoff
+        :param attempt: number of retry, starting at 0
+        :return: seconds
+        """
+        return random.uniform(0, min(self.settings.backoff_max, self.settings.backoff_base * 2 ** attempt))
+
+    def send_request(self, method: str, api_full_path: str, **kwargs):
+        """
+        Sends request through the rate limiter of the api key
+        429 responses are retried after Retry-After seconds (or exponential backoff when it is missing),
+        up to max_throttle_retries times. Timeouts, connection errors and 5xx responses of retry_methods
+        are retried up to max_retries times with jittered exponential backoff, within the current deadline.
+        4xx responses are returned, their body carries the api error message
+        :param method: HTTP method
+        :param api_full_path: url
+        :param kwargs: passed to requests.Session.request
+        :return: requests.Response
+        """
+        limiter = self.rate_limiter
+        throttle_attempt = 0
+        retry_attempt = 0
+        while True:
+            limiter.acquire(getattr(self._local, 'deadline', None))
+            try:
+                # time spent waiting in the limiter counts against the deadline
+                timeout = self.request_timeout()
+            except StreakTimeoutError:
+                limiter.release()
+                raise
+            retry_after = None
+            failure = None
+            event = RequestEvent(method, api_full_path, self.settings.api_endpoint, throttle_attempt + retry_attempt)
+            self.run_hooks('before', event)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, api_full_path, timeout=timeout, **kwargs)
+            except requests.Timeout as error:
+                failure = StreakTimeoutError('[HTTP %s] Timed out: %s' % (method, error))
+            except requests.ConnectionError as error:
+                failure = StreakConnectionError('[HTTP %s] Connection failed: %s' % (method, error))
+            else:
+                if response.status_code == 429:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'), 2 ** throttle_attempt)
+            finally:
+                limiter.release(retry_after)
+            event.duration = time.perf_counter() - started
+            if failure is None:
+                event.status = response.status_code
+                if kwargs.get('stream'):
+                    event.bytes = int(response.headers.get('Content-Length') or 0)
+                else:
+                    event.bytes = len(response.content)
+            else:
+                event.error = failure
+            self.stats.record(event)
+            self.run_hooks('after', event)
+            logger.debug('[API %s] %s %s %.1f ms', method, api_full_path, event.status or event.error,
+                         event.duration * 1000)
+
+            if retry_after is not None:
+                response.close()
+                if throttle_attempt >= self.settings.max_throttle_retries:
+                    raise StreakRateLimitError('[HTTP %s] Rate limited: %s' % (method, api_full_path), response)
+                throttle_attempt += 1
+                continue
+
+            if failure is None:
+                if response.status_code < 500:
+                    return response
+                response.close()
+                failure = StreakHTTPError('[HTTP %s] Server error %s: %s' % (method, response.status_code,
+                                                                            api_full_path), response)
+
+            if method not in self.settings.retry_methods or retry_attempt >= self.settings.max_retries:
+                raise failure
+            delay = self.backoff_delay(retry_attempt)
+            at = getattr(self._local, 'deadline', None)
+            if at is not None and time.monotonic() + delay >= at:
+                raise failure
+            time.sleep(delay)
+            retry_attempt += 1
+
+    def decode_response(self, response):
+        """
+        :param response: requests.Response
+        :return: decoded JSON body
+        """
+        try:
+            return self.codec.loads(response.content)
+        except ValueError:
+            raise StreakHTTPError('[HTTP %s] Response is not JSON, status %s: %s' % (
+                response.request.method, response.status_code, response.url), response) from None
 
     def get_api_data(self, api_path: str):
         """
         Merges api_endpoint with api_path and sends GET request
+        With coalesce_gets on, concurrent identical GETs share one request, each caller gets its own copy
         :param api_path: string
         :return: object
         """
-        result = None
         api_full_path = self.settings.api_endpoint + api_path
-        print('[API GET]', api_full_path)
-        try:
-            result = requests.get(api_full_path, auth=HTTPBasicAuth(self.settings.api_key, ''))
-        except requests.HTTPError:
-            print('[HTTP GET] Error')
-            exit()
-        else:
-            result = json.loads(result.text)
-        return result
+        if not self.settings.coalesce_gets:
+            return self.decode_response(self.send_request('GET', api_full_path))
+        # reads started after a write never join reads that may have started before it;
+        # the response body is shared, every caller decodes its own objects from it
+        response = self.single_flight.do((self.write_generation, api_path),
+                                         lambda: self.send_request('GET', api_full_path),
+                                         self.deadline_at())
+        return self.decode_response(response)
 
     def put_api_data(self, api_path: str, settings: dict):
         """
@@ -72,17 +1579,9 @@ class StreakConnection:
         :param api_path: string
         :return: object
         """
-        result = None
         api_full_path = self.settings.api_endpoint + api_path
-        print('[API PUT]', api_full_path)
-        try:
-            result = requests.put(api_full_path, data=settings, auth=HTTPBasicAuth(self.settings.api_key, ''))
-        except requests.HTTPError:
-            print('[HTTP PUT] Error')
-            exit()
-        else:
-            result = json.loads(result.text)
-        return result
+        self.write_generation = next(self.write_counter)
+        return self.decode_response(self.send_request('PUT', api_full_path, data=settings))
 
     def delete_api_data(self, api_path: str):
         """
@@ -90,17 +1589,9 @@ class StreakConnection:
         :param api_path: string
         :return: object
         """
-        result = None
         api_full_path = self.settings.api_endpoint + api_path
-        print('[API DELETE]', api_full_path)
-        try:
-            result = requests.delete(api_full_path, auth=HTTPBasicAuth(self.settings.api_key, ''))
-        except requests.HTTPError:
-            print('[HTTP DELETE] Error')
-            exit()
-        else:
-            result = json.loads(result.text)
-        return result
+        self.write_generation = next(self.write_counter)
+        return self.decode_response(self.send_request('DELETE', api_full_path))
 
     def post_api_data(self, api_path: str, settings: dict):
         """
@@ -108,19 +1599,111 @@ class StreakConnection:
         :param api_path: string
         :return: object
         """
-        result = None
         api_full_path = self.settings.api_endpoint + api_path
-        print('[API POST]', api_full_path)
-        try:
-            result = requests.post(api_full_path, data=json.dumps(settings),
-                                   auth=HTTPBasicAuth(self.settings.api_key, ''),
-                                   headers={'Content-Type': 'application/json'})
-        except requests.HTTPError:
-            print('[HTTP POST] Error')
-            exit()
-        else:
-            result = json.loads(result.text)
-        return result
+        self.write_generation = next(self.write_counter)
+        return self.decode_response(self.send_request('POST', api_full_path, data=self.codec.dumps(settings),
+                                                      headers={'Content-Type': 'application/json'}))
+
+    def iter_api_data(self, api_path: str, params=None, chunk_size=65536):
+        """
+        Sends GET request and parses JSON array response incrementally while it is downloaded
+        Only the current chunk and one element are held in memory
+        :param api_path: string
+        :param params: dict of query params
+        :param chunk_size: bytes read from socket at once
+        :return: generator of array elements
+        """
+        api_full_path = self.settings.api_endpoint + api_path
+        with self.send_request('GET', api_full_path, params=params, stream=True) as response:
+            for element in iter_json_array(response.iter_content(chunk_size)):
+                yield element
+
+    def iter_paged_api_data(self, api_path: str, page_size=None):
+        """
+        Streams JSON array from api_path, fetching it page by page with page/limit params if page_size is given
+        An endpoint that ignores page/limit would return the whole array for every page, StreakAPIError
+        is raised as soon as a page holds more than page_size elements
+        :param api_path: string
+        :param page_size: elements per page, None to stream whole array in one response
+        :return: generator of array elements
+        """
+        if not page_size:
+            yield from self.iter_api_data(api_path)
+            return
+
+        page = 0
+        while True:
+            count = 0
+            for element in self.iter_api_data(api_path, {'page': page, 'limit': page_size}):
+                count += 1
+                if count > page_size:
+                    raise StreakAPIError('%s returned more than %s elements per page, it does not support paging'
+                                         % (api_path, page_size))
+                yield element
+            if count < page_size:
+                break
+            page += 1
+
+    @staticmethod
+    def check_api_data(data, message: str):
+        """
+        :param data: decoded response
+        :param message: prefix of the error message
+        :return: data, StreakAPIError is raised if it is an error response
+        """
+        if isinstance(data, dict) and 'success' in data.keys():
+            raise StreakAPIError('%s: %s' % (message, data.get('error')))
+        return data
+
+    def get_pipelines_data(self, pipeline_keys=None):
+        """
+        Gets raw data of given pipelines, or of all pipelines of the account, without building models
+        :param pipeline_keys: list of pipeline keys, None for all pipelines
+        :return: list of dicts, StreakAPIError is raised if any of them failed
+        """
+        if pipeline_keys is None:
+            return self.check_api_data(self.get_api_data('pipelines/'), 'Failed to get pipelines')
+        return [self.check_api_data(self.get_api_data('pipelines/' + key), 'Failed to get pipeline ' + key)
+                for key in pipeline_keys]
+
+    def get_fields_data(self, pipeline_key: str):
+        """
+        Gets raw data of fields of pipeline, without building models
+        :return: list of dicts, StreakAPIError is raised if the request failed
+        """
+        return self.check_api_data(self.get_api_data('pipelines/%s/fields' % pipeline_key),
+                                   'Failed to get fields of pipeline ' + pipeline_key)
+
+    def get_schema_data(self, resource: str, pipeline_key: str, key, api_path: str):
+        """
+        Reads pipeline schema data (pipeline, stages, fields) through schema_cache if it is enabled
+        Error responses are never cached
+        :param resource: one of SchemaCache.default_ttl keys
+        :param pipeline_key: string
+        :param key: stage or field key, None for whole resource
+        :param api_path: string
+        :return: object
+        """
+        if self.schema_cache is None:
+            return self.get_api_data(api_path)
+
+        hit, data = self.schema_cache.get(resource, pipeline_key, key)
+        if not hit:
+            # a write of the pipeline finishing while this read runs makes the response stale, put then skips it
+            generation = self.schema_cache.generation(pipeline_key)
+            data = self.get_api_data(api_path)
+            if not (isinstance(data, dict) and 'success' in data.keys()):
+                self.schema_cache.put(resource, pipeline_key, key, data, generation)
+        return data
+
+    def invalidate_schema(self, pipeline_key: str):
+        """
+        Drops cached schema of pipeline, called by every pipeline, stage and field write
+        :param pipeline_key: string
+        :return:
+        """
+        if self.schema_cache is not None:
+            self.schema_cache.invalidate(pipeline_key)
 
     def user_get_me(self):
         """
@@ -144,7 +1727,7 @@ class StreakConnection:
 
         # if server response has error code
         if 'success' in user_data.keys():
-            raise Exception(user_data['error'])
+            raise StreakAPIError(user_data['error'])
 
         user = add_attributes(user_data, User(self))
         return user
@@ -170,28 +1753,32 @@ class StreakConnection:
         if not pipeline_key:
             raise Exception('[!] Empty pipeline key, please supply one')
 
-        pipeline_data = self.get_api_data('pipelines/' + pipeline_key)
+        pipeline_data = self.get_schema_data('pipeline', pipeline_key, None, 'pipelines/' + pipeline_key)
 
         if 'success' in pipeline_data.keys():
-            raise Exception(pipeline_data['error'])
+            raise StreakAPIError(pipeline_data['error'])
 
         pipeline = add_attributes(pipeline_data, Pipeline(self))
         return pipeline
 
-    def pipeline_create(self, pipeline_params: dict):
+    def pipeline_create(self, pipeline_params: dict, refresh=False):
         """
         Creates and returns Pipeline with given params
         :param pipeline_params: dict of params
+        :param refresh: re-read Pipeline from server instead of building it from the create response
         :return: newly created Pipeline instance
         """
         pipeline_data = self.put_api_data('pipelines/', pipeline_params)
 
         if 'success' in pipeline_data.keys():
-            raise Exception(pipeline_data['error'])
+            raise StreakAPIError(pipeline_data['error'])
 
-        new_pipeline = self.pipeline_get(pipeline_data['pipelineKey'])
+        if refresh:
+            new_pipeline = self.pipeline_get(pipeline_data['pipelineKey'])
+        else:
+            new_pipeline = add_attributes(pipeline_data, Pipeline(self))
 
-        print('New Pipeline created')
+        logger.debug('New Pipeline created')
 
         return new_pipeline
 
@@ -202,20 +1789,25 @@ class StreakConnection:
         :return:
         """
         response_on_delete = self.delete_api_data('pipelines/' + pipeline_key)
+        self.invalidate_schema(pipeline_key)
 
         if not response_on_delete['success']:
-            raise Exception('Failed to delete Pipeline')
+            raise StreakAPIError('Failed to delete Pipeline')
         else:
-            print('Pipeline deleted')
+            logger.debug('Pipeline deleted')
 
-    def pipeline_edit(self, pipeline_key: str, pipeline_params: dict):
+    def pipeline_edit(self, pipeline_key: str, pipeline_params: dict, refresh=False):
         pipeline_update_result = self.post_api_data('pipelines/' + pipeline_key, pipeline_params)
+        self.invalidate_schema(pipeline_key)
 
         if 'success' in pipeline_update_result.keys():
-            raise Exception(pipeline_update_result['error'])
+            raise StreakAPIError(pipeline_update_result['error'])
 
-        print('Pipeline updated')
-        updated_pipeline = self.pipeline_get(pipeline_update_result['pipelineKey'])
+        logger.debug('Pipeline updated')
+        if refresh:
+            updated_pipeline = self.pipeline_get(pipeline_update_result['pipelineKey'])
+        else:
+            updated_pipeline = add_attributes(pipeline_update_result, Pipeline(self))
         return updated_pipeline
 
     def box_get_all(self):
@@ -232,6 +1824,27 @@ class StreakConnection:
             boxes_list.append(add_attributes(box_data, Box(self)))
         return boxes_list
 
+    def iter_boxes(self, page_size=None):
+        """
+        Yields all Boxes one at a time while the response is being downloaded
+        :param page_size: fetch boxes in pages of this size, None for a single request
+        :return: generator of Boxes
+        """
+        for box_data in self.iter_paged_api_data('boxes/', page_size):
+            yield add_attributes(box_data, Box(self))
+
+    def iter_boxes_in_pipeline(self, pipeline_key: str, page_size=None):
+        """
+        Yields Boxes of pipeline one at a time while the response is being downloaded
+        # >>> for box in streak.iter_boxes_in_pipeline(pipeline_key, page_size=1000):
+        # ...     print(box.name)
+        :param pipeline_key: string
+        :param page_size: fetch boxes in pages of this size, None for a single request
+        :return: generator of Boxes
+        """
+        for box_data in self.iter_paged_api_data('pipelines/%s/boxes' % pipeline_key, page_size):
+            yield add_attributes(box_data, Box(self))
+
     def box_get(self, box_key: str):
         """
         Gets Box by key
@@ -244,27 +1857,87 @@ class StreakConnection:
         box_data = self.get_api_data('boxes/' + box_key)
 
         if 'success' in box_data.keys():
-            raise Exception(box_data['error'])
+            raise StreakAPIError(box_data['error'])
 
         box = add_attributes(box_data, Box(self))
         return box
 
-    def box_create(self, pipeline_key: str, box_params: dict):
+    def box_create(self, pipeline_key: str, box_params: dict, refresh=False):
         """
         Creates and returns Box with given params
         :param box_params: dict of params
+        :param refresh: re-read Box from server instead of building it from the create response
         :return: newly created Pipeline instance
         """
         box_data = self.put_api_data('pipelines/%s/boxes' % pipeline_key, box_params)
 
         if 'success' in box_data.keys():
-            raise Exception(box_data['error'])
+            raise StreakAPIError(box_data['error'])
 
-        new_box = self.box_get(box_data['boxKey'])
+        if refresh:
+            new_box = self.box_get(box_data['boxKey'])
+        else:
+            new_box = add_attributes(box_data, Box(self))
 
-        print('New Box created')
+        logger.debug('New Box created')
+        self.run_hooks('box_written', new_box)
         return new_box
 
+    def box_create_with_fields(self, pipeline_key: str, box_params: dict):
+        """
+        Creates Box, then sets initial values of fields given as box_params['fields'] = {field_key: value}
+        If setting a field fails the Box is already created, the raised exception carries it as .box
+        :param pipeline_key: string
+        :param box_params: dict of params, optionally with 'fields'
+        :return: newly created Box instance
+        """
+        box_params = dict(box_params)
+        field_values = box_params.pop('fields', None) or {}
+        new_box = self.box_create(pipeline_key, box_params)
+        if not field_values:
+            return new_box
+
+        fields = dict(getattr(new_box, 'fields', None) or {})
+        try:
+            for field_key, value in field_values.items():
+                fields[field_key] = self.value_edit_in_box(new_box.boxKey, field_key, {'value': value}).value
+        except Exception as error:
+            error.box = new_box
+            raise
+        finally:
+            new_box.fields = fields
+        return new_box
+
+    def iter_box_create_many(self, pipeline_key: str, box_params_list, concurrency=8, deadline=None):
+        """
+        Creates boxes concurrently, yields (box_params, Box) in input order
+        Input is consumed lazily, so a generator over a million-row file keeps memory bounded.
+        A box that failed is yielded with the exception instead of the Box, the rest go on
+        # >>> rows = ({'name': row['company'], 'fields': {'1001': row['email']}} for row in csv.DictReader(f))
+        # >>> for box_params, box in streak.iter_box_create_many(pipeline_key, rows, concurrency=16):
+        # ...     if isinstance(box, Exception): ...
+        :param pipeline_key: string
+        :param box_params_list: iterable of box params dicts, see box_create_with_fields for 'fields'
+        :param concurrency: number of creates in flight
+        :param deadline: seconds the whole batch may take
+        :return: generator of (box_params, Box or Exception)
+        """
+        at = self.deadline_at(deadline)
+        return map_concurrently(functools.partial(self.call_with_deadline, at, self.box_create_with_fields,
+                                                  pipeline_key),
+                                box_params_list, concurrency)
+
+    def box_create_many(self, pipeline_key: str, box_params_list, concurrency=8, deadline=None):
+        """
+        Creates boxes concurrently
+        :param pipeline_key: string
+        :param box_params_list: iterable of box params dicts
+        :param concurrency: number of creates in flight
+        :param deadline: seconds the whole batch may take
+        :return: list of Box, or the Exception raised for that box, in input order
+        """
+        return [box for _, box in self.iter_box_create_many(pipeline_key, box_params_list, concurrency, deadline)]
+
     def box_delete(self, box_key: str):
         """
         Deletes Box by key
@@ -274,108 +1947,133 @@ class StreakConnection:
         response_on_delete = self.delete_api_data('boxes/' + box_key)
 
         if not response_on_delete['success']:
-            raise Exception('Failed to delete Box')
+            raise StreakAPIError('Failed to delete Box')
         else:
-            print('Box deleted')
+            logger.debug('Box deleted')
+            self.run_hooks('box_deleted', box_key)
 
-    def box_edit(self, box_key: str, box_params: dict):
+    def box_edit(self, box_key: str, box_params: dict, refresh=False):
         box_edit_result = self.post_api_data('boxes/' + box_key, box_params)
 
         if 'success' in box_edit_result.keys():
-            raise Exception(box_edit_result['error'])
+            raise StreakAPIError(box_edit_result['error'])
 
-        print('Box updated')
-        updated_box = self.box_get(box_edit_result['boxKey'])
+        logger.debug('Box updated')
+        if refresh:
+            updated_box = self.box_get(box_edit_result['boxKey'])
+        else:
+            updated_box = add_attributes(box_edit_result, Box(self))
+        self.run_hooks('box_written', updated_box)
         return updated_box
 
     def stage_get_all_in_pipeline(self, pipeline_key: str):
         stages_list = []
-        stages_data = self.get_api_data('pipelines/%s/stages' % pipeline_key)
+        stages_data = self.get_schema_data('stages', pipeline_key, None, 'pipelines/%s/stages' % pipeline_key)
         for stage_data in stages_data.values():
             stages_list.append(add_attributes(stage_data, Stage(self, pipeline_key)))
         return stages_list
 
     def stage_get_specific_in_pipeline(self, pipeline_key: str, stage_key: str):
-        stage_data = self.get_api_data('pipelines/%s/stages/%s' % (pipeline_key, stage_key))
+        stage_data = self.get_schema_data('stage', pipeline_key, stage_key,
+                                          'pipelines/%s/stages/%s' % (pipeline_key, stage_key))
 
         if 'success' in stage_data.keys():
-            raise Exception(stage_data['error'])
+            raise StreakAPIError(stage_data['error'])
 
         stage = add_attributes(stage_data, Stage(self, pipeline_key))
         return stage
 
-    def stage_create_in_pipeline(self, pipeline_key: str, stage_params: dict):
+    def stage_create_in_pipeline(self, pipeline_key: str, stage_params: dict, refresh=False):
         stage_data = self.put_api_data('pipelines/%s/stages' % pipeline_key, stage_params)
+        self.invalidate_schema(pipeline_key)
 
         if 'success' in stage_data.keys():
-            raise Exception(stage_data['error'])
+            raise StreakAPIError(stage_data['error'])
 
-        new_stage = self.stage_get_specific_in_pipeline(pipeline_key, stage_data['key'])
+        if refresh:
+            new_stage = self.stage_get_specific_in_pipeline(pipeline_key, stage_data['key'])
+        else:
+            new_stage = add_attributes(stage_data, Stage(self, pipeline_key))
 
-        print('New Stage created')
+        logger.debug('New Stage created')
         return new_stage
 
     def stage_delete_in_pipeline(self, pipeline_key: str, stage_key: str):
         response_on_delete = self.delete_api_data('pipelines/%s/stages/%s' % (pipeline_key, stage_key))
+        self.invalidate_schema(pipeline_key)
 
         if not response_on_delete['success']:
-            raise Exception('Failed to delete Stage')
+            raise StreakAPIError('Failed to delete Stage')
         else:
-            print('Stage deleted')
+            logger.debug('Stage deleted')
 
-    def stage_edit_in_pipeline(self, pipeline_key: str, stage_key: str, stage_params: dict):
+    def stage_edit_in_pipeline(self, pipeline_key: str, stage_key: str, stage_params: dict, refresh=False):
         stage_edit_result = self.post_api_data('pipelines/%s/stages/%s' % (pipeline_key, stage_key), stage_params)
+        self.invalidate_schema(pipeline_key)
 
         if 'success' in stage_edit_result.keys():
-            raise Exception(stage_edit_result['error'])
+            raise StreakAPIError(stage_edit_result['error'])
 
-        print('Stage edited')
-        stage_edited = self.stage_get_specific_in_pipeline(pipeline_key, stage_edit_result['key'])
+        logger.debug('Stage edited')
+        if refresh:
+            stage_edited = self.stage_get_specific_in_pipeline(pipeline_key, stage_edit_result['key'])
+        else:
+            stage_edited = add_attributes(stage_edit_result, Stage(self, pipeline_key))
         return stage_edited
 
     def field_get_all_in_pipeline(self, pipeline_key: str):
         field_list = []
-        fields_data = self.get_api_data('pipelines/%s/fields' % pipeline_key)
+        fields_data = self.get_schema_data('fields', pipeline_key, None, 'pipelines/%s/fields' % pipeline_key)
         for field_data in fields_data:
             field_list.append(add_attributes(field_data, Field(self, pipeline_key)))
         return field_list
 
     def field_get_specific_in_pipeline(self, pipeline_key: str, field_key: str):
-        field_data = self.get_api_data('pipelines/%s/fields/%s' % (pipeline_key, field_key))
+        field_data = self.get_schema_data('field', pipeline_key, field_key,
+                                          'pipelines/%s/fields/%s' % (pipeline_key, field_key))
 
         if 'success' in field_data.keys():
-            raise Exception(field_data['error'])
+            raise StreakAPIError(field_data['error'])
 
         field = add_attributes(field_data, Field(self, pipeline_key))
         return field
 
-    def field_create_in_pipeline(self, pipeline_key: str, field_params: dict):
+    def field_create_in_pipeline(self, pipeline_key: str, field_params: dict, refresh=False):
         field_data = self.put_api_data('pipelines/%s/fields' % pipeline_key, field_params)
+        self.invalidate_schema(pipeline_key)
 
         if 'success' in field_data.keys():
-            raise Exception(field_data['error'])
+            raise StreakAPIError(field_data['error'])
 
-        new_field = self.field_get_specific_in_pipeline(pipeline_key, field_data['key'])
+        if refresh:
+            new_field = self.field_get_specific_in_pipeline(pipeline_key, field_data['key'])
+        else:
+            new_field = add_attributes(field_data, Field(self, pipeline_key))
 
-        print('New Field created')
+        logger.debug('New Field created')
         return new_field
 
     def field_delete_in_pipeline(self, pipeline_key: str, field_key: str):
         response_on_delete = self.delete_api_data('pipelines/%s/fields/%s' % (pipeline_key, field_key))
+        self.invalidate_schema(pipeline_key)
 
         if not response_on_delete['success']:
-            raise Exception('Failed to delete Field')
+            raise StreakAPIError('Failed to delete Field')
         else:
-            print('Field deleted')
+            logger.debug('Field deleted')
 
-    def field_edit_in_pipeline(self, pipeline_key: str, field_key: str, field_params: dict):
+    def field_edit_in_pipeline(self, pipeline_key: str, field_key: str, field_params: dict, refresh=False):
         field_edit_result = self.post_api_data('pipelines/%s/fields/%s' % (pipeline_key, field_key), field_params)
+        self.invalidate_schema(pipeline_key)
 
         if 'success' in field_edit_result.keys():
-            raise Exception(field_edit_result['error'])
+            raise StreakAPIError(field_edit_result['error'])
 
-        print('Field edited')
-        field_edited = self.field_get_specific_in_pipeline(pipeline_key, field_edit_result['key'])
+        logger.debug('Field edited')
+        if refresh:
+            field_edited = self.field_get_specific_in_pipeline(pipeline_key, field_edit_result['key'])
+        else:
+            field_edited = add_attributes(field_edit_result, Field(self, pipeline_key))
         return field_edited
 
     def field_get_values_for_box(self, box_key: str):
@@ -388,6 +2086,10 @@ class StreakConnection:
     def value_get_all_in_box(self, box_key: str):
         value_list = []
         values_data = self.get_api_data('boxes/%s/fields' % box_key)
+
+        if isinstance(values_data, dict) and 'success' in values_data.keys():
+            raise StreakAPIError(values_data['error'])
+
         for value_data in values_data:
             # new_value = Value(self, box_key)
             # new_value.key = value_data['key']
@@ -395,30 +2097,466 @@ class StreakConnection:
             value_list.append(add_attributes(value_data, Value(self, box_key)))
         return value_list
 
+    def iter_values_in_boxes(self, box_keys, max_workers=8, deadline=None):
+        """
+        Fetches values of many boxes concurrently, yields (box_key, list of Values) in box_keys order
+        A box that failed to load is yielded with the exception instead of the list, the rest go on
+        # >>> for box_key, values in streak.iter_values_in_boxes(box_keys, max_workers=16):
+        # ...     if isinstance(values, Exception): ...
+        :param box_keys: iterable of box keys, consumed lazily
+        :param max_workers: number of requests in flight
+        :param deadline: seconds the whole batch may take, boxes not fetched by then fail with StreakTimeoutError
+        :return: generator of (box_key, list of Values or Exception)
+        """
+        at = self.deadline_at(deadline)
+        return map_concurrently(functools.partial(self.call_with_deadline, at, self.value_get_all_in_box),
+                                box_keys, max_workers)
+
+    def value_get_all_in_boxes(self, box_keys, max_workers=8, deadline=None):
+        """
+        Fetches values of many boxes concurrently
+        :param box_keys: iterable of box keys
+        :param max_workers: number of requests in flight
+        :param deadline: seconds the whole batch may take
+        :return: dict box_key: list of Values, or the Exception raised for that box
+        """
+        return dict(self.iter_values_in_boxes(box_keys, max_workers, deadline))
+
     def value_get_specific_in_box(self, box_key: str, field_key: str):
         value_data = self.get_api_data('boxes/%s/fields/%s' % (box_key, field_key))
 
         if 'success' in value_data.keys():
-            raise Exception(value_data['error'])
+            raise StreakAPIError(value_data['error'])
 
         value = add_attributes(value_data, Value(self, box_key))
         return value
 
-    def value_edit_in_box(self, box_key: str, field_key: str, field_params: dict):
+    def value_edit_in_box(self, box_key: str, field_key: str, field_params: dict, refresh=False):
         value_edit_result = self.post_api_data('boxes/%s/fields/%s' % (box_key, field_key), field_params)
 
         if 'success' in value_edit_result.keys():
-            raise Exception(value_edit_result['error'])
+            raise StreakAPIError(value_edit_result['error'])
 
-        print('Value edited')
-        value_edited = self.value_get_specific_in_box(box_key, value_edit_result['key'])
+        logger.debug('Value edited')
+        if refresh:
+            value_edited = self.value_get_specific_in_box(box_key, value_edit_result['key'])
+        else:
+            value_edited = add_attributes(value_edit_result, Value(self, box_key))
+        self.run_hooks('value_written', value_edited)
         return value_edited
 
+    def value_edit_many(self, updates, current_values=None, concurrency=8, deadline=None):
+        """
+        Sets many field values concurrently, skipping writes that would not change anything
+        Current values come from current_values when the box is in it (e.g. StreakSync.box_values),
+        otherwise from one value_get_all_in_box per box. Boxes whose values could not be read are written blindly.
+        Successful writes are applied to current_values, so it stays usable as a cache for the next batch.
+        Reads and writes overlap: writes of a box start as soon as its values arrive.
+        # >>> streak.value_edit_many([(box_key, '1001', 'ACME'), (box_key, '1002', 42)])
+        # {'updates': 2, 'skipped': 1, 'written': 1, 'failed': 0, 'errors': {}}
+        :param updates: iterable of (box_key, field_key, value), the last one wins for the same box and field
+        :param current_values: dict box_key: {field_key: value}, or None
+        :param concurrency: number of requests in flight
+        :param deadline: seconds the whole batch may take
+        :return: dict with counts and errors {(box_key, field_key): Exception}
+        """
+        at = self.deadline_at(deadline)
+        if current_values is None:
+            current_values = {}
+        wanted = {}
+        count = 0
+        for box_key, field_key, value in updates:
+            wanted.setdefault(box_key, {})[field_key] = value
+            count += 1
+        stats = {'updates': count, 'skipped': 0, 'written': 0, 'failed': 0, 'errors': {}}
+
+        def load_values(box_key):
+            if box_key in current_values:
+                return current_values[box_key]
+            return {value.key: value.value for value in self.value_get_all_in_box(box_key)}
+
+        def changed_values():
+            loaded = map_concurrently(functools.partial(self.call_with_deadline, at, load_values),
+                                      wanted, concurrency)
+            for box_key, current in loaded:
+                if isinstance(current, Exception):
+                    logger.debug('Values of Box %s not loaded, writing all: %s', box_key, current)
+                    current = {}
+                for field_key, value in wanted[box_key].items():
+                    if field_key in current and current[field_key] == value:
+                        stats['skipped'] += 1
+                    else:
+                        yield box_key, field_key, value
+
+        def write_value(update):
+            box_key, field_key, value = update
+            return self.value_edit_in_box(box_key, field_key, {'value': value})
+
+        written = map_concurrently(functools.partial(self.call_with_deadline, at, write_value),
+                                   changed_values(), concurrency)
+        for (box_key, field_key, _), result in written:
+            if isinstance(result, Exception):
+                stats['failed'] += 1
+                stats['errors'][box_key, field_key] = result
+            else:
+                stats['written'] += 1
+                if box_key in current_values:
+                    current_values[box_key][field_key] = result.value
+        # duplicates of the same box and field were never written
+        stats['skipped'] += count - sum(len(values) for values in wanted.values())
+        return stats
+
+    def prefetch(self, objects, *relations, max_workers=8):
+        """
+        Loads relationships of many models in as few requests as possible and caches them on the models
+        'pipeline' and 'stage' of Boxes take one request per pipeline, 'values' of Boxes run concurrently,
+        'boxes' of Stages take one box listing per pipeline. Objects that already have a relationship
+        loaded are skipped, a failed one is left unloaded and is loaded again on access.
+        # >>> boxes = streak.box_get_all_in_pipeline(pipeline_key)
+        # >>> streak.prefetch(boxes, 'stage', 'values')
+        # >>> [(box.stage.name, len(box.values)) for box in boxes]
+        :param objects: list of Boxes or Stages
+        :param relations: names of relationships: 'pipeline', 'stage', 'values' (Box) or 'boxes' (Stage)
+        :param max_workers: number of requests in flight for 'values'
+        :return: dict relationship: list of exceptions of objects that failed to load it
+        """
+        loaders = {'pipeline': self.prefetch_pipelines, 'stage': self.prefetch_stages,
+                   'values': self.prefetch_values, 'boxes': self.prefetch_stage_boxes}
+        errors = {}
+        for relation in relations:
+            if relation not in loaders:
+                raise Exception('[!] Unknown relationship %r, choose one of %s' % (relation, ', '.join(loaders)))
+            missing = [obj for obj in objects if not obj.is_related_loaded(relation)]
+            errors[relation] = loaders[relation](missing, max_workers) if missing else []
+        return errors
+
+    def prefetch_pipelines(self, boxes, max_workers):
+        errors = []
+        for pipeline_key, result in map_concurrently(self.pipeline_get, {box.pipelineKey for box in boxes},
+                                                     max_workers):
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
+            for box in boxes:
+                if box.pipelineKey == pipeline_key:
+                    box.set_related('pipeline', result)
+        return errors
+
+    def prefetch_stages(self, boxes, max_workers):
+        errors = []
+        loaded = map_concurrently(self.stage_get_all_in_pipeline, {box.pipelineKey for box in boxes}, max_workers)
+        for pipeline_key, result in loaded:
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
+            stages = {stage.key: stage for stage in result}
+            for box in boxes:
+                if box.pipelineKey == pipeline_key:
+                    box.set_related('stage', stages.get(getattr(box, 'stageKey', None)))
+        return errors
+
+    def prefetch_values(self, boxes, max_workers):
+        errors = []
+        boxes_by_key = {}
+        for box in boxes:
+            boxes_by_key.setdefault(box.boxKey, []).append(box)
+        for box_key, result in self.iter_values_in_boxes(boxes_by_key, max_workers):
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
+            for box in boxes_by_key[box_key]:
+                box.set_related('values', result)
+        return errors
+
+    def prefetch_stage_boxes(self, stages, max_workers):
+        errors = []
+        for pipeline_key in {stage.pipeline_key for stage in stages}:
+            boxes_by_stage = {}
+            try:
+                for box in self.iter_boxes_in_pipeline(pipeline_key):
+                    boxes_by_stage.setdefault(getattr(box, 'stageKey', None), []).append(box)
+            except StreakError as error:
+                errors.append(error)
+                continue
+            for stage in stages:
+                if stage.pipeline_key == pipeline_key:
+                    stage.set_related('boxes', boxes_by_stage.get(stage.key, []))
+                    for box in stage.boxes:
+                        box.set_related('stage', stage)
+        return errors
+
+
+class Shard:
+    """
+    One api key of ShardedStreakConnection with its connection, weight and health
+    A key is marked unhealthy for cooldown seconds after threshold consecutive failures,
+    every next failure while it is unhealthy doubles the cooldown, the first success resets it
+    """
+    __slots__ = ('connection', 'weight', 'current_weight', 'in_flight', 'requests', 'failures',
+                 'consecutive_failures', 'cooldown', 'unhealthy_until')
+
+    def __init__(self, connection, weight=1):
+        self.connection = connection
+        self.weight = weight
+        self.current_weight = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown = None
+        self.unhealthy_until = 0
 
-class User:
-    def __init__(self, streak_connection):
-        self.streak_connection = streak_connection
-        self.displayName = 'n/a'
+    def __repr__(self):
+        return '<Shard: ...%s>' % self.connection.settings.api_key[-4:]
+
+    def is_healthy(self, now):
+        return now >= self.unhealthy_until
+
+    def mark(self, failed: bool, threshold: int, cooldown: float):
+        if not failed:
+            self.consecutive_failures = 0
+            self.cooldown = None
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= threshold:
+            self.cooldown = cooldown if self.cooldown is None else min(self.cooldown * 2, cooldown * 32)
+            self.unhealthy_until = time.monotonic() + self.cooldown
+            logger.debug('[!] Api key ...%s unhealthy for %s s', self.connection.settings.api_key[-4:], self.cooldown)
+
+
+class ShardedStreakConnection(StreakConnection):
+    """
+    StreakConnection spreading requests across several api keys with access to the same pipelines
+    Every key has its own session, rate limiter and health. Each request goes to a healthy key picked by
+    smooth weighted round robin, or to the key with the fewest requests in flight per weight ('least_loaded').
+    Requests that failed on one key (errors after retries, 401/403) are sent to the next key if their method
+    is in retry_methods. Concurrent work (iter_values_in_boxes, box_create_many, prefetch...) scales with
+    the number of keys, a single request such as box_get_all_in_pipeline still runs on one key.
+    # >>> streak = ShardedStreakConnection([key_1, key_2, key_3], weights=[2, 1, 1], rate_limit=10)
+    # >>> streak.value_get_all_in_boxes(box_keys, max_workers=30)
+    # >>> streak.shard_stats()
+    """
+    strategies = ('round_robin', 'least_loaded')
+    failure_statuses = (401, 403)
+    key_errors = ('invalid api key',)
+
+    def __init__(self, api_keys, weights=None, strategy='round_robin', health_threshold=3, health_cooldown=30,
+                 **settings):
+        """
+        :param api_keys: list of api keys
+        :param weights: list of positive ints, share of requests of every key, all 1 by default
+        :param strategy: 'round_robin' or 'least_loaded'
+        :param health_threshold: consecutive failures that make a key unhealthy
+        :param health_cooldown: seconds an unhealthy key gets no requests (unless all keys are unhealthy)
+        :param settings: StreakConnection settings, used for every key
+        """
+        api_keys = list(api_keys)
+        if not api_keys:
+            raise Exception('[!] No api keys, please supply at least one')
+        if strategy not in self.strategies:
+            raise Exception('[!] Unknown strategy %r, choose one of %s' % (strategy, ', '.join(self.strategies)))
+        weights = list(weights or [1] * len(api_keys))
+        if len(weights) != len(api_keys) or min(weights) <= 0:
+            raise Exception('[!] Supply one positive weight per api key')
+        super().__init__(api_keys[0], **settings)
+        self.strategy = strategy
+        self.health_threshold = health_threshold
+        self.health_cooldown = health_cooldown
+        self.shards_lock = threading.Lock()
+        self.shards = []
+        for api_key, weight in zip(api_keys, weights):
+            connection = StreakConnection(api_key, **settings)
+            # shards report to the hooks and stats of this connection and honour its deadlines
+            connection.hooks = self.hooks
+            connection.stats = self.stats
+            connection._local = self._local
+            self.shards.append(Shard(connection, weight))
+
+    def __repr__(self):
+        return '<Sharded Streak Connection Object: %s keys>' % len(self.shards)
+
+    def close(self):
+        for shard in self.shards:
+            shard.connection.close()
+
+    def throttle_stats(self):
+        """
+        :return: list of throttle counters of every api key
+        """
+        return [shard.connection.throttle_stats() for shard in self.shards]
+
+    def shard_stats(self):
+        """
+        :return: list of dicts with requests, failures and health of every api key
+        """
+        now = time.monotonic()
+        with self.shards_lock:
+            return [{
+                'api_key': '...' + shard.connection.settings.api_key[-4:],
+                'weight': shard.weight,
+                'in_flight': shard.in_flight,
+                'requests': shard.requests,
+                'failures': shard.failures,
+                'healthy': shard.is_healthy(now),
+                'unhealthy_for': round(max(0.0, shard.unhealthy_until - now), 3),
+            } for shard in self.shards]
+
+    def pick_shard(self, tried):
+        """
+        :param tried: shards the request already failed on
+        :return: Shard for the next attempt
+        """
+        now = time.monotonic()
+        with self.shards_lock:
+            candidates = [shard for shard in self.shards if shard not in tried]
+            healthy = [shard for shard in candidates if shard.is_healthy(now)]
+            if not healthy:
+                # every key is cooling down, use the one that recovers first rather than failing
+                healthy = [min(candidates, key=lambda shard: shard.unhealthy_until)]
+            if self.strategy == 'least_loaded':
+                shard = min(healthy, key=lambda shard: ((shard.in_flight + 1) / shard.weight, shard.requests))
+            else:
+                total = 0
+                for candidate in healthy:
+                    candidate.current_weight += candidate.weight
+                    total += candidate.weight
+                shard = max(healthy, key=lambda candidate: candidate.current_weight)
+                shard.current_weight -= total
+            shard.in_flight += 1
+            shard.requests += 1
+        return shard
+
+    def is_key_failure(self, response):
+        """
+        :return: True if response says the api key was refused, as opposed to an error of the request itself
+        """
+        if response.status_code in self.failure_statuses:
+            return True
+        if response.status_code != 400:
+            return False
+        try:
+            error_data = self.codec.loads(response.content)
+        except ValueError:
+            return False
+        return isinstance(error_data, dict) and error_data.get('error') in self.key_errors
+
+    def send_request(self, method: str, api_full_path: str, **kwargs):
+        """
+        Sends request through a shard picked by strategy, see StreakConnection.send_request
+        """
+        tried = []
+        while True:
+            shard = self.pick_shard(tried)
+            tried.append(shard)
+            failure = None
+            response = None
+            try:
+                response = shard.connection.send_request(method, api_full_path, **kwargs)
+            except StreakError as error:
+                failure = error
+            finally:
+                # other exceptions (e.g. a malformed url) propagate as they are and do not count against the key
+                with self.shards_lock:
+                    shard.in_flight -= 1
+
+            failed = failure is not None or (response is not None and self.is_key_failure(response))
+            with self.shards_lock:
+                shard.mark(failed, self.health_threshold, self.health_cooldown)
+
+            if not failed:
+                return response
+            if method not in self.settings.retry_methods or len(tried) == len(self.shards):
+                if failure is not None:
+                    raise failure
+                return response
+            if response is not None:
+                response.close()
+            logger.debug('[API %s] %s failed on %r, trying next api key', method, api_full_path, shard)
+
+
+class AsyncStreakConnection:
+    """
+    asyncio counterpart of StreakConnection, every method of StreakConnection is available as a coroutine
+    # >>> async with AsyncStreakConnection(api_key, max_concurrency=50) as streak:
+    # ...     boxes = await asyncio.gather(*[streak.box_get(key) for key in box_keys])
+    Requests run on the pooled session of a wrapped StreakConnection in a dedicated thread pool,
+    at most max_concurrency of them are in flight at once, it is also the max_concurrency setting of the
+    wrapped connection, so bulk methods (box_create_many, value_edit_many, prefetch...) that fan out over
+    their own threads stay within it too. Returned models are bound to the wrapped StreakConnection,
+    so their own methods (delete_self etc.) are blocking.
+    """
+    methods = (
+        'get_api_data', 'put_api_data', 'delete_api_data', 'post_api_data', 'get_pipelines_data', 'get_fields_data',
+        'user_get_me', 'user_get',
+        'pipeline_get_all', 'pipeline_get', 'pipeline_create', 'pipeline_delete', 'pipeline_edit',
+        'box_get_all', 'box_get_all_in_pipeline', 'box_get', 'box_create', 'box_create_with_fields',
+        'box_create_many', 'box_delete', 'box_edit',
+        'stage_get_all_in_pipeline', 'stage_get_specific_in_pipeline', 'stage_create_in_pipeline',
+        'stage_delete_in_pipeline', 'stage_edit_in_pipeline',
+        'field_get_all_in_pipeline', 'field_get_specific_in_pipeline', 'field_create_in_pipeline',
+        'field_delete_in_pipeline', 'field_edit_in_pipeline', 'field_get_values_for_box',
+        'value_get_all_in_box', 'value_get_all_in_boxes', 'value_get_specific_in_box', 'value_edit_in_box',
+        'value_edit_many', 'prefetch',
+    )
+
+    def __init__(self, api_key=TEST_API_KEY, max_concurrency=10, **settings):
+        # the semaphore only sees one call per bulk method, the rate limiter of the key sees every request
+        settings.setdefault('max_concurrency', max_concurrency)
+        settings.setdefault('pool_maxsize', max_concurrency)
+        self.streak_connection = StreakConnection(api_key, **settings)
+        self.settings = self.streak_connection.settings
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='streak')
+
+    def __repr__(self):
+        return '<Async Streak Connection Object>'
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """
+        Waits for running requests, then closes thread pool and pooled sockets
+        :return:
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+        self.streak_connection.close()
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs blocking func in the thread pool once a concurrency slot is free
+        :param func: callable
+        :return: func result
+        """
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+
+def _async_method(name):
+    sync_method = getattr(StreakConnection, name)
+
+    async def method(self, *args, **kwargs):
+        return await self.run(getattr(self.streak_connection, name), *args, **kwargs)
+
+    method.__name__ = name
+    method.__qualname__ = 'AsyncStreakConnection.' + name
+    method.__doc__ = sync_method.__doc__
+    return method
+
+
+for _method_name in AsyncStreakConnection.methods:
+    setattr(AsyncStreakConnection, _method_name, _async_method(_method_name))
+
+
+class User(StreakObject):
+    __slots__ = ()
+    _defaults = {'displayName': 'n/a'}
 
     def __repr__(self):
         return '<User: \'%s>\'' % self.displayName
@@ -430,11 +2568,9 @@ class User:
         # return self
 
 
-class Pipeline:
-    def __init__(self, streak_connection):
-        self.streak_connection = streak_connection
-        self.name = ''
-        self.pipelineKey = ''
+class Pipeline(StreakObject):
+    __slots__ = ()
+    _defaults = {'name': '', 'pipelineKey': ''}
 
     def __repr__(self):
         return '<Pipeline: \'%s>\'' % self.name
@@ -449,11 +2585,9 @@ class Pipeline:
         # return self
 
 
-class Box:
-    def __init__(self, streak_connection):
-        self.streak_connection = streak_connection
-        self.name = ''
-        self.pipelineKey = ''
+class Box(StreakObject):
+    __slots__ = ()
+    _defaults = {'name': '', 'pipelineKey': ''}
 
     def __repr__(self):
         return '<Box: \'%s>\'' % self.name
@@ -461,12 +2595,34 @@ class Box:
     def delete_self(self):
         self.streak_connection.box_delete(self.boxKey)
 
+    @property
+    def pipeline(self):
+        return self.related('pipeline', lambda: self.streak_connection.pipeline_get(self.pipelineKey))
+
+    @property
+    def stage(self):
+        """
+        Stage the box is in, None if it has no stage
+        """
+        def load():
+            stage_key = getattr(self, 'stageKey', None)
+            if stage_key is None:
+                return None
+            return self.streak_connection.stage_get_specific_in_pipeline(self.pipelineKey, stage_key)
+        return self.related('stage', load)
+
+    @property
+    def values(self):
+        return self.related('values', lambda: self.streak_connection.value_get_all_in_box(self.boxKey))
+
+
+class Stage(StreakObject):
+    __slots__ = ('pipeline_key',)
+    _defaults = {'name': ''}
 
-class Stage:
     def __init__(self, streak_connection, pipeline_key):
-        self.streak_connection = streak_connection
-        self.pipeline_key = pipeline_key
-        self.name = ''
+        super().__init__(streak_connection)
+        object.__setattr__(self, 'pipeline_key', pipeline_key)
 
     def __repr__(self):
         return '<Stage: \'%s>\'' % self.name
@@ -474,12 +2630,27 @@ class Stage:
     def delete_self(self):
         self.streak_connection.stage_delete_in_pipeline(self.pipeline_key, self.key)
 
+    @property
+    def boxes(self):
+        """
+        Boxes of the pipeline that are in this stage, their box.stage is this stage
+        """
+        def load():
+            boxes = [box for box in self.streak_connection.iter_boxes_in_pipeline(self.pipeline_key)
+                     if getattr(box, 'stageKey', None) == self.key]
+            for box in boxes:
+                box.set_related('stage', self)
+            return boxes
+        return self.related('boxes', load)
+
+
+class Field(StreakObject):
+    __slots__ = ('pipeline_key',)
+    _defaults = {'name': ''}
 
-class Field:
     def __init__(self, streak_connection, pipeline_key):
-        self.streak_connection = streak_connection
-        self.pipeline_key = pipeline_key
-        self.name = ''
+        super().__init__(streak_connection)
+        object.__setattr__(self, 'pipeline_key', pipeline_key)
 
     def __repr__(self):
         return '<Field: \'%s\'>' % self.name
@@ -488,15 +2659,188 @@ class Field:
         self.streak_connection.field_delete_in_pipeline(self.pipeline_key, self.key)
 
 
-class Value:
+class Value(StreakObject):
+    __slots__ = ('box_key',)
+    _defaults = {'value': ''}
+
     def __init__(self, streak_connection, box_key):
-        self.streak_connection = streak_connection
-        self.box_key = box_key
-        self.value = ''
+        super().__init__(streak_connection)
+        object.__setattr__(self, 'box_key', box_key)
 
     def __repr__(self):
         return "<Value: '%s'>" % self.value
 
 
+class Progress:
+    """
+    Counts records written by the command line tool, reports throughput to stderr
+    """
+
+    def __init__(self, enabled=False, interval=5.0, stream=None):
+        self.enabled = enabled
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.records = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+
+    def update(self, records=1):
+        self.records += records
+        if self.enabled and time.monotonic() - self.reported >= self.interval:
+            self.reported = time.monotonic()
+            self.stream.write('%s records, %.1f records/s\n' % (self.records, self.rate()))
+            self.stream.flush()
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.records / elapsed if elapsed else 0.0
+
+    def summary(self, streak_connection):
+        if not self.enabled:
+            return
+        requests_sent = sum(stats['count'] for stats in streak_connection.request_stats().values())
+        self.stream.write('%s records in %.2f s, %.1f records/s, %s requests\n' % (
+            self.records, time.monotonic() - self.started, self.rate(), requests_sent))
+        self.stream.flush()
+
+
+def _box_records(streak, boxes_data, args):
+    """
+    :return: generator of (box dict with selected fields, raw values list of the box or None without --values)
+    """
+    if not args.values:
+        for box_data in boxes_data:
+            yield {key: box_data[key] for key in args.fields if key in box_data} if args.fields else box_data, None
+        return
+
+    def load_values(box_data):
+        return streak.check_api_data(streak.get_api_data('boxes/%s/fields' % box_data['boxKey']),
+                                     'Failed to get values')
+
+    for box_data, values_data in map_concurrently(load_values, boxes_data, args.concurrency):
+        record = {key: box_data[key] for key in args.fields if key in box_data} if args.fields else box_data
+        if isinstance(values_data, Exception):
+            logger.warning('[!] Values of Box %s not exported: %s', box_data.get('boxKey'), values_data)
+            values_data = None
+        yield record, values_data
+
+
+def _command_export_boxes(streak, args, write):
+    if args.pipeline:
+        boxes_data = itertools.chain.from_iterable(
+            streak.iter_paged_api_data('pipelines/%s/boxes' % pipeline_key, args.page_size)
+            for pipeline_key in args.pipeline)
+    else:
+        boxes_data = streak.iter_paged_api_data('boxes/', args.page_size)
+    for record, values_data in _box_records(streak, boxes_data, args):
+        if args.values:
+            record = dict(record, values=values_data)
+        write(record)
+
+
+def _command_export_pipeline(streak, args, write):
+    # same lines as streak_export.OrgExporter writes, see its docstring
+    for pipeline_data in streak.get_pipelines_data(args.pipeline_keys or None):
+        pipeline_key = pipeline_data['pipelineKey']
+        write({'type': 'pipeline', 'data': pipeline_data, 'fields': streak.get_fields_data(pipeline_key)})
+        boxes_data = streak.iter_paged_api_data('pipelines/%s/boxes' % pipeline_key, args.page_size)
+        for record, values_data in _box_records(streak, boxes_data, args):
+            write({'type': 'box', 'data': record, 'values': values_data})
+
+
+def _command_dump_schema(streak, args, write):
+    for pipeline_data in streak.get_pipelines_data(args.pipeline_keys or None):
+        pipeline_key = pipeline_data['pipelineKey']
+        fields_data = streak.get_fields_data(pipeline_key)
+        stages_data = [(pipeline_data.get('stages') or {})[stage_key] for stage_key in
+                       pipeline_data.get('stageOrder') or (pipeline_data.get('stages') or {}).keys()]
+        write({'pipelineKey': pipeline_key, 'name': pipeline_data.get('name'), 'stages': stages_data,
+               'fields': fields_data})
+
+
+def _command_sync(streak, args, write):
+    from streak_sync import StreakSync
+    with StreakSync(streak, args.db_path, max_workers=args.concurrency) as sync:
+        write(sync.sync(args.pipeline or None))
+
+
+def _argument_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--api-key', default=os.environ.get('STREAK_API_KEY', TEST_API_KEY),
+                        help='Streak api key, STREAK_API_KEY environment variable by default')
+    common.add_argument('--api-endpoint', default='https://www.streak.com/api/v1/')
+    common.add_argument('--concurrency', type=int, default=8, help='requests in flight for per-box requests')
+    common.add_argument('--rate-limit', type=float, help='requests per second allowed for the api key')
+    common.add_argument('--progress', action='store_true', help='report progress and throughput to stderr')
+    common.add_argument('--verbose', action='store_true', help='log requests to stderr')
+
+    parser = argparse.ArgumentParser(prog='python -m streak_crm_python',
+                                     description='Streams Streak CRM data as NDJSON to stdout')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='export boxes').add_subparsers(dest='what', required=True)
+    for name, help_text in (('pipeline', 'pipelines with fields, followed by their boxes'),
+                            ('boxes', 'boxes of the account or of --pipeline')):
+        command = export.add_parser(name, help=help_text, parents=[common])
+        if name == 'pipeline':
+            command.add_argument('pipeline_keys', nargs='*', help='pipeline keys, all pipelines by default')
+        else:
+            command.add_argument('--pipeline', action='append', help='pipeline key, can be repeated')
+        command.add_argument('--fields', type=lambda value: [key.strip() for key in value.split(',') if key.strip()],
+                             help='comma separated box attributes to export, e.g. boxKey,name,stageKey')
+        command.add_argument('--values', action='store_true', help='add values of every box (one request per box)')
+        command.add_argument('--page-size', type=int, help='fetch boxes in pages of this size')
+
+    dump = commands.add_parser('dump', help='dump metadata').add_subparsers(dest='what', required=True)
+    schema = dump.add_parser('schema', help='pipelines with stages and fields, one line per pipeline',
+                             parents=[common])
+    schema.add_argument('pipeline_keys', nargs='*', help='pipeline keys, all pipelines by default')
+
+    sync = commands.add_parser('sync', help='mirror pipelines into SQLite, see streak_sync.py', parents=[common])
+    sync.add_argument('db_path')
+    sync.add_argument('--pipeline', action='append', help='pipeline key, can be repeated')
+    return parser
+
+
+def main(argv=None, output=None):
+    """
+    Command line entry point: python -m streak_crm_python export boxes --pipeline KEY --values
+    Records are written to output (stdout by default) as NDJSON while they arrive
+    :param argv: list of arguments, sys.argv[1:] by default
+    :param output: binary file object
+    :return: exit status
+    """
+    args = _argument_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr)
+    output = output or sys.stdout.buffer
+    commands = {('export', 'pipeline'): _command_export_pipeline, ('export', 'boxes'): _command_export_boxes,
+                ('dump', 'schema'): _command_dump_schema, ('sync', None): _command_sync}
+    command = commands[args.command, getattr(args, 'what', None)]
+
+    streak = StreakConnection(args.api_key, api_endpoint=args.api_endpoint, rate_limit=args.rate_limit,
+                              pool_maxsize=max(10, args.concurrency))
+    progress = Progress(args.progress)
+
+    def write(record):
+        output.write(streak.codec.dumps(record) + b'\n')
+        progress.update()
+
+    try:
+        command(streak, args, write)
+        output.flush()
+    except BrokenPipeError:
+        # reader of the pipe (e.g. head) is gone: stop quietly, without a second error when Python flushes stdout
+        if output is sys.stdout.buffer:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except StreakError as error:
+        sys.stderr.write('%s: %s\n' % (type(error).__name__, error))
+        return 1
+    finally:
+        streak.close()
+    progress.summary(streak)
+    return 0
+
+
 if __name__ == '__main__':
-    pass
+    sys.exit(main())
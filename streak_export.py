@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import csv
+import json
+import os
+import time
+
+from streak_crm_python import JsonCodec, StreakAPIError, StreakConnection, map_concurrently
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# box attribute -> column type, 'int' columns stay numbers, 'str' columns are text
+BOX_COLUMNS = (
+    ('boxKey', 'str'),
+    ('name', 'str'),
+    ('stageKey', 'str'),
+    ('stage', 'str'),
+    ('notes', 'str'),
+    ('creatorKey', 'str'),
+    ('assignedTo', 'str'),
+    ('creationTimestamp', 'int'),
+    ('lastUpdatedTimestamp', 'int'),
+    ('lastStageChangeTimestamp', 'int'),
+    ('totalNumberOfEmails', 'int'),
+)
+
+# field types whose values are numbers, values of the other types are exported as text
+INT_FIELD_TYPES = frozenset(['DATE'])
+
+
+def text_column(values):
+    """
+    :return: values as text, None stays None, lists and dicts become JSON
+    """
+    return [value if value is None or type(value) is str
+            else json.dumps(value) if isinstance(value, (list, dict))
+            else str(value)
+            for value in values]
+
+
+def int_column(values):
+    """
+    :return: values as ints, anything that is not a number becomes None
+    """
+    column = []
+    for value in values:
+        if value is None or type(value) is int:
+            column.append(value)
+        else:
+            try:
+                column.append(int(value))
+            except (TypeError, ValueError):
+                column.append(None)
+    return column
+
+
+class PipelineExporter:
+    """
+    Exports boxes of a pipeline as a table: one row per box, box attributes plus one column per pipeline field
+    Boxes are streamed from the api as plain dicts (no Box objects) and collected column by column
+    in batches of batch_size rows, so memory stays bounded by one batch whatever the size of the pipeline.
+    # >>> exporter = PipelineExporter(StreakConnection(api_key), pipeline_key, batch_size=10000)
+    # >>> exporter.write_csv('boxes.csv')
+    # 200000
+    # >>> for batch in exporter.iter_batches():
+    # ...     batch['name'], batch['Deal size']
+    Parquet and Arrow output need pyarrow
+    """
+
+    def __init__(self, streak_connection: StreakConnection, pipeline_key: str, batch_size=10000, page_size=None,
+                 box_columns=BOX_COLUMNS):
+        self.streak_connection = streak_connection
+        self.pipeline_key = pipeline_key
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.box_columns = tuple(box_columns)
+        self.stats = {'rows': 0, 'batches': 0, 'seconds': 0}
+
+        pipeline = streak_connection.pipeline_get(pipeline_key)
+        self.stage_names = {key: stage.get('name') for key, stage in (getattr(pipeline, 'stages', None) or {}).items()}
+        self.fields = streak_connection.field_get_all_in_pipeline(pipeline_key)
+
+        # field columns are named after fields, a name taken by a box column or another field gets the key appended
+        taken = {name for name, _ in self.box_columns}
+        self.field_columns = []
+        for field in self.fields:
+            name = field.name
+            if name in taken:
+                name = '%s (%s)' % (field.name, field.key)
+            taken.add(name)
+            kind = 'int' if getattr(field, 'type', None) in INT_FIELD_TYPES else 'str'
+            self.field_columns.append((name, field.key, kind))
+
+    def __repr__(self):
+        return '<Pipeline Exporter: \'%s\'>' % self.pipeline_key
+
+    @property
+    def columns(self):
+        """
+        :return: list of (column name, type) of exported table
+        """
+        return list(self.box_columns) + [(name, kind) for name, _, kind in self.field_columns]
+
+    def box_value(self, box_data: dict, key: str):
+        if key == 'stage':
+            return self.stage_names.get(box_data.get('stageKey'))
+        if key == 'assignedTo':
+            entries = box_data.get('assignedToSharingEntries') or []
+            return ';'.join(entry.get('email', '') for entry in entries) or None
+        return box_data.get(key)
+
+    def iter_batches(self):
+        """
+        Yields the table in batches of up to batch_size rows
+        :return: generator of dicts column name: list of values, all lists of a batch have the same length
+        """
+        started = time.monotonic()
+        box_keys = [key for key, _ in self.box_columns]
+        field_keys = [key for _, key, _ in self.field_columns]
+        batch_boxes = []
+        api_path = 'pipelines/%s/boxes' % self.pipeline_key
+        for box_data in self.streak_connection.iter_paged_api_data(api_path, self.page_size):
+            batch_boxes.append(box_data)
+            if len(batch_boxes) == self.batch_size:
+                yield self.build_batch(batch_boxes, box_keys, field_keys)
+                batch_boxes = []
+        if batch_boxes:
+            yield self.build_batch(batch_boxes, box_keys, field_keys)
+        self.stats['seconds'] = round(time.monotonic() - started, 3)
+
+    def build_batch(self, batch_boxes: list, box_keys: list, field_keys: list):
+        """
+        Turns a list of box dicts into columns
+        """
+        batch = {}
+        for (name, kind), key in zip(self.box_columns, box_keys):
+            values = [self.box_value(box_data, key) for box_data in batch_boxes]
+            batch[name] = int_column(values) if kind == 'int' else text_column(values)
+
+        all_fields = [box_data.get('fields') or {} for box_data in batch_boxes]
+        for (name, _, kind), key in zip(self.field_columns, field_keys):
+            values = [fields.get(key) for fields in all_fields]
+            batch[name] = int_column(values) if kind == 'int' else text_column(values)
+
+        self.stats['rows'] += len(batch_boxes)
+        self.stats['batches'] += 1
+        return batch
+
+    def write_csv(self, path_or_file, **csv_params):
+        """
+        Writes the table to CSV, batch by batch, with a header row
+        :param path_or_file: file path or text file object opened with newline=''
+        :param csv_params: passed to csv.writer, e.g. delimiter=';'
+        :return: number of rows written
+        """
+        if isinstance(path_or_file, str):
+            with open(path_or_file, 'w', newline='', encoding='utf-8') as output:
+                return self.write_csv(output, **csv_params)
+
+        names = [name for name, _ in self.columns]
+        writer = csv.writer(path_or_file, **csv_params)
+        writer.writerow(names)
+        rows = 0
+        for batch in self.iter_batches():
+            writer.writerows(zip(*[batch[name] for name in names]))
+            rows += len(batch[names[0]])
+        return rows
+
+    def arrow_schema(self):
+        if pyarrow is None:
+            raise Exception('[!] Arrow and Parquet export need pyarrow, please install it')
+        types = {'int': pyarrow.int64(), 'str': pyarrow.string()}
+        return pyarrow.schema([(name, types[kind]) for name, kind in self.columns])
+
+    def iter_arrow_batches(self):
+        """
+        :return: generator of pyarrow.RecordBatch, one per batch
+        """
+        schema = self.arrow_schema()
+        for batch in self.iter_batches():
+            yield pyarrow.RecordBatch.from_pydict(batch, schema=schema)
+
+    def to_arrow(self):
+        """
+        :return: whole table as pyarrow.Table
+        """
+        return pyarrow.Table.from_batches(self.iter_arrow_batches(), schema=self.arrow_schema())
+
+    def write_parquet(self, path: str, compression='snappy'):
+        """
+        Writes the table to a Parquet file, one row group per batch
+        :param path: file path
+        :param compression: Parquet compression codec
+        :return: number of rows written
+        """
+        schema = self.arrow_schema()
+        rows = 0
+        with pyarrow.parquet.ParquetWriter(path, schema, compression=compression) as writer:
+            for record_batch in self.iter_arrow_batches():
+                writer.write_batch(record_batch)
+                rows += record_batch.num_rows
+        return rows
+
+
+# connection of an export worker process, created once per process by init_export_worker
+worker_connection = None
+
+
+def init_export_worker(api_key: str, settings: dict):
+    global worker_connection
+    worker_connection = StreakConnection(api_key, **settings)
+
+
+def export_page(pipeline_data: dict, page: int, page_size, include_values: bool, max_workers: int):
+    """
+    Runs in a worker process: fetches one page of boxes of a pipeline with their values
+    and serializes them to NDJSON, so only bytes travel back to the parent process
+    :return: (number of boxes, number of boxes whose values failed, NDJSON bytes)
+    """
+    streak = worker_connection
+    pipeline_key = pipeline_data['pipelineKey']
+    lines = []
+    if page == 0:
+        fields_data = streak.get_fields_data(pipeline_key)
+        lines.append(streak.codec.dumps({'type': 'pipeline', 'data': pipeline_data, 'fields': fields_data}))
+
+    params = {'page': page, 'limit': page_size} if page_size else None
+    boxes_data = list(streak.iter_api_data('pipelines/%s/boxes' % pipeline_key, params))
+    if page_size and len(boxes_data) > page_size:
+        raise StreakAPIError('pipelines/%s/boxes returned more than %s boxes per page, it does not support paging'
+                             % (pipeline_key, page_size))
+    failed = 0
+    if include_values:
+        values_iterator = map_concurrently(lambda box_data: streak.get_api_data('boxes/%s/fields' % box_data['boxKey']),
+                                           boxes_data, max_workers)
+    else:
+        values_iterator = ((box_data, None) for box_data in boxes_data)
+    for box_data, values_data in values_iterator:
+        if include_values and (isinstance(values_data, Exception) or isinstance(values_data, dict)):
+            failed += 1
+            values_data = None
+        lines.append(streak.codec.dumps({'type': 'box', 'data': box_data, 'values': values_data}))
+    return len(boxes_data), failed, b'\n'.join(lines) + b'\n' if lines else b''
+
+
+class OrgExporter:
+    """
+    Exports every pipeline of the account with fields, boxes and box values to one NDJSON file
+    Work is split into pages of page_size boxes of a pipeline and spread over a process pool, so JSON decoding
+    and encoding run on every core; each worker fetches values of its boxes with max_workers threads.
+    Workers send back NDJSON bytes, the parent writes them in a fixed order (pipelines by key, pages in order),
+    so the same data always gives the same file. Pages are fetched ahead of the known end of a pipeline
+    (up to lookahead pages past the page being written), a big pipeline keeps all processes busy too.
+    At most processes * 2 pages are in flight or waiting to be written, a slow page never lets the rest
+    of the export pile up in memory.
+    # >>> OrgExporter(api_key, processes=16).export('org.ndjson')
+    # {'pipelines': 12, 'boxes': 201342, 'values_failed': 0, 'tasks': 215, 'bytes': 412330112, 'seconds': 95.1}
+    Lines are {'type': 'pipeline', 'data': ..., 'fields': [...]} followed by the pipeline's
+    {'type': 'box', 'data': ..., 'values': [...] or None} lines.
+    """
+
+    def __init__(self, api_key: str, processes=None, page_size=1000, include_values=True, max_workers=8,
+                 lookahead=None, pipeline_keys=None, **settings):
+        """
+        :param api_key: Streak API key
+        :param processes: worker processes, number of cores by default
+        :param page_size: boxes per task, None for one task per pipeline
+        :param include_values: also export values of every box (one request per box)
+        :param max_workers: value requests in flight per worker process
+        :param lookahead: pages of one pipeline fetched ahead of the page being written, processes by default
+        :param pipeline_keys: list of pipeline keys, None for all pipelines of the account
+        :param settings: StreakConnection settings, must be picklable. Rate limiters cannot be shared between
+            processes, so rate_limit, rate_burst and max_concurrency are for the whole export and every worker
+            gets its share of them (e.g. rate_limit=10 with 4 processes: 2.5 req/s per worker)
+        """
+        self.api_key = api_key
+        self.settings = settings
+        self.processes = processes or os.cpu_count() or 1
+        self.worker_settings = dict(settings)
+        for name in ('rate_limit', 'rate_burst'):
+            if settings.get(name):
+                self.worker_settings[name] = settings[name] / self.processes
+        if settings.get('max_concurrency'):
+            # every worker needs at least one request in flight to make progress
+            self.worker_settings['max_concurrency'] = max(1, settings['max_concurrency'] // self.processes)
+        self.page_size = page_size
+        self.include_values = include_values
+        self.max_workers = max_workers
+        self.lookahead = lookahead or self.processes
+        self.pipeline_keys = pipeline_keys
+
+    def __repr__(self):
+        return '<Org Exporter: %s processes>' % self.processes
+
+    def list_pipelines(self):
+        streak = StreakConnection(self.api_key, **self.settings)
+        try:
+            pipelines_data = streak.get_pipelines_data(self.pipeline_keys)
+        finally:
+            streak.close()
+        return sorted(pipelines_data, key=lambda pipeline_data: pipeline_data['pipelineKey'])
+
+    def export(self, path_or_file):
+        """
+        :param path_or_file: file path or binary file object
+        :return: dict with counts
+        """
+        if isinstance(path_or_file, str):
+            with open(path_or_file, 'wb') as output:
+                return self.export(output)
+
+        started = time.monotonic()
+        pipelines_data = self.list_pipelines()
+        stats = {'pipelines': len(pipelines_data), 'boxes': 0, 'values_failed': 0, 'tasks': 0, 'bytes': 0}
+        # per pipeline: next page to submit, last page (None until a short page shows the end)
+        next_page = [0] * len(pipelines_data)
+        last_page = [None if self.page_size else 0] * len(pipelines_data)
+        # (pipeline number, page): NDJSON bytes done but not written yet, because an earlier page is still running
+        finished = {}
+        written = (0, 0)
+        pending = {}
+
+        def next_task():
+            # earliest page that may be fetched now, pages before written are never needed again
+            for number in range(written[0], len(pipelines_data)):
+                if last_page[number] is not None and next_page[number] > last_page[number]:
+                    continue
+                # pipelines after the one being written have nothing written yet, their window starts at page 0
+                window_start = written[1] if number == written[0] else 0
+                if next_page[number] >= window_start + self.lookahead:
+                    continue
+                return number, next_page[number]
+            return None
+
+        def write_ready():
+            nonlocal written
+            while written in finished:
+                blob = finished.pop(written)
+                path_or_file.write(blob)
+                stats['bytes'] += len(blob)
+                number, page = written
+                if last_page[number] is not None and page >= last_page[number]:
+                    written = (number + 1, 0)
+                else:
+                    written = (number, page + 1)
+
+        with concurrent.futures.ProcessPoolExecutor(self.processes, initializer=init_export_worker,
+                                                    initargs=(self.api_key, self.worker_settings)) as executor:
+            while written[0] < len(pipelines_data):
+                while len(pending) + len(finished) < self.processes * 2:
+                    task = next_task()
+                    if task is None:
+                        break
+                    number, page = task
+                    next_page[number] = page + 1
+                    future = executor.submit(export_page, pipelines_data[number], page, self.page_size,
+                                             self.include_values, self.max_workers)
+                    pending[future] = task
+                    stats['tasks'] += 1
+
+                if not pending:
+                    raise Exception('[!] Export stalled at pipeline %s page %s' % written)
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    number, page = pending.pop(future)
+                    count, failed, blob = future.result()
+                    if not self.page_size or count < self.page_size:
+                        # short page is the last one, later pages fetched ahead of it come back empty
+                        if last_page[number] is None or page < last_page[number]:
+                            last_page[number] = page
+                            for key in [key for key in finished if key[0] == number and key[1] > page]:
+                                del finished[key]
+                    if last_page[number] is not None and page > last_page[number]:
+                        continue
+                    stats['boxes'] += count
+                    stats['values_failed'] += failed
+                    finished[number, page] = blob
+                write_ready()
+
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        return stats
+
+
+def read_export(path: str, codec=None):
+    """
+    Reads file written by OrgExporter
+    :return: generator of decoded lines
+    """
+    codec = codec or JsonCodec()
+    with open(path, 'rb') as export_file:
+        for line in export_file:
+            if line.strip():
+                yield codec.loads(line)
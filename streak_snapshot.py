@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import stat
+import struct
+import tempfile
+
+from streak_crm_python import (Box, Field, JsonCodec, Pipeline, Stage, StreakConnection, Value, add_attributes,
+                               map_concurrently)
+
+MAGIC = b'STRKSNP1'
+
+# record kinds, in the order their index tables are listed in the footer
+KINDS = ('pipeline', 'fields', 'pipeline_boxes', 'box', 'values')
+
+# index entry: key offset, key length, record offset, record length
+ENTRY = struct.Struct('<QIQI')
+# footer: (entries offset, entry count) per kind, then MAGIC again
+FOOTER = struct.Struct('<' + 'QQ' * len(KINDS) + '8s')
+
+
+class SnapshotWriter:
+    """
+    Writes snapshot file in one pass: records are appended as they come, indexes and footer on close
+    File layout: MAGIC, JSON records, keys, per kind a table of ENTRY sorted by key, FOOTER
+    The snapshot is written to a temporary file next to path and moved over path on close,
+    so processes that have the previous snapshot mapped keep reading it undisturbed.
+    """
+
+    def __init__(self, path: str, codec=None):
+        self.path = path
+        self.codec = codec or JsonCodec()
+        directory, name = os.path.split(os.path.abspath(path))
+        descriptor, self.temp_path = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+        self.file = os.fdopen(descriptor, 'wb')
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.entries = {kind: [] for kind in KINDS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, kind: str, key: str, data):
+        """
+        Appends record
+        :param kind: one of KINDS
+        :param key: pipelineKey or boxKey
+        :param data: JSON serializable
+        :return:
+        """
+        record = self.codec.dumps(data)
+        self.file.write(record)
+        self.entries[kind].append((key.encode('utf-8'), self.offset, len(record)))
+        self.offset += len(record)
+
+    def close(self):
+        if self.file.closed:
+            return
+        key_offsets = {}
+        for kind in KINDS:
+            self.entries[kind].sort()
+            offsets = key_offsets[kind] = []
+            for key, _, _ in self.entries[kind]:
+                self.file.write(key)
+                offsets.append(self.offset)
+                self.offset += len(key)
+
+        tables = []
+        for kind in KINDS:
+            tables.extend((self.offset, len(self.entries[kind])))
+            for key_offset, (key, record_offset, record_length) in zip(key_offsets[kind], self.entries[kind]):
+                self.file.write(ENTRY.pack(key_offset, len(key), record_offset, record_length))
+                self.offset += ENTRY.size
+        self.file.write(FOOTER.pack(*tables, MAGIC))
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            # mkstemp creates the file readable by the owner only, keep the permissions a snapshot had before
+            mode = stat.S_IMODE(os.stat(self.path).st_mode) if os.path.exists(self.path) else 0o644
+            os.chmod(self.temp_path, mode)
+            os.replace(self.temp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        """
+        Drops the partly written snapshot, the file at path is left as it was
+        """
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def write_snapshot(streak_connection: StreakConnection, path: str, pipeline_keys=None, include_values=False,
+                   max_workers=8, page_size=None):
+    """
+    Snapshots pipelines with their stages, fields and boxes, and optionally values of every box
+    Boxes are streamed to the file as they are downloaded
+    # >>> write_snapshot(StreakConnection(api_key), 'streak.snapshot', include_values=True)
+    # {'pipelines': 2, 'boxes': 20140, 'values': 20140, 'failed': 0, 'bytes': 31840212}
+    :param streak_connection: StreakConnection
+    :param path: file path
+    :param pipeline_keys: list of pipeline keys, None for all pipelines of the account
+    :param include_values: also store values of every box (one request per box)
+    :param max_workers: number of value requests in flight
+    :param page_size: fetch boxes in pages of this size
+    :return: dict with counts
+    """
+    pipelines_data = streak_connection.get_pipelines_data(pipeline_keys)
+    stats = {'pipelines': 0, 'boxes': 0, 'values': 0, 'failed': 0}
+    with SnapshotWriter(path, streak_connection.codec) as writer:
+        for pipeline_data in pipelines_data:
+            pipeline_key = pipeline_data['pipelineKey']
+            fields_data = streak_connection.get_fields_data(pipeline_key)
+            writer.add('pipeline', pipeline_key, pipeline_data)
+            writer.add('fields', pipeline_key, fields_data)
+
+            box_keys = []
+            for box_data in streak_connection.iter_paged_api_data('pipelines/%s/boxes' % pipeline_key, page_size):
+                writer.add('box', box_data['boxKey'], box_data)
+                box_keys.append(box_data['boxKey'])
+            writer.add('pipeline_boxes', pipeline_key, box_keys)
+            stats['pipelines'] += 1
+            stats['boxes'] += len(box_keys)
+
+            if include_values:
+                values_iterator = map_concurrently(
+                    lambda box_key: streak_connection.get_api_data('boxes/%s/fields' % box_key), box_keys, max_workers)
+                for box_key, values_data in values_iterator:
+                    if isinstance(values_data, Exception) or isinstance(values_data, dict):
+                        stats['failed'] += 1
+                        continue
+                    writer.add('values', box_key, values_data)
+                    stats['values'] += 1
+        writer.close()
+        stats['bytes'] = writer.offset + FOOTER.size
+    return stats
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot file, opened with mmap
+    Opening reads only the footer, lookups binary search the key table of their kind and decode
+    just the record they hit, so processes opening the same file share it through the page cache.
+    Models are bound to streak_connection if one is given, e.g. to edit a box found in the snapshot.
+    # >>> with Snapshot('streak.snapshot') as snapshot:
+    # ...     box = snapshot.box(box_key)
+    # ...     boxes = list(snapshot.boxes(pipeline_key))
+    """
+
+    def __init__(self, path: str, streak_connection=None, codec=None):
+        self.path = path
+        self.streak_connection = streak_connection
+        self.codec = codec or JsonCodec()
+        with open(path, 'rb') as snapshot_file:
+            self.mm = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < len(MAGIC) + FOOTER.size or self.mm[:len(MAGIC)] != MAGIC:
+            self.mm.close()
+            raise Exception('[!] %s is not a Streak snapshot' % path)
+        footer = FOOTER.unpack_from(self.mm, len(self.mm) - FOOTER.size)
+        if footer[-1] != MAGIC:
+            self.mm.close()
+            raise Exception('[!] Snapshot %s is truncated' % path)
+        self.tables = {kind: (footer[2 * number], footer[2 * number + 1]) for number, kind in enumerate(KINDS)}
+
+    def __repr__(self):
+        return '<Streak Snapshot: \'%s\'>' % self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.mm.close()
+
+    def entry(self, kind: str, number: int):
+        table_offset, _ = self.tables[kind]
+        return ENTRY.unpack_from(self.mm, table_offset + number * ENTRY.size)
+
+    def entry_key(self, kind: str, number: int):
+        key_offset, key_length, _, _ = self.entry(kind, number)
+        return self.mm[key_offset:key_offset + key_length]
+
+    def find(self, kind: str, key: str):
+        """
+        :return: (record offset, record length) of key, None if key is not in the snapshot
+        """
+        key = key.encode('utf-8')
+        low, high = 0, self.tables[kind][1]
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry_key(kind, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.tables[kind][1]:
+            key_offset, key_length, record_offset, record_length = self.entry(kind, low)
+            if self.mm[key_offset:key_offset + key_length] == key:
+                return record_offset, record_length
+        return None
+
+    def record(self, kind: str, key: str):
+        """
+        :return: decoded record, None if key is not in the snapshot
+        """
+        location = self.find(kind, key)
+        if location is None:
+            return None
+        record_offset, record_length = location
+        return self.codec.loads(self.mm[record_offset:record_offset + record_length])
+
+    def keys(self, kind: str):
+        """
+        :return: generator of all keys of kind, sorted
+        """
+        for number in range(self.tables[kind][1]):
+            yield self.entry_key(kind, number).decode('utf-8')
+
+    def __contains__(self, box_key):
+        return self.find('box', box_key) is not None
+
+    def pipeline_keys(self):
+        return list(self.keys('pipeline'))
+
+    def pipeline(self, pipeline_key: str):
+        pipeline_data = self.record('pipeline', pipeline_key)
+        return None if pipeline_data is None else add_attributes(pipeline_data, Pipeline(self.streak_connection))
+
+    def stages(self, pipeline_key: str):
+        pipeline_data = self.record('pipeline', pipeline_key) or {}
+        return [add_attributes(stage_data, Stage(self.streak_connection, pipeline_key))
+                for stage_data in (pipeline_data.get('stages') or {}).values()]
+
+    def fields(self, pipeline_key: str):
+        return [add_attributes(field_data, Field(self.streak_connection, pipeline_key))
+                for field_data in self.record('fields', pipeline_key) or []]
+
+    def box_keys(self, pipeline_key: str):
+        """
+        :return: keys of boxes of pipeline, in api order
+        """
+        return self.record('pipeline_boxes', pipeline_key) or []
+
+    def box(self, box_key: str):
+        box_data = self.record('box', box_key)
+        return None if box_data is None else add_attributes(box_data, Box(self.streak_connection))
+
+    def boxes(self, pipeline_key: str):
+        """
+        :return: generator of Boxes of pipeline, decoded one at a time
+        """
+        for box_key in self.box_keys(pipeline_key):
+            yield self.box(box_key)
+
+    def values(self, box_key: str):
+        """
+        :return: list of Values of box, None if values of the box were not snapshotted
+        """
+        values_data = self.record('values', box_key)
+        if values_data is None:
+            return None
+        return [add_attributes(value_data, Value(self.streak_connection, box_key)) for value_data in values_data]
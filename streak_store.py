@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import threading
+
+from streak_crm_python import Box, StreakConnection
+
+HOOKS = ('box_written', 'box_deleted', 'value_written')
+
+SORTED_ATTRIBUTES = ('creationTimestamp', 'lastUpdatedTimestamp', 'lastStageChangeTimestamp')
+
+
+def index_value(value):
+    """
+    :return: value usable as a hash index key, lists become tuples, None for dicts
+    """
+    if isinstance(value, list):
+        return tuple(index_value(item) for item in value)
+    if isinstance(value, dict):
+        return None
+    return value
+
+
+class SortedIndex:
+    """
+    Box keys ordered by an attribute value, kept in two parallel lists for bisect
+    """
+    __slots__ = ('values', 'box_keys')
+
+    def __init__(self):
+        self.values = []
+        self.box_keys = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value, box_key):
+        number = bisect.bisect_right(self.values, value)
+        self.values.insert(number, value)
+        self.box_keys.insert(number, box_key)
+
+    def remove(self, value, box_key):
+        start = bisect.bisect_left(self.values, value)
+        end = bisect.bisect_right(self.values, value, start)
+        for number in range(start, end):
+            if self.box_keys[number] == box_key:
+                del self.values[number]
+                del self.box_keys[number]
+                return
+
+    def bounds(self, low=None, high=None):
+        """
+        :return: (start, end) slice of box_keys with low <= value <= high, None bound is open
+        """
+        start = 0 if low is None else bisect.bisect_left(self.values, low)
+        end = len(self.values) if high is None else bisect.bisect_right(self.values, high)
+        return start, max(start, end)
+
+
+class BoxStore:
+    """
+    Local copy of boxes with hash indexes on stageKey, pipelineKey, assigned users and chosen fields,
+    and sorted indexes on timestamps, for repeated multi-filter queries without api calls
+    Boxes written through the connection (box_create, box_edit, box_delete, value_edit_in_box) are
+    re-indexed incrementally through its write hooks. Boxes of pipelines that were not loaded are ignored.
+    # >>> store = BoxStore(streak, field_keys=['1001'])
+    # >>> store.load_pipeline(pipeline_key)
+    # >>> store.find(stageKey='5001', assignedTo='robot@example.com', fields={'1001': 'hot'},
+    # ...            lastUpdatedTimestamp=(since, None))
+    # [<Box: 'ACME'>]
+    Returned Boxes belong to the store, change them through the connection rather than in place.
+    """
+    hash_attributes = ('stageKey', 'pipelineKey', 'assignedTo')
+
+    def __init__(self, streak_connection: StreakConnection, field_keys=(), sorted_attributes=SORTED_ATTRIBUTES):
+        self.streak_connection = streak_connection
+        self.field_keys = frozenset(field_keys)
+        self.sorted_attributes = tuple(sorted_attributes)
+        self.lock = threading.RLock()
+        self.boxes = {}
+        self.pipeline_keys = set()
+        self.hash_indexes = {attribute: {} for attribute in self.hash_attributes}
+        self.field_indexes = {field_key: {} for field_key in self.field_keys}
+        self.sorted_indexes = {attribute: SortedIndex() for attribute in self.sorted_attributes}
+        self.callbacks = {'box_written': self.on_box_written, 'box_deleted': self.remove,
+                          'value_written': self.on_value_written}
+        for when in HOOKS:
+            streak_connection.add_hook(when, self.callbacks[when])
+
+    def __repr__(self):
+        return '<Box Store: %s boxes>' % len(self.boxes)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, box_key):
+        return box_key in self.boxes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Stops following writes made through the connection
+        """
+        for when in HOOKS:
+            if self.callbacks[when] in self.streak_connection.hooks[when]:
+                self.streak_connection.remove_hook(when, self.callbacks[when])
+
+    def load_pipeline(self, pipeline_key: str, page_size=None):
+        """
+        Loads all boxes of pipeline, replacing boxes of it already in the store
+        :param pipeline_key: string
+        :param page_size: fetch boxes in pages of this size
+        :return: number of boxes loaded
+        """
+        boxes = list(self.streak_connection.iter_boxes_in_pipeline(pipeline_key, page_size))
+        with self.lock:
+            self.drop_pipeline(pipeline_key)
+            self.pipeline_keys.add(pipeline_key)
+            for box in boxes:
+                self.add(box, sorted_indexes=False)
+            self.rebuild_sorted_indexes()
+        return len(boxes)
+
+    def rebuild_sorted_indexes(self):
+        """
+        Re-creates sorted indexes from all boxes, one sort instead of an insert per box
+        """
+        with self.lock:
+            for attribute in self.sorted_attributes:
+                pairs = sorted((value, box_key) for box_key, value in
+                               ((box_key, getattr(box, attribute, None)) for box_key, box in self.boxes.items())
+                               if value is not None)
+                sorted_index = self.sorted_indexes[attribute] = SortedIndex()
+                sorted_index.values = [value for value, _ in pairs]
+                sorted_index.box_keys = [box_key for _, box_key in pairs]
+
+    def drop_pipeline(self, pipeline_key: str):
+        with self.lock:
+            self.pipeline_keys.discard(pipeline_key)
+            for box_key in list(self.hash_indexes['pipelineKey'].get(pipeline_key, ())):
+                self.remove(box_key)
+
+    def index_entries(self, box: Box):
+        """
+        :return: list of (index dict, index key) the box belongs to
+        """
+        entries = [(self.hash_indexes['stageKey'], getattr(box, 'stageKey', None)),
+                   (self.hash_indexes['pipelineKey'], box.pipelineKey)]
+        for entry in getattr(box, 'assignedToSharingEntries', None) or ():
+            entries.append((self.hash_indexes['assignedTo'], entry.get('email')))
+        fields = getattr(box, 'fields', None) or {}
+        for field_key in self.field_keys:
+            entries.append((self.field_indexes[field_key], index_value(fields.get(field_key))))
+        return entries
+
+    def add(self, box: Box, sorted_indexes=True):
+        """
+        Adds box or replaces the stored box with the same key, the store keeps its own copy
+        :param box: Box
+        :param sorted_indexes: False to skip sorted indexes, rebuild_sorted_indexes must be called afterwards
+        :return:
+        """
+        attributes = box.attributes()
+        attributes['fields'] = dict(attributes.get('fields') or {})
+        box = Box(box.streak_connection).load(attributes)
+        with self.lock:
+            self.remove(box.boxKey)
+            self.boxes[box.boxKey] = box
+            for index, key in self.index_entries(box):
+                index.setdefault(key, set()).add(box.boxKey)
+            if not sorted_indexes:
+                return
+            for attribute, sorted_index in self.sorted_indexes.items():
+                value = getattr(box, attribute, None)
+                if value is not None:
+                    sorted_index.add(value, box.boxKey)
+
+    def remove(self, box_key: str):
+        """
+        Removes box from the store and its indexes, unknown keys are ignored
+        """
+        with self.lock:
+            box = self.boxes.pop(box_key, None)
+            if box is None:
+                return
+            for index, key in self.index_entries(box):
+                box_keys = index.get(key)
+                if box_keys is not None:
+                    box_keys.discard(box_key)
+                    if not box_keys:
+                        del index[key]
+            for attribute, sorted_index in self.sorted_indexes.items():
+                value = getattr(box, attribute, None)
+                if value is not None:
+                    sorted_index.remove(value, box_key)
+
+    def on_box_written(self, box: Box):
+        with self.lock:
+            if box.boxKey in self.boxes or box.pipelineKey in self.pipeline_keys:
+                self.add(box)
+
+    def on_value_written(self, value):
+        with self.lock:
+            box = self.boxes.get(value.box_key)
+            if box is None:
+                return
+            fields = dict(getattr(box, 'fields', None) or {})
+            fields[value.key] = value.value
+            changed = Box(box.streak_connection).load(box.attributes())
+            changed.fields = fields
+            self.add(changed)
+
+    def get(self, box_key: str):
+        return self.boxes.get(box_key)
+
+    def find_keys(self, fields=None, **filters):
+        """
+        :param fields: dict field_key: value, fields must be among field_keys of the store
+        :param filters: stageKey, pipelineKey or assignedTo (email) = value,
+            or a sorted attribute = (low, high) with inclusive bounds, None for an open bound
+        :return: set of keys of boxes matching all filters
+        """
+        hash_filters = []
+        ranges = []
+        for name, value in filters.items():
+            if name in self.hash_indexes:
+                hash_filters.append((self.hash_indexes[name], value))
+            elif name in self.sorted_indexes:
+                ranges.append((name, value))
+            else:
+                raise Exception('[!] No index on %r, choose one of %s' % (
+                    name, ', '.join(self.hash_attributes + self.sorted_attributes)))
+        for field_key, value in (fields or {}).items():
+            if field_key not in self.field_indexes:
+                raise Exception('[!] Field %r is not indexed, pass it in field_keys of BoxStore' % field_key)
+            hash_filters.append((self.field_indexes[field_key], index_value(value)))
+
+        with self.lock:
+            # sets are looked up under the lock, a concurrent write may replace the set of a key
+            hash_sets = [index.get(value, ()) for index, value in hash_filters]
+            hash_sets.sort(key=len)
+            result = None
+            if hash_sets:
+                result = set(hash_sets[0])
+                for box_keys in hash_sets[1:]:
+                    if not result:
+                        break
+                    result &= box_keys
+
+            for name, (low, high) in ranges:
+                sorted_index = self.sorted_indexes[name]
+                start, end = sorted_index.bounds(low, high)
+                if result is None:
+                    result = set(sorted_index.box_keys[start:end])
+                elif len(result) < end - start:
+                    # checking the few candidates is cheaper than building a set of the whole range
+                    result = {box_key for box_key in result
+                              if self.in_range(getattr(self.boxes[box_key], name, None), low, high)}
+                else:
+                    result &= set(sorted_index.box_keys[start:end])
+
+            if result is None:
+                result = set(self.boxes)
+            return result
+
+    @staticmethod
+    def in_range(value, low, high):
+        if value is None:
+            return False
+        return (low is None or value >= low) and (high is None or value <= high)
+
+    def find(self, fields=None, order_by=None, **filters):
+        """
+        Boxes matching all filters, see find_keys
+        :param order_by: sorted attribute to order result by, e.g. 'lastUpdatedTimestamp'
+        :return: list of Boxes
+        """
+        box_keys = self.find_keys(fields, **filters)
+        with self.lock:
+            boxes = [self.boxes[box_key] for box_key in box_keys]
+        if order_by is not None:
+            boxes.sort(key=lambda box: (getattr(box, order_by, None) is None, getattr(box, order_by, None) or 0))
+        return boxes
+
+    def count(self, fields=None, **filters):
+        return len(self.find_keys(fields, **filters))
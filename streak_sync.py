@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sqlite3
+import time
+
+from streak_crm_python import StreakConnection
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pipelines (
+    pipeline_key TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    pipeline_key TEXT NOT NULL,
+    stage_key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (pipeline_key, stage_key)
+);
+CREATE TABLE IF NOT EXISTS fields (
+    pipeline_key TEXT NOT NULL,
+    field_key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (pipeline_key, field_key)
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    box_key TEXT PRIMARY KEY,
+    pipeline_key TEXT NOT NULL,
+    stage_key TEXT,
+    last_updated INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS boxes_pipeline ON boxes (pipeline_key);
+CREATE TABLE IF NOT EXISTS box_values (
+    box_key TEXT NOT NULL,
+    field_key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (box_key, field_key)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    pipeline_key TEXT PRIMARY KEY,
+    last_updated INTEGER,
+    synced_at REAL
+);
+'''
+
+
+class StreakSync:
+    """
+    Mirrors pipelines, stages, fields, boxes and field values into a local SQLite file
+    First run copies everything, later runs fetch values only for boxes whose lastUpdatedTimestamp moved
+    and drop boxes that disappeared from Streak
+    # >>> sync = StreakSync(StreakConnection(api_key), 'streak.sqlite')
+    # >>> sync.sync()
+    # {'pipelines': 2, 'boxes': 20140, 'changed': 312, 'deleted': 4, 'failed': 0, 'seconds': 41.2}
+    """
+
+    def __init__(self, streak_connection: StreakConnection, db_path: str, max_workers=8, commit_every=500):
+        self.streak_connection = streak_connection
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.commit_every = commit_every
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def __repr__(self):
+        return '<Streak Sync: \'%s\'>' % self.db_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def sync(self, pipeline_keys=None):
+        """
+        Syncs given pipelines, or all pipelines of the account (dropping local ones deleted in Streak)
+        :param pipeline_keys: list of pipeline keys or None
+        :return: dict with run stats
+        """
+        started = time.monotonic()
+        stats = {'pipelines': 0, 'boxes': 0, 'changed': 0, 'deleted': 0, 'failed': 0}
+
+        pipelines_data = self.streak_connection.get_pipelines_data(pipeline_keys)
+        if pipeline_keys is None:
+            with self.db:
+                remote_keys = {pipeline_data['pipelineKey'] for pipeline_data in pipelines_data}
+                for pipeline_key in set(self.pipeline_keys()) - remote_keys:
+                    self.drop_pipeline(pipeline_key)
+
+        for pipeline_data in pipelines_data:
+            pipeline_stats = self.sync_pipeline(pipeline_data)
+            stats['pipelines'] += 1
+            for key, value in pipeline_stats.items():
+                stats[key] += value
+
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        return stats
+
+    def sync_pipeline(self, pipeline_data: dict):
+        """
+        Stores pipeline schema, then brings its boxes and values up to date
+        :param pipeline_data: pipeline dict as returned by the api
+        :return: dict with counts of boxes, changed, deleted and failed boxes
+        """
+        pipeline_key = pipeline_data['pipelineKey']
+        fields_data = self.streak_connection.get_fields_data(pipeline_key)
+        boxes_data = self.streak_connection.check_api_data(
+            self.streak_connection.get_api_data('pipelines/%s/boxes' % pipeline_key), 'Failed to get boxes')
+
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO pipelines VALUES (?, ?)', (pipeline_key, json.dumps(pipeline_data)))
+            self.db.execute('DELETE FROM stages WHERE pipeline_key = ?', (pipeline_key,))
+            self.db.executemany('INSERT INTO stages VALUES (?, ?, ?)', [
+                (pipeline_key, stage_key, json.dumps(stage_data))
+                for stage_key, stage_data in (pipeline_data.get('stages') or {}).items()
+            ])
+            self.db.execute('DELETE FROM fields WHERE pipeline_key = ?', (pipeline_key,))
+            self.db.executemany('INSERT INTO fields VALUES (?, ?, ?)', [
+                (pipeline_key, field_data['key'], json.dumps(field_data)) for field_data in fields_data
+            ])
+
+        known = dict(self.db.execute('SELECT box_key, last_updated FROM boxes WHERE pipeline_key = ?',
+                                     (pipeline_key,)))
+        remote = {box_data['boxKey']: box_data for box_data in boxes_data}
+        changed = [box_key for box_key, box_data in remote.items()
+                   if known.get(box_key) != box_data.get('lastUpdatedTimestamp')]
+        deleted = [box_key for box_key in known if box_key not in remote]
+
+        failed = 0
+        with self.db:
+            self.db.executemany('DELETE FROM boxes WHERE box_key = ?', [(key,) for key in deleted])
+            self.db.executemany('DELETE FROM box_values WHERE box_key = ?', [(key,) for key in deleted])
+
+        values_iterator = self.streak_connection.iter_values_in_boxes(changed, self.max_workers)
+        for number, (box_key, values) in enumerate(values_iterator, 1):
+            if isinstance(values, Exception):
+                # box keeps its old timestamp, so it is picked up again by the next run
+                failed += 1
+                continue
+            box_data = remote[box_key]
+            self.db.execute('INSERT OR REPLACE INTO boxes VALUES (?, ?, ?, ?, ?)', (
+                box_key, pipeline_key, box_data.get('stageKey'), box_data.get('lastUpdatedTimestamp'),
+                json.dumps(box_data)
+            ))
+            self.db.execute('DELETE FROM box_values WHERE box_key = ?', (box_key,))
+            self.db.executemany('INSERT INTO box_values VALUES (?, ?, ?)', [
+                (box_key, value.key, json.dumps(value.value)) for value in values
+            ])
+            if number % self.commit_every == 0:
+                self.db.commit()
+        self.db.commit()
+
+        watermark = max([box_data.get('lastUpdatedTimestamp') or 0 for box_data in boxes_data] or [0])
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)',
+                            (pipeline_key, watermark, time.time()))
+
+        return {'boxes': len(remote), 'changed': len(changed) - failed, 'deleted': len(deleted), 'failed': failed}
+
+    def drop_pipeline(self, pipeline_key: str):
+        """
+        Removes pipeline with all its boxes and values from the mirror
+        :param pipeline_key: string
+        :return:
+        """
+        self.db.execute('DELETE FROM box_values WHERE box_key IN (SELECT box_key FROM boxes WHERE pipeline_key = ?)',
+                        (pipeline_key,))
+        for table in ('boxes', 'stages', 'fields', 'watermarks', 'pipelines'):
+            self.db.execute('DELETE FROM %s WHERE pipeline_key = ?' % table, (pipeline_key,))
+
+    def pipeline_keys(self):
+        return [row[0] for row in self.db.execute('SELECT pipeline_key FROM pipelines')]
+
+    def watermark(self, pipeline_key: str):
+        """
+        :param pipeline_key: string
+        :return: highest lastUpdatedTimestamp seen in pipeline by the last sync, None if never synced
+        """
+        row = self.db.execute('SELECT last_updated FROM watermarks WHERE pipeline_key = ?', (pipeline_key,)).fetchone()
+        return row[0] if row else None
+
+    def box_data(self, box_key: str):
+        """
+        :param box_key: string
+        :return: box dict stored by the last sync, None if box is unknown
+        """
+        row = self.db.execute('SELECT data FROM boxes WHERE box_key = ?', (box_key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def box_values(self, box_key: str):
+        """
+        :param box_key: string
+        :return: dict field_key: value stored by the last sync
+        """
+        rows = self.db.execute('SELECT field_key, value FROM box_values WHERE box_key = ?', (box_key,))
+        return {field_key: json.loads(value) for field_key, value in rows}
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 
 from streak_crm_python import *
+from streak_sync import StreakSync
 from keys import TEST_API_KEY
+import json
 import unittest
+import asyncio
 import random
 import string
 import datetime
+import time
+import os
+import tempfile
 
 
 alphanumeric_range = string.ascii_lowercase + '1234567890'
@@ -43,6 +49,26 @@ class TestStreakConnection(unittest.TestCase):
     def test_connections_with_wrong_api_key(self):
         self.assertEqual(self.connections_with_wrong_api_key.user_get_me().error, 'invalid api key')
 
+    def test_session_lifecycle(self):
+        with StreakConnection(pool_maxsize=4) as streak:
+            session = streak.session
+            self.assertEqual(streak.user_get_me().email, my_email)
+            self.assertIs(streak.session, session)
+        self.assertIsNone(streak._session)
+        self.assertEqual(streak.user_get_me().email, my_email)
+        streak.close()
+
+
+class TestAsyncStreakConnection(unittest.TestCase):
+    def test_user_get_me(self):
+        async def get_me_concurrently():
+            async with AsyncStreakConnection(max_concurrency=2) as streak:
+                return await asyncio.gather(*[streak.user_get_me() for _ in range(4)])
+
+        for me in asyncio.run(get_me_concurrently()):
+            self.assertIsInstance(me, User)
+            self.assertEqual(me.email, my_email)
+
 
 class TestUsers(unittest.TestCase):
     def setUp(self):
@@ -106,6 +132,11 @@ class TestCreateDeleteUpdatePipelines(unittest.TestCase):
         self.assertEqual(self.updated_pipeline.name, self.updated_settings['name'])
         self.assertEqual(self.updated_pipeline.description, self.updated_settings['description'])
 
+        self.refreshed_pipeline = self.streak.pipeline_edit(self.new_pipeline.pipelineKey, {'name': 'test name 3'},
+                                                            refresh=True)
+        self.assertEqual(self.refreshed_pipeline.name, 'test name 3')
+        self.assertEqual(self.refreshed_pipeline.description, self.updated_settings['description'])
+
 
     def tearDown(self):
         self.streak.pipeline_delete(self.new_pipeline.pipelineKey)
@@ -140,6 +171,161 @@ class TestCreateDeleteUpdatePipelinesWithInvalidParams(unittest.TestCase):
             self.new_pipeline = self.streak.pipeline_edit('12345', self.settings)
 
 
+class TestModels(unittest.TestCase):
+    def test_compact_attributes(self):
+        box_1 = add_attributes({'boxKey': 'box 1', 'name': 'first', 'pipelineKey': 'pipeline'}, Box(None))
+        box_2 = add_attributes({'boxKey': 'box 2', 'name': 'second', 'pipelineKey': ''.join(['pipe', 'line'])}, Box(None))
+        self.assertEqual(box_1.name, 'first')
+        self.assertIs(box_1._shape, box_2._shape)
+        self.assertIs(box_1.pipelineKey, box_2.pipelineKey)
+
+        box_1.notes = 'some notes'
+        self.assertEqual(box_1.notes, 'some notes')
+        self.assertIn('notes', box_1.__dict__)
+        with self.assertRaises(AttributeError):
+            box_2.notes
+
+    def test_flush_attributes(self):
+        stage = add_attributes({'key': '5001', 'name': 'Cold Call'}, Stage(None, 'pipeline'))
+        flush_attributes(stage)
+        self.assertEqual(stage.name, '')
+        self.assertEqual(stage.pipeline_key, 'pipeline')
+        self.assertIsNone(stage.streak_connection)
+        self.assertNotIn('key', stage.__dict__)
+
+
+class TestJsonCodec(unittest.TestCase):
+    def test_backends(self):
+        for backend in ('json', 'auto') + (('orjson',) if orjson is not None else ()):
+            codec = JsonCodec(backend)
+            self.assertEqual(codec.loads(b'{"name": "box \\u00e9"}'), {'name': 'box \u00e9'})
+            self.assertEqual(json.loads(codec.dumps({'name': 'box', 1: 2 ** 70})), {'name': 'box', '1': 2 ** 70})
+            self.assertIsInstance(codec.dumps([]), bytes)
+        with self.assertRaisesRegex(Exception, 'Unknown JSON backend'):
+            JsonCodec('yaml')
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=50, burst=5)
+        started = time.monotonic()
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+        self.assertEqual(limiter.stats()['requests'], 10)
+
+    def test_throttle_halves_concurrency(self):
+        limiter = RateLimiter(max_concurrency=8)
+        limiter.acquire()
+        limiter.release(retry_after=0)
+        self.assertEqual(limiter.stats()['concurrency_limit'], 4)
+        self.assertEqual(limiter.stats()['throttled'], 1)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release()
+        self.assertEqual(limiter.stats()['concurrency_limit'], 5)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('3', 1), 3.0)
+        self.assertEqual(parse_retry_after(None, 1), 1)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', 1), 0.0)
+
+
+class TestResilience(unittest.TestCase):
+    def setUp(self):
+        # nothing listens on the discard port, every request is refused
+        self.streak = StreakConnection(api_endpoint='http://127.0.0.1:9/', max_retries=2, backoff_base=0.01)
+
+    def test_connection_error_is_raised_after_retries(self):
+        with self.assertRaises(StreakConnectionError):
+            self.streak.user_get_me()
+
+    def test_deadline(self):
+        with self.assertRaisesRegex(StreakTimeoutError, 'Deadline exceeded'):
+            with self.streak.deadline(0):
+                self.streak.user_get_me()
+        self.assertIsNone(self.streak.deadline_at())
+        with self.streak.deadline(60) as outer:
+            with self.streak.deadline(120) as inner:
+                self.assertEqual(inner, outer)
+
+    def test_bulk_errors_are_typed(self):
+        values_by_box = self.streak.value_get_all_in_boxes(['box 1', 'box 2'], deadline=5)
+        for error in values_by_box.values():
+            self.assertIsInstance(error, StreakError)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_path_template(self):
+        self.assertEqual(path_template('boxes/agxzfm1ha/fields/1001'), 'boxes/%s/fields/%s')
+        self.assertEqual(path_template('pipelines/'), 'pipelines')
+        self.assertEqual(path_template('users/me'), 'users/me')
+
+    def test_hooks_and_stats(self):
+        streak = StreakConnection(api_endpoint='http://127.0.0.1:9/', max_retries=1, backoff_base=0.01)
+        before, after = [], []
+        streak.add_hook('before', before.append)
+        streak.add_hook('after', after.append)
+        with self.assertRaises(StreakConnectionError):
+            streak.box_get('some box key')
+
+        self.assertEqual(len(before), 2)
+        self.assertEqual([event.attempt for event in after], [0, 1])
+        self.assertIsInstance(after[0].error, StreakConnectionError)
+        endpoint = streak.request_stats()['GET boxes/%s']
+        self.assertEqual(endpoint['count'], 2)
+        self.assertEqual(endpoint['errors'], 2)
+        self.assertEqual(sum(endpoint['histogram'].values()), 2)
+
+        streak.stats.reset()
+        self.assertEqual(streak.request_stats(), {})
+
+
+class TestIterJsonArray(unittest.TestCase):
+    def test_split_chunks(self):
+        document = json.dumps([{'name': 'box \u00e9', 'fields': {'1001': 12.5}}, {'name': 'box 2'}, 300]).encode()
+        for size in (1, 3, 17, len(document)):
+            chunks = [document[i:i + size] for i in range(0, len(document), size)]
+            self.assertEqual(list(iter_json_array(chunks)),
+                             [{'name': 'box \u00e9', 'fields': {'1001': 12.5}}, {'name': 'box 2'}, 300])
+
+    def test_error_and_truncated_response(self):
+        with self.assertRaisesRegex(Exception, 'invalid api key'):
+            list(iter_json_array([b'{"success": false, "error": "invalid api key"}']))
+        with self.assertRaisesRegex(ValueError, 'Truncated'):
+            list(iter_json_array([b'[{"name": "box"}, {"na']))
+
+
+class TestSchemaCache(unittest.TestCase):
+    def test_lru_and_ttl(self):
+        cache = SchemaCache(max_size=2, ttl={'stages': 0})
+        cache.put('pipeline', 'p1', None, {'name': 'first'})
+        cache.put('pipeline', 'p2', None, {'name': 'second'})
+        self.assertEqual(cache.get('pipeline', 'p1'), (True, {'name': 'first'}))
+        cache.put('fields', 'p3', None, [])
+        self.assertEqual(cache.get('pipeline', 'p2'), (False, None))
+        cache.put('stages', 'p1', None, {})
+        self.assertEqual(cache.get('stages', 'p1'), (False, None))
+        cache.invalidate('p1')
+        self.assertEqual(cache.get('pipeline', 'p1'), (False, None))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_cached_pipeline_invalidated_on_edit(self):
+        streak = StreakConnection(schema_cache=True)
+        pipeline = streak.pipeline_create({'name': 'pipeline to test cache', 'stageNames': 'Cold Call, Meeting'})
+        try:
+            stages = streak.stage_get_all_in_pipeline(pipeline.pipelineKey)
+            streak.stage_get_all_in_pipeline(pipeline.pipelineKey)
+            self.assertEqual(streak.schema_cache.stats()['hits'], 1)
+            streak.stage_edit_in_pipeline(pipeline.pipelineKey, stages[0].key, {'name': 'edited name'})
+            stage_names = [stage.name for stage in streak.stage_get_all_in_pipeline(pipeline.pipelineKey)]
+            self.assertIn('edited name', stage_names)
+        finally:
+            pipeline.delete_self()
+
+
 class TestCreateDeleteUpdateBoxes(unittest.TestCase):
     def setUp(self):
         """
@@ -194,6 +380,8 @@ class TestCreateDeleteUpdateBoxes(unittest.TestCase):
         new_box_2 = self.streak.box_create(self.pipeline.pipelineKey, {'name': 'another box', 'notes': 'somenotes'})
 
         self.boxes = self.streak.box_get_all()
+        streamed_boxes = list(self.streak.iter_boxes_in_pipeline(self.pipeline.pipelineKey))
+        self.assertEqual({box.boxKey for box in streamed_boxes}, {new_box_1.boxKey, new_box_2.boxKey})
         # print(self.boxes[0].__dict__)
         boxes_names = [box.name for box in self.boxes]
         boxes_notes = [box.notes for box in self.boxes]
@@ -332,8 +520,54 @@ class TestGetGetAllEditValues(unittest.TestCase):
 
 
 
+    def test_value_get_all_in_boxes(self):
+        values_by_box = self.streak.value_get_all_in_boxes([self.box.key, 'wrong box key'], max_workers=2)
+        self.assertEqual(set(values_by_box), {self.box.key, 'wrong box key'})
+        for value in values_by_box[self.box.key]:
+            self.assertIsInstance(value, Value)
+        self.assertIsInstance(values_by_box['wrong box key'], Exception)
+
     def tearDown(self):
         print('Cleaning up...')
         self.box.delete_self()
         self.pipeline.delete_self()
-        print('...done.')
\ No newline at end of file
+        print('...done.')
+
+
+class TestStreakSync(unittest.TestCase):
+    def setUp(self):
+        self.streak = StreakConnection()
+        self.pipeline = self.streak.pipeline_create(
+            {
+                'name': 'pipeline to test sync',
+                'description': 'test description',
+                'orgWide': False,
+                'fieldNames': 'name, date, memo',
+                'fieldTypes': 'PERSON, DATE, TEXT_INPUT',
+                'stageNames': 'Cold Call, Meeting, Contract'
+            }
+        )
+        self.box_1 = self.streak.box_create(self.pipeline.pipelineKey, {'name': 'box to keep'})
+        self.box_2 = self.streak.box_create(self.pipeline.pipelineKey, {'name': 'box to delete'})
+        self.db_dir = tempfile.TemporaryDirectory()
+
+    def test_delta_sync(self):
+        pip_key = self.pipeline.pipelineKey
+        with StreakSync(self.streak, os.path.join(self.db_dir.name, 'streak.sqlite')) as sync:
+            stats = sync.sync([pip_key])
+            self.assertEqual(stats['changed'], 2)
+            self.assertEqual(sync.sync([pip_key])['changed'], 0)
+
+            self.streak.box_edit(self.box_1.boxKey, {'notes': 'changed notes'})
+            self.box_2.delete_self()
+            stats = sync.sync([pip_key])
+            self.assertEqual(stats['changed'], 1)
+            self.assertEqual(stats['deleted'], 1)
+            self.assertEqual(sync.box_data(self.box_1.boxKey)['notes'], 'changed notes')
+            self.assertIsNone(sync.box_data(self.box_2.boxKey))
+            self.assertIsNotNone(sync.watermark(pip_key))
+
+    def tearDown(self):
+        self.box_1.delete_self()
+        self.pipeline.delete_self()
+        self.db_dir.cleanup()
@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+
+from streak_crm_python import *
+from mock_streak_server import MockStreakServer, MOCK_API_KEY
+from streak_export import OrgExporter, PipelineExporter, read_export
+from streak_store import BoxStore
+from streak_snapshot import Snapshot, write_snapshot
+import copy
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+
+class MockServerTestCase(unittest.TestCase):
+    """
+    Runs tests against a fresh local mock of the Streak api, no api key or network needed
+    """
+    server_settings = {'boxes_per_pipeline': 5}
+
+    def setUp(self):
+        self.server = MockStreakServer(**self.server_settings).start()
+        self.streak = StreakConnection(MOCK_API_KEY, api_endpoint=self.server.api_endpoint, backoff_base=0.01)
+        self.pipeline = self.streak.pipeline_get_all()[0]
+
+    def tearDown(self):
+        self.streak.close()
+        self.server.stop()
+
+
+class TestPipelinesAndBoxes(MockServerTestCase):
+    def test_user_get_me(self):
+        self.assertEqual(self.streak.user_get_me().email, 'robot@example.com')
+
+    def test_pipeline_create_edit_delete(self):
+        pipeline = self.streak.pipeline_create({'name': 'test name', 'stageNames': 'Cold Call, Meeting'})
+        self.assertEqual(pipeline.name, 'test name')
+        self.assertEqual(self.server.request_count, 2)
+
+        pipeline = self.streak.pipeline_edit(pipeline.pipelineKey, {'name': 'test name 2'}, refresh=True)
+        self.assertEqual(pipeline.name, 'test name 2')
+        self.assertEqual(self.server.request_count, 4)
+
+        pipeline.delete_self()
+        with self.assertRaisesRegex(StreakAPIError, 'usually a key issue'):
+            self.streak.pipeline_get(pipeline.pipelineKey)
+
+    def test_box_create_edit_stream(self):
+        box = self.streak.box_create(self.pipeline.pipelineKey, {'name': 'new box', 'notes': 'some notes'})
+        box = self.streak.box_edit(box.boxKey, {'name': 'new box changed'})
+        self.assertEqual(box.name, 'new box changed')
+        self.assertEqual(box.notes, 'some notes')
+
+        streamed = list(self.streak.iter_boxes_in_pipeline(self.pipeline.pipelineKey, page_size=2))
+        self.assertEqual(len(streamed), 6)
+        self.assertEqual([b.boxKey for b in streamed],
+                         [b.boxKey for b in self.streak.box_get_all_in_pipeline(self.pipeline.pipelineKey)])
+
+    def test_paging_must_be_supported(self):
+        self.server.data.ignore_paging = True
+        with self.assertRaisesRegex(StreakAPIError, 'does not support paging'):
+            list(self.streak.iter_boxes_in_pipeline(self.pipeline.pipelineKey, page_size=2))
+        with self.assertRaisesRegex(StreakAPIError, 'does not support paging'):
+            OrgExporter(MOCK_API_KEY, processes=1, page_size=2, api_endpoint=self.server.api_endpoint).export(
+                io.BytesIO())
+
+    def test_copied_box_does_not_share_values(self):
+        box = self.streak.box_get_all_in_pipeline(self.pipeline.pipelineKey)[0]
+        stage_key = box.stageKey
+        self.assertEqual(box.stage.key, stage_key)
+        copied = copy.copy(box)
+        copied.notes = 'copied notes'
+        copied.stageKey = 'other stage'
+        box.lastUpdatedTimestamp = 1
+        self.assertEqual(box.stageKey, stage_key)
+        self.assertEqual(box.lastUpdatedTimestamp, 1)
+        self.assertEqual(copied.notes, 'copied notes')
+        self.assertFalse(copied.is_related_loaded('stage'))
+        self.assertEqual(copy.deepcopy(box).stageKey, stage_key)
+
+        attributes = box.attributes()
+        attributes['stageKey'] = 'changed in dict'
+        self.assertEqual((box.stageKey, attributes['boxKey']), (stage_key, box.boxKey))
+
+    def test_box_create_many(self):
+        pip_key = self.pipeline.pipelineKey
+        field = self.streak.field_get_all_in_pipeline(pip_key)[0]
+        params = ({'name': 'lead %s' % number, 'fields': {field.key: 'value %s' % number}} for number in range(20))
+        boxes = self.streak.box_create_many(pip_key, params, concurrency=4)
+        self.assertEqual([box.name for box in boxes], ['lead %s' % number for number in range(20)])
+        self.assertEqual(boxes[3].fields[field.key], 'value 3')
+        self.assertEqual(self.streak.value_get_specific_in_box(boxes[3].boxKey, field.key).value, 'value 3')
+
+        boxes = self.streak.box_create_many('wrong key', [{'name': 'lead'}])
+        self.assertIsInstance(boxes[0], StreakAPIError)
+
+
+class TestStagesFieldsValues(MockServerTestCase):
+    def test_stage_and_field_edits_invalidate_cache(self):
+        streak = StreakConnection(MOCK_API_KEY, api_endpoint=self.server.api_endpoint, schema_cache=True)
+        pip_key = self.pipeline.pipelineKey
+        stage = streak.stage_get_all_in_pipeline(pip_key)[0]
+        field = streak.field_get_all_in_pipeline(pip_key)[0]
+        streak.stage_get_all_in_pipeline(pip_key)
+        self.assertEqual(streak.schema_cache.stats()['hits'], 1)
+
+        streak.stage_edit_in_pipeline(pip_key, stage.key, {'name': 'edited stage'})
+        streak.field_edit_in_pipeline(pip_key, field.key, {'name': 'edited field'})
+        self.assertEqual(streak.stage_get_specific_in_pipeline(pip_key, stage.key).name, 'edited stage')
+        self.assertEqual(streak.field_get_specific_in_pipeline(pip_key, field.key).name, 'edited field')
+
+        # an edit finishing while a read is in flight keeps the read's response out of the cache
+        def edit_during_read(event):
+            streak.remove_hook('before', edit_during_read)
+            streak.stage_edit_in_pipeline(pip_key, stage.key, {'name': 'edited during read'})
+        streak.add_hook('before', edit_during_read)
+        streak.stage_get_all_in_pipeline(pip_key)
+        self.assertEqual(streak.schema_cache.stats()['stale'], 1)
+        self.assertIn('edited during read', [stage.name for stage in streak.stage_get_all_in_pipeline(pip_key)])
+
+    def test_values(self):
+        box = self.streak.box_get_all_in_pipeline(self.pipeline.pipelineKey)[0]
+        field = self.streak.field_get_all_in_pipeline(self.pipeline.pipelineKey)[0]
+        value = self.streak.value_edit_in_box(box.boxKey, field.key, {'value': 'some value'})
+        self.assertEqual(value.value, 'some value')
+        self.assertEqual(self.streak.value_get_specific_in_box(box.boxKey, field.key).value, 'some value')
+
+        values_by_box = self.streak.value_get_all_in_boxes([box.boxKey, 'wrong key'])
+        self.assertIn('some value', [value.value for value in values_by_box[box.boxKey]])
+        self.assertIsInstance(values_by_box['wrong key'], StreakAPIError)
+
+    def test_value_edit_many_skips_unchanged(self):
+        boxes = self.streak.box_get_all_in_pipeline(self.pipeline.pipelineKey)
+        fields = self.streak.field_get_all_in_pipeline(self.pipeline.pipelineKey)
+        current = self.streak.value_get_all_in_box(boxes[0].boxKey)
+        updates = [(boxes[0].boxKey, value.key, value.value) for value in current]
+        updates += [(boxes[0].boxKey, fields[0].key, 'changed'), (boxes[1].boxKey, fields[0].key, 'changed'),
+                    ('wrong key', fields[0].key, 'changed')]
+        stats = self.streak.value_edit_many(updates, concurrency=4)
+        self.assertEqual(stats['updates'], len(updates))
+        self.assertEqual(stats['skipped'], len(current))
+        self.assertEqual(stats['written'], 2)
+        self.assertEqual(list(stats['errors']), [('wrong key', fields[0].key)])
+        self.assertEqual(self.streak.value_get_specific_in_box(boxes[1].boxKey, fields[0].key).value, 'changed')
+
+        cache = {boxes[1].boxKey: {fields[0].key: 'changed'}}
+        requests_before = self.server.request_count
+        stats = self.streak.value_edit_many([(boxes[1].boxKey, fields[0].key, 'changed')], cache)
+        self.assertEqual((stats['skipped'], self.server.request_count), (1, requests_before))
+
+    def test_pipeline_export_csv(self):
+        pip_key = self.pipeline.pipelineKey
+        field = self.streak.field_get_all_in_pipeline(pip_key)[0]
+        exporter = PipelineExporter(self.streak, pip_key, batch_size=2)
+        output = io.StringIO(newline='')
+        self.assertEqual(exporter.write_csv(output), 5)
+        self.assertEqual(exporter.stats['batches'], 3)
+
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        boxes = self.streak.box_get_all_in_pipeline(pip_key)
+        self.assertEqual([row['boxKey'] for row in rows], [box.boxKey for box in boxes])
+        self.assertEqual(rows[0][field.name], boxes[0].fields[field.key])
+        self.assertEqual(rows[0]['stage'], 'stage 0')
+
+    def test_box_store_follows_writes(self):
+        pip_key = self.pipeline.pipelineKey
+        stages = self.streak.stage_get_all_in_pipeline(pip_key)
+        field = self.streak.field_get_all_in_pipeline(pip_key)[0]
+        with BoxStore(self.streak, field_keys=[field.key]) as store:
+            self.assertEqual(store.load_pipeline(pip_key), 5)
+            self.assertEqual(store.count(stageKey=stages[0].key), 5)
+            box = store.find(order_by='creationTimestamp')[0]
+
+            self.streak.box_edit(box.boxKey, {'stageKey': stages[1].key})
+            self.streak.value_edit_in_box(box.boxKey, field.key, {'value': 'hot'})
+            found = store.find(stageKey=stages[1].key, fields={field.key: 'hot'},
+                               lastUpdatedTimestamp=(box.lastUpdatedTimestamp + 1, None))
+            self.assertEqual([found_box.boxKey for found_box in found], [box.boxKey])
+            self.assertEqual(store.count(stageKey=stages[0].key), 4)
+
+            new_box = self.streak.box_create(pip_key, {'name': 'new box'})
+            self.assertIn(new_box.boxKey, store)
+            self.streak.box_delete(new_box.boxKey)
+            self.assertNotIn(new_box.boxKey, store)
+            self.assertEqual(store.count(pipelineKey=pip_key), 5)
+        self.assertEqual(self.streak.hooks['box_written'], [])
+
+    def test_snapshot_round_trip(self):
+        pip_key = self.pipeline.pipelineKey
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'streak.snapshot')
+            stats = write_snapshot(self.streak, path, include_values=True)
+            self.assertEqual((stats['pipelines'], stats['boxes'], stats['values']), (1, 5, 5))
+            self.assertEqual(stats['bytes'], os.path.getsize(path))
+
+            boxes = self.streak.box_get_all_in_pipeline(pip_key)
+            with Snapshot(path, self.streak) as snapshot:
+                self.assertEqual(snapshot.pipeline_keys(), [pip_key])
+                self.assertEqual(snapshot.pipeline(pip_key).name, self.pipeline.name)
+                self.assertEqual(len(snapshot.stages(pip_key)), 3)
+                self.assertEqual([field.key for field in snapshot.fields(pip_key)],
+                                 [field.key for field in self.streak.field_get_all_in_pipeline(pip_key)])
+                self.assertEqual([box.boxKey for box in snapshot.boxes(pip_key)], [box.boxKey for box in boxes])
+                self.assertEqual(snapshot.box(boxes[2].boxKey).name, boxes[2].name)
+                self.assertEqual({value.key: value.value for value in snapshot.values(boxes[2].boxKey)},
+                                 boxes[2].fields)
+                self.assertIsNone(snapshot.box('wrong key'))
+                self.assertNotIn('wrong key', snapshot)
+
+                # rewriting the file while it is mapped leaves this snapshot readable
+                self.streak.box_edit(boxes[2].boxKey, {'name': 'renamed'})
+                write_snapshot(self.streak, path)
+                self.assertEqual(snapshot.box(boxes[2].boxKey).name, boxes[2].name)
+            with Snapshot(path) as snapshot:
+                self.assertEqual(snapshot.box(boxes[2].boxKey).name, 'renamed')
+
+            with self.assertRaises(StreakAPIError):
+                write_snapshot(self.streak, path, pipeline_keys=['wrong key'])
+            self.assertEqual(os.listdir(directory), ['streak.snapshot'])
+            with Snapshot(path) as snapshot:
+                self.assertEqual(snapshot.pipeline_keys(), [pip_key])
+
+    def test_cassette_record_and_replay(self):
+        pip_key = self.pipeline.pipelineKey
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'streak.cassette')
+            with Cassette(path, 'record') as cassette:
+                streak = StreakConnection(MOCK_API_KEY, api_endpoint=self.server.api_endpoint, cassette=cassette)
+                recorded = [box.boxKey for box in streak.iter_boxes_in_pipeline(pip_key)]
+                self.assertEqual(streak.box_edit(recorded[0], {'name': 'recorded'}).name, 'recorded')
+                self.assertEqual(cassette.count, 2)
+            self.server.stop()
+
+            with Cassette(path, 'replay') as cassette:
+                streak = StreakConnection('no key', api_endpoint='http://replay.invalid/api/v1/', cassette=cassette)
+                self.assertEqual([box.boxKey for box in streak.iter_boxes_in_pipeline(pip_key)], recorded)
+                self.assertEqual(streak.box_edit(recorded[0], {'name': 'recorded'}).name, 'recorded')
+                with self.assertRaises(StreakCassetteMiss):
+                    streak.box_edit(recorded[0], {'name': 'not recorded'})
+                self.assertEqual(streak.request_stats()['GET pipelines/%s/boxes']['count'], 1)
+
+            # bodies are matched in normal form, whatever JSON backend encoded them
+            with Cassette(path, 'replay') as cassette:
+                streak = StreakConnection('no key', api_endpoint='http://replay.invalid/api/v1/', cassette=cassette,
+                                          json_backend='json')
+                self.assertEqual(streak.box_edit(recorded[0], {'name': 'recorded'}).name, 'recorded')
+
+    def test_relationships_and_prefetch(self):
+        pip_key = self.pipeline.pipelineKey
+        box = self.streak.box_get_all_in_pipeline(pip_key)[0]
+        requests_before = self.server.request_count
+        self.assertEqual(box.stage.name, 'stage 0')
+        self.assertEqual(box.pipeline.name, self.pipeline.name)
+        self.assertEqual({value.key: value.value for value in box.values}, box.fields)
+        box.stage, box.pipeline, box.values
+        self.assertEqual(self.server.request_count - requests_before, 3)
+
+        stage = box.stage
+        self.assertEqual(len(stage.boxes), 5)
+        self.assertIs(stage.boxes[0].stage, stage)
+
+        boxes = self.streak.box_get_all_in_pipeline(pip_key)
+        requests_before = self.server.request_count
+        self.assertEqual(self.streak.prefetch(boxes, 'stage', 'values', 'pipeline'),
+                         {'stage': [], 'values': [], 'pipeline': []})
+        self.assertEqual(self.server.request_count - requests_before, 2 + len(boxes))
+        self.assertEqual([box.stage.name for box in boxes], ['stage 0'] * 5)
+        self.assertEqual(self.server.request_count - requests_before, 2 + len(boxes))
+
+    def test_edit_buffer_merges_edits(self):
+        pip_key = self.pipeline.pipelineKey
+        box = self.streak.box_get_all_in_pipeline(pip_key)[0]
+        field_keys = [field.key for field in self.streak.field_get_all_in_pipeline(pip_key)]
+        with self.streak.edit_buffer(max_delay=None) as buffer:
+            buffer.box_edit(box.boxKey, {'name': 'first'})
+            buffer.value_edit(box.boxKey, field_keys[0], 'warm')
+            buffer.box_edit(box.boxKey, {'notes': 'merged'})
+            buffer.value_edit(box.boxKey, field_keys[0], 'hot')
+            buffer.value_edit(box.boxKey, field_keys[1], 'other')
+            requests_before = self.server.request_count
+            results = buffer.flush()
+            self.assertEqual(self.server.request_count - requests_before, 3)
+            self.assertEqual(results[0].edits, [('box', {'name': 'first', 'notes': 'merged'}),
+                                                 (field_keys[0], {'value': 'hot'}),
+                                                 (field_keys[1], {'value': 'other'})])
+            self.assertEqual(buffer.stats()['merged'], 2)
+
+        box = self.streak.box_get(box.boxKey)
+        self.assertEqual((box.name, box.notes, box.fields[field_keys[0]]), ('first', 'merged', 'hot'))
+
+    def test_edit_buffer_flushes_in_background(self):
+        flushed = threading.Event()
+        results = []
+        box = self.streak.box_get_all_in_pipeline(self.pipeline.pipelineKey)[0]
+        with self.streak.edit_buffer(max_delay=0.05, callback=lambda result: (results.append(result), flushed.set())) \
+                as buffer:
+            buffer.box_edit('wrong key', {'name': 'lost'})
+            buffer.box_edit(box.boxKey, {'name': 'background'})
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(sorted(result.error is None for result in results), [False, True])
+        self.assertEqual(self.streak.box_get(box.boxKey).name, 'background')
+
+    def test_org_export_is_deterministic(self):
+        self.streak.pipeline_create({'name': 'empty pipeline'})
+        with tempfile.TemporaryDirectory() as directory:
+            outputs = []
+            for page_size, lookahead in ((2, None), (5, None), (None, None), (1, 1)):
+                path = os.path.join(directory, 'org-%s-%s.ndjson' % (page_size, lookahead))
+                stats = OrgExporter(MOCK_API_KEY, processes=2, page_size=page_size, max_workers=2, lookahead=lookahead,
+                                    api_endpoint=self.server.api_endpoint).export(path)
+                self.assertEqual((stats['pipelines'], stats['boxes'], stats['values_failed']), (2, 5, 0))
+                with open(path, 'rb') as export_file:
+                    outputs.append(export_file.read())
+            self.assertEqual(len(set(outputs)), 1)
+
+            lines = list(read_export(path))
+        self.assertEqual([line['type'] for line in lines].count('pipeline'), 2)
+        boxes = [line for line in lines if line['type'] == 'box']
+        self.assertEqual({value['key']: value['value'] for value in boxes[0]['values']}, boxes[0]['data']['fields'])
+
+        # limits are for the whole export, each worker process gets its share
+        exporter = OrgExporter(MOCK_API_KEY, processes=4, rate_limit=10, max_concurrency=6, read_timeout=5)
+        self.assertEqual(exporter.worker_settings, {'rate_limit': 2.5, 'max_concurrency': 1, 'read_timeout': 5})
+
+
+class TestResilienceAgainstMock(MockServerTestCase):
+    def test_server_errors_are_retried(self):
+        self.server.fail_next = 2
+        self.assertEqual(self.streak.user_get_me().email, 'robot@example.com')
+        self.assertEqual(self.streak.request_stats()['GET users/me']['statuses'], {503: 2, 200: 1})
+
+    def test_post_is_not_retried(self):
+        box = self.streak.box_get_all()[0]
+        self.server.fail_next = 1
+        with self.assertRaises(StreakHTTPError) as raised:
+            self.streak.box_edit(box.boxKey, {'name': 'changed'})
+        self.assertEqual(raised.exception.status_code, 503)
+
+    def test_throttled_requests_are_retried(self):
+        self.server.throttle_next = 2
+        self.assertEqual(self.streak.user_get_me().email, 'robot@example.com')
+        self.assertGreaterEqual(self.streak.throttle_stats()['throttled'], 2)
+
+    def test_deadline_covers_rate_limiter_waits(self):
+        # own api keys, so the pause and the rate limit do not slow down other tests
+        self.server.retry_after = 5
+        self.server.throttle_next = 1
+        throttled = StreakConnection('throttled key', api_endpoint=self.server.api_endpoint)
+        started = time.monotonic()
+        with self.assertRaises(StreakTimeoutError), throttled.deadline(0.5):
+            throttled.user_get_me()
+        self.assertLess(time.monotonic() - started, 1)
+
+        limited = StreakConnection('slow key', api_endpoint=self.server.api_endpoint, rate_limit=0.5)
+        limited.get_api_data('users/me')  # spends the only token
+        started = time.monotonic()
+        with self.assertRaises(StreakTimeoutError), limited.deadline(0.3):
+            limited.user_get_me()
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_limits_of_one_key_are_reconciled(self):
+        api_key = 'reconciled key'
+        self.assertIsNone(StreakConnection(api_key).throttle_stats()['rate'])
+        limited = StreakConnection(api_key, rate_limit=5, max_concurrency=2)
+        self.assertEqual((limited.throttle_stats()['rate'], limited.throttle_stats()['concurrency_limit']), (5, 2))
+        with self.assertLogs('streak_crm_python', 'WARNING'):
+            looser = StreakConnection(api_key, rate_limit=50, max_concurrency=8).throttle_stats()
+        self.assertEqual((looser['rate'], looser['max_concurrency']), (5, 2))
+        self.assertIs(StreakConnection(api_key).rate_limiter, limited.rate_limiter)
+
+    def test_identical_gets_are_coalesced(self):
+        self.server.latency = 0.2
+        pipeline_key = self.pipeline.pipelineKey
+        requests_before = self.server.request_count
+        pipelines = [pipeline for _, pipeline in
+                     map_concurrently(lambda _: self.streak.pipeline_get(pipeline_key), range(4), 4)]
+        self.assertEqual({pipeline.pipelineKey for pipeline in pipelines}, {pipeline_key})
+        self.assertEqual(len({id(pipeline) for pipeline in pipelines}), 4)
+        self.assertLess(self.server.request_count - requests_before, 4)
+        self.assertGreater(self.streak.single_flight.stats()['shared'], 0)
+
+
+class TestCommandLine(MockServerTestCase):
+    def run_main(self, *argv):
+        output = io.BytesIO()
+        status = main(list(argv) + ['--api-key', MOCK_API_KEY, '--api-endpoint', self.server.api_endpoint], output)
+        self.assertEqual(status, 0)
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_export_and_dump(self):
+        boxes = self.run_main('export', 'boxes', '--fields', 'boxKey,name', '--values', '--page-size', '2')
+        self.assertEqual([box['name'] for box in boxes], ['box %s' % number for number in range(5)])
+        self.assertEqual(sorted(boxes[0]), ['boxKey', 'name', 'values'])
+        self.assertEqual(len(boxes[0]['values']), 3)
+
+        lines = self.run_main('export', 'pipeline', self.pipeline.pipelineKey, '--values')
+        self.assertEqual([line['type'] for line in lines], ['pipeline'] + ['box'] * 5)
+        self.assertEqual(len(lines[0]['fields']), 3)
+        # same lines as OrgExporter writes
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'org.ndjson')
+            OrgExporter(MOCK_API_KEY, processes=1, api_endpoint=self.server.api_endpoint).export(path)
+            self.assertEqual(list(read_export(path)), lines)
+
+        schema = self.run_main('dump', 'schema')
+        self.assertEqual([stage['name'] for stage in schema[0]['stages']], ['stage 0', 'stage 1', 'stage 2'])
+
+    def test_sync(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stats = self.run_main('sync', os.path.join(directory, 'streak.sqlite'), '--concurrency', '2')
+        self.assertEqual((stats[0]['boxes'], stats[0]['changed']), (5, 5))
+
+
+class TestAsyncConnection(MockServerTestCase):
+    # own api key, its max_concurrency must not limit the connections of other tests
+    server_settings = {'boxes_per_pipeline': 5, 'api_keys': ('async key', MOCK_API_KEY)}
+
+    def test_max_concurrency_reaches_rate_limiter(self):
+        streak = AsyncStreakConnection('async key', max_concurrency=3, api_endpoint=self.server.api_endpoint)
+        self.assertEqual(streak.settings.max_concurrency, 3)
+        self.assertEqual(streak.streak_connection.throttle_stats()['max_concurrency'], 3)
+        asyncio.run(streak.close())
+
+    def test_bulk_methods_stay_within_max_concurrency(self):
+        pip_key = self.pipeline.pipelineKey
+        in_flight = [0, 0]
+        lock = threading.Lock()
+
+        def before(event):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+
+        def after(event):
+            with lock:
+                in_flight[0] -= 1
+
+        self.server.latency = 0.02
+
+        async def run():
+            async with AsyncStreakConnection('async key', max_concurrency=3,
+                                             api_endpoint=self.server.api_endpoint) as streak:
+                streak.streak_connection.add_hook('before', before)
+                streak.streak_connection.add_hook('after', after)
+                boxes, _ = await asyncio.gather(
+                    streak.box_create_many(pip_key, [{'name': 'lead %s' % number} for number in range(12)]),
+                    streak.user_get_me())
+                values = await streak.value_get_all_in_boxes([box.boxKey for box in boxes])
+                return streak.settings.max_concurrency, boxes, values
+
+        max_concurrency, boxes, values = asyncio.run(run())
+        self.assertEqual(max_concurrency, 3)
+        self.assertEqual(len(values), 12)
+        self.assertEqual([box.name for box in boxes], ['lead %s' % number for number in range(12)])
+        self.assertLessEqual(in_flight[1], 3)
+
+
+class TestShardedConnection(MockServerTestCase):
+    server_settings = {'boxes_per_pipeline': 5, 'api_keys': ('key-1', 'key-2', MOCK_API_KEY)}
+
+    def test_weighted_round_robin(self):
+        streak = ShardedStreakConnection(['key-1', 'key-2'], weights=[2, 1], api_endpoint=self.server.api_endpoint)
+        for _ in range(30):
+            streak.user_get_me()
+        self.assertEqual([shard['requests'] for shard in streak.shard_stats()], [20, 10])
+        self.assertEqual(streak.request_stats()['GET users/me']['count'], 30)
+
+        box_keys = [box.boxKey for box in streak.box_get_all()]
+        values = streak.value_get_all_in_boxes(box_keys, max_workers=4)
+        self.assertFalse([error for error in values.values() if isinstance(error, Exception)])
+
+    def test_refused_key_is_skipped(self):
+        streak = ShardedStreakConnection(['revoked key', MOCK_API_KEY], strategy='least_loaded', health_threshold=1,
+                                         api_endpoint=self.server.api_endpoint)
+        for _ in range(4):
+            self.assertEqual(streak.user_get_me().email, 'robot@example.com')
+        revoked, working = streak.shard_stats()
+        self.assertEqual((revoked['requests'], revoked['failures'], revoked['healthy']), (1, 1, False))
+        self.assertEqual((working['requests'], working['failures']), (4, 0))
+
+    def test_unexpected_errors_propagate(self):
+        streak = ShardedStreakConnection(['key-1', 'key-2'], api_endpoint='invalid://mock/api/v1/')
+        for _ in range(3):
+            with self.assertRaises(requests.exceptions.InvalidSchema):
+                streak.user_get_me()
+        self.assertEqual([shard['in_flight'] for shard in streak.shard_stats()], [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()